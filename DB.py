@@ -1,12 +1,42 @@
 from __future__ import annotations
 
+import logging
+import logging.handlers
+import os
+import pathlib
 import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
 from dataclasses import dataclass
 from datetime import datetime, date
-from typing import Iterable, Optional, Sequence
+from typing import Callable, Iterable, Iterator, Mapping, Optional, Sequence, Union
 
 DB_PATH = "elnajah.db"
 
+# Connection tuning. Change these before the first DB call if needed.
+CACHE_SIZE_KIB = 16 * 1024          # page cache per connection (PRAGMA cache_size)
+MMAP_SIZE = 64 * 1024 * 1024        # memory-mapped I/O window (PRAGMA mmap_size)
+STATEMENT_CACHE_SIZE = 128          # prepared statements kept per connection
+BUSY_TIMEOUT_MS = 5000              # wait this long for a lock before failing
+
+# Name searches of at least this many characters go through the FTS5 trigram
+# index (students_fts) when the file has one; shorter ones use plain LIKE.
+USE_FTS_SEARCH = True
+FTS_MIN_CHARS = 3
+
+# Rows fetched per query by the iter_* streaming functions.
+STREAM_PAGE_SIZE = 500
+
+# Filter combinations whose get_students_with_payment_for_month() result is
+# kept per thread (LRU). 0 turns the cache off.
+MONTH_VIEW_CACHE_SIZE = 32
+
+# Pages copied per backup() step (4 MiB with the default 4 KiB page size).
+BACKUP_STEP_PAGES = 1024
+
 
 # ---------------------------------------------------------------------------
 # Exceptions
@@ -28,38 +58,678 @@ class AlreadyExistsError(DBError):
 # Low-level helpers
 # ---------------------------------------------------------------------------
 
-def _get_conn(row_factory: bool = False) -> sqlite3.Connection:
+_local = threading.local()
+
+# DB_PATH -> whether that file has the students_fts table (see _has_name_index)
+_fts_present: dict[str, bool] = {}
+
+# Commits made through this module by any thread (see change_token). A
+# connection's own commits don't move its PRAGMA data_version.
+_write_count = 0
+_write_count_lock = threading.Lock()
+
+
+def _note_write() -> None:
+    global _write_count
+    with _write_count_lock:
+        _write_count += 1
+
+
+def _open_conn(path: str, readonly: bool = False) -> sqlite3.Connection:
     """
-    Return a new sqlite3 connection with foreign keys enabled.
+    Open and tune a new sqlite3 connection.
 
-    If row_factory is True we use sqlite3.Row so columns can be accessed by name.
+    WAL journaling with synchronous=NORMAL means a commit no longer waits for
+    an fsync of the main file, and readers never block the writer.
+    A readonly connection opens the file with mode=ro and leaves its journal
+    mode alone, so nothing is written to it (temp tables still work).
     """
-    conn = sqlite3.connect(DB_PATH)
-    if row_factory:
-        conn.row_factory = sqlite3.Row
+    if readonly:
+        uri = pathlib.Path(os.path.abspath(path)).as_uri() + "?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, cached_statements=STATEMENT_CACHE_SIZE)
+    else:
+        conn = sqlite3.connect(path, cached_statements=STATEMENT_CACHE_SIZE)
     # Make sure ON DELETE CASCADE etc. actually work
     conn.execute("PRAGMA foreign_keys = ON")
+    # Lets REPLACE fire DELETE triggers, so the summary triggers see the row
+    # it removes (see _migrate_4_payment_summary).
+    conn.execute("PRAGMA recursive_triggers = ON")
+    conn.execute(f"PRAGMA busy_timeout = {int(BUSY_TIMEOUT_MS)}")
+    if not readonly:
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA cache_size = -{int(CACHE_SIZE_KIB)}")
+    conn.execute(f"PRAGMA mmap_size = {int(MMAP_SIZE)}")
+    conn.create_function("duplicate_key", 1, _duplicate_key, deterministic=True)
     return conn
 
 
-def _today_str() -> str:
-    """Return today's date as YYYY-MM-DD."""
-    return date.today().strftime("%Y-%m-%d")
+def _db_path() -> str:
+    """The file this thread's DB calls go to: use_database()'s, else DB_PATH."""
+    return getattr(_local, "path", None) or DB_PATH
+
+
+@contextmanager
+def use_database(path: str, readonly: bool = False) -> Iterator[None]:
+    """
+    Point this thread's DB calls at path instead of DB_PATH for the block.
+
+        with DB.use_database("D:/branches/north.db"):
+            unpaid = DB.get_unpaid_students_for_month(2025, 1)
+
+    Other threads keep using DB_PATH, so this is safe next to the GUI and
+    AsyncDB workers (branches.Branches runs one of these per worker).
+    Blocks may nest. Call init_db() inside the block if the file may be new
+    or on an older schema.
+    readonly=True opens the file read-only (see _open_conn): queries work,
+    anything that writes to it raises sqlite3.OperationalError.
+    """
+    old = getattr(_local, "path", None), getattr(_local, "readonly", False)
+    _local.path, _local.readonly = path, readonly
+    try:
+        yield
+    finally:
+        _local.path, _local.readonly = old
+
+
+def _get_conn() -> sqlite3.Connection:
+    """
+    Return this thread's long-lived connection to its database file, opening
+    it on first use.
+
+    Connections are kept per thread (sqlite3 objects must not cross threads)
+    and per path, so changing DB_PATH at runtime opens a fresh one.
+    """
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    key = (_db_path(), getattr(_local, "readonly", False))
+    conn = conns.get(key)
+    if conn is None:
+        conn = conns[key] = _open_conn(*key)
+    return conn
+
+
+def close_connections() -> None:
+    """
+    Close this thread's cached connections.
+
+    Call this before replacing the database file on disk (e.g. restoring a
+    backup); the next DB call reopens the connection.
+    """
+    # A reopened connection counts data_version afresh; make sure no old
+    # change_token() compares equal to a new one.
+    _note_write()
+    _local.month_view = None
+    _fts_present.clear()
+    _invalidate_groups(all_paths=True)
+    conns = getattr(_local, "conns", None) or {}
+    while conns:
+        _key, conn = conns.popitem()
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+
+def checkpoint() -> None:
+    """Fold the WAL file back into the main database file."""
+    _get_conn().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+def change_token() -> tuple:
+    """
+    Return a token that changes whenever the database may have changed.
+
+        token = DB.change_token()
+        rows = DB.get_students_with_payment_for_month(...)
+        ...
+        if DB.change_token() == token:
+            pass  # rows are still current, no need to query again
+
+    Built from this thread's PRAGMA data_version, which moves when any
+    other connection commits (other threads, another running copy of the
+    app, a restore), and a counter of the commits made through this module,
+    which covers this connection's own writes. Inside transaction() the
+    connection's total_changes is added too, so writes not yet committed
+    change the token as well (and so does the commit or rollback that ends
+    the transaction). Costs one pragma that reads no pages. Only compare
+    tokens taken on the same thread, and take the token before the query it
+    guards.
+    """
+    conn = _get_conn()
+    version = conn.execute("PRAGMA data_version").fetchone()[0]
+    pending = conn.total_changes if conn.in_transaction else None
+    return (_db_path(), version, _write_count, pending)
 
 
 # ---------------------------------------------------------------------------
-# Schema management
+# Query instrumentation (opt-in)
 # ---------------------------------------------------------------------------
+#
+# enable_instrumentation() makes _session() hand out _TracedCursor instead of
+# a plain cursor. With it off, the only cost is one global lookup per call.
+# Statements run straight on the connection (pragmas, savepoints) are not
+# traced.
+
+@dataclass(slots=True)
+class QueryRecord:
+    """One traced statement."""
+    function: str        # DB function that ran it
+    sql: str             # whitespace-collapsed SQL text
+    params: str          # shape only, e.g. "(int, str)" or "500 x (int, int)"
+    rows: int            # rows fetched (SELECT) or changed (DML)
+    ms: float            # execute + fetch time
+
+
+def _params_shape(params) -> str:
+    if isinstance(params, dict):
+        return "{" + ", ".join(f"{k}: {type(v).__name__}" for k, v in params.items()) + "}"
+    return "(" + ", ".join(type(v).__name__ for v in params) + ")"
+
+
+def _format_plan(rows: list[tuple]) -> str:
+    """Indent EXPLAIN QUERY PLAN rows (id, parent, notused, detail) as a tree."""
+    depth = {0: -1}
+    lines = []
+    for node_id, parent, _notused, detail in rows:
+        depth[node_id] = depth.get(parent, -1) + 1
+        lines.append("  " * (depth[node_id] + 1) + detail)
+    return "\n".join(lines)
+
+
+class _Instrumentation:
+    """Settings and collected numbers for enable_instrumentation()."""
+
+    def __init__(self, slow_ms: float, log_path: Optional[str], max_bytes: int,
+                 backup_count: int, keep_last: int):
+        self.slow_ms = slow_ms
+        self.lock = threading.Lock()
+        self.stats: dict[str, dict] = {}
+        self.recent: deque[QueryRecord] = deque(maxlen=keep_last)
+        self.log = logging.getLogger("DB.slow_queries")
+        self.handler = None
+        if log_path:
+            self.handler = logging.handlers.RotatingFileHandler(
+                log_path, maxBytes=max_bytes, backupCount=backup_count,
+                encoding="utf-8", delay=True,
+            )
+            self.handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+            self.log.addHandler(self.handler)
+            self.log.setLevel(logging.INFO)
+            self.log.propagate = False
+
+    def close(self) -> None:
+        if self.handler is not None:
+            self.log.removeHandler(self.handler)
+            self.handler.close()
+
+    def begin_call(self, function: str) -> None:
+        with self.lock:
+            self._entry(function)["calls"] += 1
+
+    def _entry(self, function: str) -> dict:
+        entry = self.stats.get(function)
+        if entry is None:
+            entry = self.stats[function] = {
+                "calls": 0, "statements": 0, "rows": 0,
+                "total_ms": 0.0, "max_ms": 0.0, "slow": 0,
+            }
+        return entry
+
+    def record(self, conn: sqlite3.Connection, rec: QueryRecord, plan_params) -> None:
+        slow = rec.ms >= self.slow_ms
+        with self.lock:
+            self.recent.append(rec)
+            entry = self._entry(rec.function)
+            entry["statements"] += 1
+            entry["rows"] += rec.rows
+            entry["total_ms"] += rec.ms
+            entry["max_ms"] = max(entry["max_ms"], rec.ms)
+            entry["slow"] += slow
+        if slow and self.handler is not None:
+            try:
+                plan = _format_plan(
+                    conn.execute("EXPLAIN QUERY PLAN " + rec.sql, plan_params).fetchall()
+                )
+            except sqlite3.Error as e:
+                plan = f"  (no plan: {e})"
+            self.log.info(
+                "slow query %.1f ms in %s: %d rows, params %s\n  %s\n%s",
+                rec.ms, rec.function, rec.rows, rec.params, rec.sql, plan,
+            )
 
-def init_db() -> None:
+
+_instrumentation: Optional[_Instrumentation] = None
+
+
+class _TracedCursor(sqlite3.Cursor):
+    """Cursor that times each statement from execute() until the next one or close()."""
+
+    _function = "?"
+    _pending = None     # [sql, params_shape, plan_params, ms, fetched_rows]
+
+    def _finish(self) -> None:
+        pending, self._pending = self._pending, None
+        if pending is None:
+            return
+        sql, shape, plan_params, ms, fetched = pending
+        rows = fetched if self.description is not None else max(self.rowcount, 0)
+        inst = _instrumentation
+        if inst is not None:
+            inst.record(
+                self.connection,
+                QueryRecord(self._function, " ".join(sql.split()), shape, rows, ms),
+                plan_params,
+            )
+
+    def execute(self, sql, parameters=(), /):
+        self._finish()
+        t0 = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._pending = [sql, _params_shape(parameters), parameters,
+                             (time.perf_counter() - t0) * 1000, 0]
+
+    def executemany(self, sql, seq_of_parameters, /):
+        self._finish()
+        seq = list(seq_of_parameters)
+        shape = f"{len(seq)} x {_params_shape(seq[0])}" if seq else "0 x ()"
+        t0 = time.perf_counter()
+        try:
+            return super().executemany(sql, seq)
+        finally:
+            self._pending = [sql, shape, seq[0] if seq else (),
+                             (time.perf_counter() - t0) * 1000, 0]
+
+    def _fetched(self, t0: float, n: int) -> None:
+        if self._pending is not None:
+            self._pending[3] += (time.perf_counter() - t0) * 1000
+            self._pending[4] += n
+
+    def fetchone(self):
+        t0 = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(t0, row is not None)
+        return row
+
+    def fetchmany(self, size=None):
+        t0 = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(t0, len(rows))
+        return rows
+
+    def fetchall(self):
+        t0 = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(t0, len(rows))
+        return rows
+
+    def __next__(self):
+        t0 = time.perf_counter()
+        row = super().__next__()
+        self._fetched(t0, 1)
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+
+def enable_instrumentation(
+    slow_ms: float = 100.0,
+    log_path: Optional[str] = "slow_queries.log",
+    max_bytes: int = 1_000_000,
+    backup_count: int = 3,
+    keep_last: int = 500,
+) -> None:
     """
-    Create all tables if they do not exist.
+    Start tracing every statement run through the DB functions.
 
-    Call this once when your program starts (before using any other function).
+    For each statement we record the SQL, the shape of its parameters (types
+    only, never values), the row count and the wall time; see
+    recent_queries() and get_query_stats(). Statements taking at least
+    slow_ms are written to log_path (rotated at max_bytes, keeping
+    backup_count old files) together with their EXPLAIN QUERY PLAN.
+    Pass log_path=None to collect numbers without a log file.
+
+    Setting the environment variable ELNAJAH_DB_SLOW_MS turns this on at
+    import time with that threshold.
+    """
+    global _instrumentation
+    disable_instrumentation()
+    _instrumentation = _Instrumentation(slow_ms, log_path, max_bytes, backup_count, keep_last)
+
+
+def disable_instrumentation() -> None:
+    """Stop tracing and close the slow-query log. Collected numbers are dropped."""
+    global _instrumentation
+    inst, _instrumentation = _instrumentation, None
+    if inst is not None:
+        inst.close()
+
+
+def get_query_stats() -> dict[str, dict]:
+    """
+    Return per-function counters since instrumentation was enabled (or reset).
+
+    {function: {"calls", "statements", "rows", "total_ms", "max_ms", "slow"}}
+    Empty if instrumentation is off.
+    """
+    inst = _instrumentation
+    if inst is None:
+        return {}
+    with inst.lock:
+        return {name: dict(entry) for name, entry in inst.stats.items()}
+
+
+def reset_query_stats() -> None:
+    """Zero the per-function counters and forget the recent statements."""
+    inst = _instrumentation
+    if inst is not None:
+        with inst.lock:
+            inst.stats.clear()
+            inst.recent.clear()
+
+
+def recent_queries() -> list[QueryRecord]:
+    """Return the most recent traced statements, oldest first."""
+    inst = _instrumentation
+    if inst is None:
+        return []
+    with inst.lock:
+        return list(inst.recent)
+
+
+def format_query_stats() -> str:
+    """Return get_query_stats() as a text table, slowest functions first."""
+    stats = get_query_stats()
+    lines = [
+        f"{'function':<40} {'calls':>7} {'stmts':>7} {'rows':>9} "
+        f"{'total ms':>10} {'max ms':>9} {'slow':>5}"
+    ]
+    for name, s in sorted(stats.items(), key=lambda kv: -kv[1]["total_ms"]):
+        lines.append(
+            f"{name:<40} {s['calls']:>7} {s['statements']:>7} {s['rows']:>9} "
+            f"{s['total_ms']:>10.1f} {s['max_ms']:>9.1f} {s['slow']:>5}"
+        )
+    return "\n".join(lines)
+
+
+def _tx_depths() -> dict[str, int]:
+    """Return this thread's {DB_PATH: open transaction() depth} map."""
+    depths = getattr(_local, "tx_depths", None)
+    if depths is None:
+        depths = _local.tx_depths = {}
+    return depths
+
+
+@contextmanager
+def _savepoint(conn: sqlite3.Connection, depth: int) -> Iterator[None]:
+    """Release the savepoint if the block succeeds, roll back to it if it raises."""
+    name = f"sp{depth}"
+    conn.execute(f"SAVEPOINT {name}")
+    try:
+        yield
+    except BaseException:
+        # Some errors (e.g. SQLITE_FULL) make SQLite abort the whole
+        # transaction, taking the savepoint with it.
+        if conn.in_transaction:
+            conn.execute(f"ROLLBACK TO {name}")
+            conn.execute(f"RELEASE {name}")
+        raise
+    else:
+        conn.execute(f"RELEASE {name}")
+
+
+@contextmanager
+def transaction() -> Iterator[None]:
+    """
+    Run several DB calls as one unit of work with a single commit.
+
+        with DB.transaction():
+            sid = DB.create_student(name)
+            DB.set_student_groups(sid, groups)
+            DB.upsert_payment(sid, year, month, "paid")
+
+    Every DB function called inside the block on this thread joins the
+    transaction instead of committing on its own. Each call still runs in a
+    savepoint, so a call that raises undoes only its own changes and the
+    caller may catch the error and carry on. If the block itself raises,
+    everything is rolled back. Nested transaction() blocks become savepoints
+    of the outermost one.
+    """
+    conn = _get_conn()
+    depths = _tx_depths()
+    path = _db_path()
+    depth = depths.get(path, 0)
+    depths[path] = depth + 1
+    try:
+        if depth:
+            with _savepoint(conn, depth):
+                yield
+            return
+
+        # IMMEDIATE takes the write lock up front, so a busy database fails
+        # (after busy_timeout) before any work is done rather than at commit.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            conn.rollback()
+            # The rolled-back writes never moved data_version.
+            _invalidate_groups()
+            raise
+        else:
+            conn.commit()
+            _note_write()
+    finally:
+        depths[path] = depth
+
+
+def _public_caller() -> str:
+    """
+    Name of the public DB function a _session() is opened for, so helpers
+    shared by several functions (e.g. _unpaid_students) charge their
+    statements to each caller rather than to themselves.
+    """
+    # frame 0 is this function, 1 _session, 2 contextlib's __enter__, 3 the caller
+    caller = frame = sys._getframe(3)
+    while frame is not None:
+        if frame.f_globals is globals() and not frame.f_code.co_name.startswith("_"):
+            return frame.f_code.co_name
+        frame = frame.f_back
+    return caller.f_code.co_name
+
+
+@contextmanager
+def _session(
+    row_factory: Union[bool, Callable] = False,
+) -> Iterator[sqlite3.Cursor]:
+    """
+    Yield a cursor on the shared connection.
+
+    Commits if the block finishes normally and rolls back if it raises, so a
+    failed call never leaves a half-finished transaction on the connection.
+    Inside transaction() the block runs in a savepoint instead and the commit
+    is left to the outermost transaction() block.
+    If row_factory is True we use sqlite3.Row so columns can be accessed by name;
+    a callable is installed as the cursor's row factory as-is.
     """
     conn = _get_conn()
-    c = conn.cursor()
+    inst = _instrumentation
+    if inst is None:
+        c = conn.cursor()
+    else:
+        c = conn.cursor(_TracedCursor)
+        c._function = _public_caller()
+        inst.begin_call(c._function)
+    if row_factory is True:
+        c.row_factory = sqlite3.Row
+    elif row_factory:
+        c.row_factory = row_factory
+    depth = _tx_depths().get(_db_path(), 0)
+    try:
+        if depth:
+            with _savepoint(conn, depth):
+                yield c
+            return
+        try:
+            yield c
+        except BaseException:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        else:
+            if conn.in_transaction:
+                conn.commit()
+                _note_write()
+    finally:
+        c.close()
+
+
+def _has_name_index() -> bool:
+    """Return True if the current file has the students_fts search table."""
+    path = _db_path()
+    found = _fts_present.get(path)
+    if found is None:
+        row = _get_conn().execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'students_fts'"
+        ).fetchone()
+        found = _fts_present[path] = row is not None
+    return found
+
+
+def _group_ids(c: sqlite3.Cursor) -> dict[str, int]:
+    """
+    Return {group name: id} for every group, ordered by name, from the cache.
+
+    The cache lives next to this thread's connection and is tagged with that
+    connection's PRAGMA data_version, which changes whenever another
+    connection (another thread or process) commits. So the only statement a
+    cache hit costs is that pragma, which reads no pages. Writes made through
+    this connection don't move data_version; functions that add or remove
+    groups call _invalidate_groups() instead.
+
+    Treat the returned dict as read-only.
+    """
+    version = c.execute("PRAGMA data_version").fetchone()[0]
+    cache = getattr(_local, "groups", None)
+    if cache is None:
+        cache = _local.groups = {}
+    path = _db_path()
+    entry = cache.get(path)
+    if entry is not None and entry[0] == version:
+        return entry[1]
+
+    c.execute("SELECT name, id FROM groups ORDER BY name")
+    ids = dict(c.fetchall())
+    cache[path] = (version, ids)
+    return ids
+
+
+def _invalidate_groups(all_paths: bool = False) -> None:
+    """Drop this thread's cached group table (for DB_PATH, or for every path)."""
+    cache = getattr(_local, "groups", None)
+    if not cache:
+        return
+    if all_paths:
+        cache.clear()
+    else:
+        cache.pop(_db_path(), None)
+
+
+def _ensure_group_ids(c: sqlite3.Cursor, names: Iterable[str]) -> list[int]:
+    """
+    Return the ids of the named groups, creating any that don't exist yet.
+
+    Known names are answered from the cache; only new ones cost SQL.
+    """
+    known = _group_ids(c)
+    gids = []
+    for gname in names:
+        gid = known.get(gname)
+        if gid is None:
+            # Invalidate before writing: nothing refills the cache on this
+            # connection until the transaction ends, and the next fill then
+            # sees the committed (or rolled back) state.
+            _invalidate_groups()
+            c.execute("INSERT OR IGNORE INTO groups (name) VALUES (?)", (gname,))
+            c.execute("SELECT id FROM groups WHERE name = ?", (gname,))
+            gid = c.fetchone()[0]
+        gids.append(gid)
+    return gids
+
+
+def _name_filter(search_text: str, alias: str = "s") -> tuple[str, str]:
+    """
+    Return (sql, param) matching students whose name contains search_text.
+
+    Long enough terms are answered from the trigram index; the FTS5 trigram
+    tokenizer implements LIKE itself, so both paths match exactly the same
+    rows (case-insensitive substring).
+    """
+    pattern = f"%{search_text}%"
+    if USE_FTS_SEARCH and len(search_text) >= FTS_MIN_CHARS and _has_name_index():
+        return (
+            f"{alias}.id IN (SELECT rowid FROM students_fts WHERE name LIKE ?)",
+            pattern,
+        )
+    return f"{alias}.name LIKE ?", pattern
+
+
+# Keyset condition "(name COLLATE NOCASE, id) > (?, ?)". The leading >= term
+# lets SQLite seek into idx_students_name_nocase instead of scanning from the
+# start; params are (name, name, id).
+_KEYSET_AFTER_SQL = (
+    "s.name COLLATE NOCASE >= ? AND (s.name COLLATE NOCASE > ? OR s.id > ?)"
+)
+
+
+def _id_table(c: sqlite3.Cursor, ids: Iterable[int], name: str = "ids") -> str:
+    """
+    Load ids into the temp table temp.<name> (one column: id) and return
+    its qualified name, for statements to join or "IN (SELECT id ...)" on.
+
+    Used instead of "IN (?, ?, ...)" lists, which fail past SQLite's bound
+    variable limit and get re-parsed by every statement that repeats them.
+    The table lives on the connection and is refilled on each call.
+
+    SQLite has no statistics for the table, so joins should name it first
+    with CROSS JOIN to keep it on the outer side of the loop.
+    """
+    conn = c.connection
+    outside_transaction = not conn.in_transaction
+    table = f"temp.{name}"
+    c.execute(f"CREATE TEMP TABLE IF NOT EXISTS {name} (id INTEGER PRIMARY KEY)")
+    c.execute(f"DELETE FROM {table}")
+    c.executemany(f"INSERT OR IGNORE INTO {table} (id) VALUES (?)", ((i,) for i in ids))
+    if outside_transaction:
+        # Only temp.<name> changed so far. Committing that on its own keeps
+        # _session() from counting a read that used the table as a write
+        # (see change_token).
+        conn.commit()
+    return table
+
+
+def _missing_student_ids(c: sqlite3.Cursor, table: str) -> list[int]:
+    """Return the IDs in an _id_table() that have no student, sorted."""
+    c.execute(f"SELECT id FROM {table} WHERE id NOT IN (SELECT id FROM students) ORDER BY id")
+    return [r[0] for r in c.fetchall()]
+
+
+def _today_str() -> str:
+    """Return today's date as YYYY-MM-DD."""
+    return date.today().strftime("%Y-%m-%d")
+
+
+# ---------------------------------------------------------------------------
+# Schema management
+# ---------------------------------------------------------------------------
 
+def _migrate_1_base_tables(c: sqlite3.Cursor) -> None:
+    """Create the original tables (no-op on files that already have them)."""
     # Students table
     c.execute(
         """
@@ -111,28 +781,443 @@ def init_db() -> None:
         """
     )
 
-    conn.commit()
-    conn.close()
+
+def _migrate_2_indexes(c: sqlite3.Cursor) -> None:
+    """Secondary indexes for the group, month and name-ordered queries."""
+    # get_group_students / group filters look students up by group
+    c.execute(
+        "CREATE INDEX IF NOT EXISTS idx_student_group_group ON student_group(group_id)"
+    )
+    # month views and unpaid reports filter on (year, month, paid)
+    c.execute(
+        "CREATE INDEX IF NOT EXISTS idx_payments_year_month_paid "
+        "ON payments(year, month, paid)"
+    )
+    # get_all_students() and name searches order by name COLLATE NOCASE
+    c.execute(
+        "CREATE INDEX IF NOT EXISTS idx_students_name_nocase "
+        "ON students(name COLLATE NOCASE)"
+    )
+
+
+def _migrate_3_name_search(c: sqlite3.Cursor) -> None:
+    """
+    FTS5 trigram index over students.name, kept in sync by triggers.
+
+    Skipped when this SQLite build has no FTS5 / trigram tokenizer (needs
+    3.34+); name searches then keep using LIKE on the students table.
+    """
+    try:
+        c.execute(
+            """
+            CREATE VIRTUAL TABLE IF NOT EXISTS students_fts USING fts5(
+                name,
+                content='students',
+                content_rowid='id',
+                tokenize='trigram'
+            )
+            """
+        )
+    except sqlite3.OperationalError:
+        return
+
+    c.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS students_fts_ai AFTER INSERT ON students BEGIN
+            INSERT INTO students_fts (rowid, name) VALUES (new.id, new.name);
+        END
+        """
+    )
+    c.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS students_fts_ad AFTER DELETE ON students BEGIN
+            INSERT INTO students_fts (students_fts, rowid, name)
+            VALUES ('delete', old.id, old.name);
+        END
+        """
+    )
+    c.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS students_fts_au AFTER UPDATE OF id, name ON students BEGIN
+            INSERT INTO students_fts (students_fts, rowid, name)
+            VALUES ('delete', old.id, old.name);
+            INSERT INTO students_fts (rowid, name) VALUES (new.id, new.name);
+        END
+        """
+    )
+    # index the names that already exist
+    c.execute("INSERT INTO students_fts (students_fts) VALUES ('rebuild')")
+
+
+# group_id used in payment_summary / group_member_counts for "every student"
+# (real group ids start at 1).
+_ALL_STUDENTS = 0
+
+
+# The trigger bodies below guard their INSERTs with NOT EXISTS rather than
+# INSERT OR IGNORE: inside a trigger, the outer statement's conflict clause
+# (REPLACE, an upsert, ...) overrides the one written in the body.
+
+def _summary_payment_sql(ref: str, sign: str) -> str:
+    """Trigger statements adding (sign '+') or removing ('-') payment row ref."""
+    sql = ""
+    if sign == "+":
+        sql += f"""
+            INSERT INTO payment_summary (year, month, group_id)
+            SELECT {ref}.year, {ref}.month, t.group_id
+            FROM (
+                SELECT {_ALL_STUDENTS} AS group_id
+                UNION ALL
+                SELECT group_id FROM student_group WHERE student_id = {ref}.student_id
+            ) AS t
+            WHERE NOT EXISTS (
+                SELECT 1 FROM payment_summary ps
+                WHERE ps.year = {ref}.year AND ps.month = {ref}.month
+                  AND ps.group_id = t.group_id
+            );
+        """
+    return sql + f"""
+        UPDATE payment_summary
+        SET paid = paid {sign} ({ref}.paid = 'paid'),
+            unpaid = unpaid {sign} ({ref}.paid = 'unpaid')
+        WHERE year = {ref}.year AND month = {ref}.month
+          AND (group_id = {_ALL_STUDENTS} OR group_id IN (
+              SELECT group_id FROM student_group WHERE student_id = {ref}.student_id
+          ));
+    """
+
+
+def _summary_link_sql(ref: str, sign: str) -> str:
+    """Trigger statements adding (sign '+') or removing ('-') membership row ref."""
+    sql = ""
+    if sign == "+":
+        sql += f"""
+            INSERT INTO payment_summary (year, month, group_id)
+            SELECT p.year, p.month, {ref}.group_id
+            FROM payments p
+            WHERE p.student_id = {ref}.student_id
+              AND NOT EXISTS (
+                  SELECT 1 FROM payment_summary ps
+                  WHERE ps.year = p.year AND ps.month = p.month
+                    AND ps.group_id = {ref}.group_id
+              );
+            INSERT INTO group_member_counts (group_id)
+            SELECT {ref}.group_id
+            WHERE NOT EXISTS (
+                SELECT 1 FROM group_member_counts WHERE group_id = {ref}.group_id
+            );
+        """
+    # (student_id, year, month) is unique, so each summary row matched below
+    # has exactly one payment row of this student behind it.
+    return sql + f"""
+        UPDATE payment_summary
+        SET paid = paid {sign} (
+                SELECT p.paid = 'paid' FROM payments p
+                WHERE p.student_id = {ref}.student_id
+                  AND p.year = payment_summary.year AND p.month = payment_summary.month
+            ),
+            unpaid = unpaid {sign} (
+                SELECT p.paid = 'unpaid' FROM payments p
+                WHERE p.student_id = {ref}.student_id
+                  AND p.year = payment_summary.year AND p.month = payment_summary.month
+            )
+        WHERE group_id = {ref}.group_id
+          AND (year, month) IN (
+              SELECT year, month FROM payments WHERE student_id = {ref}.student_id
+          );
+        UPDATE group_member_counts SET members = members {sign} 1
+        WHERE group_id = {ref}.group_id;
+    """
+
+
+def _fill_payment_summary(c: sqlite3.Cursor) -> None:
+    """Recompute payment_summary and group_member_counts from the base tables."""
+    c.execute("DELETE FROM payment_summary")
+    c.execute("DELETE FROM group_member_counts")
+    c.execute(
+        f"""
+        INSERT INTO payment_summary (year, month, group_id, paid, unpaid)
+        SELECT year, month, {_ALL_STUDENTS}, SUM(paid = 'paid'), SUM(paid = 'unpaid')
+        FROM payments
+        GROUP BY year, month
+        """
+    )
+    c.execute(
+        """
+        INSERT INTO payment_summary (year, month, group_id, paid, unpaid)
+        SELECT p.year, p.month, sg.group_id, SUM(p.paid = 'paid'), SUM(p.paid = 'unpaid')
+        FROM payments p
+        JOIN student_group sg ON sg.student_id = p.student_id
+        GROUP BY p.year, p.month, sg.group_id
+        """
+    )
+    c.execute(
+        f"""
+        INSERT INTO group_member_counts (group_id, members)
+        SELECT {_ALL_STUDENTS}, COUNT(*) FROM students
+        UNION ALL
+        SELECT g.id, COUNT(sg.student_id)
+        FROM groups g
+        LEFT JOIN student_group sg ON sg.group_id = g.id
+        GROUP BY g.id
+        """
+    )
+
+
+def _migrate_4_payment_summary(c: sqlite3.Cursor) -> None:
+    """
+    Trigger-maintained counts for reports.
+
+    payment_summary holds, per (year, month, group_id), how many of the
+    group's current members have a 'paid' / 'unpaid' row that month.
+    group_member_counts holds each group's size. Membership doesn't depend
+    on the month, so it lives in its own table; otherwise every join or
+    leave would have to touch one row per month. group_id 0 stands for the
+    whole school (each student counted once).
+    """
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS payment_summary (
+            year INTEGER NOT NULL,
+            month INTEGER NOT NULL,
+            group_id INTEGER NOT NULL,
+            paid INTEGER NOT NULL DEFAULT 0,
+            unpaid INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (year, month, group_id)
+        ) WITHOUT ROWID
+        """
+    )
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS group_member_counts (
+            group_id INTEGER PRIMARY KEY,
+            members INTEGER NOT NULL DEFAULT 0
+        )
+        """
+    )
+
+    triggers = {
+        "summary_payments_ai": (
+            "AFTER INSERT ON payments",
+            _summary_payment_sql("new", "+"),
+        ),
+        "summary_payments_ad": (
+            "AFTER DELETE ON payments",
+            _summary_payment_sql("old", "-"),
+        ),
+        "summary_payments_au": (
+            "AFTER UPDATE OF student_id, year, month, paid ON payments",
+            _summary_payment_sql("old", "-") + _summary_payment_sql("new", "+"),
+        ),
+        "summary_student_group_ai": (
+            "AFTER INSERT ON student_group",
+            _summary_link_sql("new", "+"),
+        ),
+        "summary_student_group_ad": (
+            "AFTER DELETE ON student_group",
+            _summary_link_sql("old", "-"),
+        ),
+        "summary_student_group_au": (
+            "AFTER UPDATE OF student_id, group_id ON student_group",
+            _summary_link_sql("old", "-") + _summary_link_sql("new", "+"),
+        ),
+        "summary_students_ai": (
+            "AFTER INSERT ON students",
+            f"UPDATE group_member_counts SET members = members + 1 "
+            f"WHERE group_id = {_ALL_STUDENTS};",
+        ),
+        "summary_students_ad": (
+            "AFTER DELETE ON students",
+            f"UPDATE group_member_counts SET members = members - 1 "
+            f"WHERE group_id = {_ALL_STUDENTS};",
+        ),
+        "summary_groups_ai": (
+            "AFTER INSERT ON groups",
+            "INSERT INTO group_member_counts (group_id) SELECT new.id "
+            "WHERE NOT EXISTS (SELECT 1 FROM group_member_counts WHERE group_id = new.id);",
+        ),
+        "summary_groups_ad": (
+            "AFTER DELETE ON groups",
+            "DELETE FROM payment_summary WHERE group_id = old.id;"
+            "DELETE FROM group_member_counts WHERE group_id = old.id;",
+        ),
+    }
+    for name, (event, body) in triggers.items():
+        c.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {body} END")
+
+    _fill_payment_summary(c)
+
+
+def _unix_ms_sql(julian_day: str) -> str:
+    """SQL turning a julianday() expression into Unix time in milliseconds."""
+    return f"CAST(ROUND(({julian_day} - 2440587.5) * 86400000) AS INTEGER)"
+
+
+# payment_events.ts of the event being written. Stored as Unix ms (UTC):
+# an integer keeps the table and both of its indexes far smaller than a
+# date string would.
+_EVENT_TS_SQL = _unix_ms_sql("julianday('now')")
+
+
+def _payment_event_sql(ref: str, deleted: bool = False, where: str = "") -> str:
+    """
+    Trigger statement appending payment row ref to payment_events, or its
+    removal if deleted; only when the SQL condition where holds, if given.
+    """
+    paid, payment_date = ("NULL", "NULL") if deleted else (f"{ref}.paid", f"{ref}.payment_date")
+    return f"""
+        INSERT INTO payment_events (ts, student_id, year, month, paid, payment_date)
+        SELECT {_EVENT_TS_SQL}, {ref}.student_id, {ref}.year, {ref}.month,
+               {paid}, {payment_date}
+        {"WHERE " + where if where else ""};
+    """
+
+
+def _migrate_5_payment_events(c: sqlite3.Cursor) -> None:
+    """
+    Append-only history of every payment change, written by triggers.
+
+    Each insert or change of a payments row appends its new (paid,
+    payment_date); a delete appends paid = NULL. student_id has no foreign
+    key, so the history outlives deleted students. The status of a month
+    as of any moment is then the newest event at or before it (see
+    get_unpaid_students_as_of).
+
+    Existing payments are seeded as one event each, dated at (local)
+    midnight of their payment_date: the best known time they took effect.
+    """
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS payment_events (
+            id INTEGER PRIMARY KEY,          -- append order
+            ts INTEGER NOT NULL,             -- Unix time in ms (UTC)
+            student_id INTEGER NOT NULL,
+            year INTEGER NOT NULL,
+            month INTEGER NOT NULL,
+            paid TEXT CHECK(paid IN ('paid', 'unpaid')),  -- NULL: record deleted
+            payment_date TEXT
+        )
+        """
+    )
+    # as-of views of one month, and one student's history
+    c.execute(
+        "CREATE INDEX IF NOT EXISTS idx_payment_events_month "
+        "ON payment_events(year, month, ts)"
+    )
+    c.execute(
+        "CREATE INDEX IF NOT EXISTS idx_payment_events_student "
+        "ON payment_events(student_id, ts)"
+    )
+
+    key_changed = (
+        "old.student_id IS NOT new.student_id OR old.year IS NOT new.year "
+        "OR old.month IS NOT new.month"
+    )
+    triggers = {
+        "payment_events_payments_ai": ("AFTER INSERT ON payments", _payment_event_sql("new")),
+        "payment_events_payments_ad": (
+            "AFTER DELETE ON payments",
+            _payment_event_sql("old", deleted=True),
+        ),
+        # Saving a month unchanged (the edit modal re-saves all twelve)
+        # records nothing.
+        "payment_events_payments_au": (
+            "AFTER UPDATE OF student_id, year, month, paid, payment_date ON payments "
+            f"WHEN {key_changed} OR old.paid IS NOT new.paid "
+            "OR old.payment_date IS NOT new.payment_date",
+            # a changed key moves the record: the old month loses it
+            _payment_event_sql("old", deleted=True, where=key_changed)
+            + _payment_event_sql("new"),
+        ),
+        "payment_events_no_update": (
+            "BEFORE UPDATE ON payment_events",
+            "SELECT RAISE(ABORT, 'payment_events is append-only');",
+        ),
+        "payment_events_no_delete": (
+            "BEFORE DELETE ON payment_events",
+            "SELECT RAISE(ABORT, 'payment_events is append-only');",
+        ),
+    }
+    for name, (event, body) in triggers.items():
+        c.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {event} BEGIN {body} END")
+
+    c.execute(
+        f"""
+        INSERT INTO payment_events (ts, student_id, year, month, paid, payment_date)
+        SELECT COALESCE({_unix_ms_sql("julianday(payment_date, 'utc')")}, {_EVENT_TS_SQL}),
+               student_id, year, month, paid, payment_date
+        FROM payments
+        WHERE NOT EXISTS (SELECT 1 FROM payment_events)
+        ORDER BY 1, id
+        """
+    )
+
+
+# Step N upgrades a file from PRAGMA user_version N-1 to N.
+# Only ever append to this list; never change a step that has shipped.
+_MIGRATIONS = [
+    _migrate_1_base_tables,
+    _migrate_2_indexes,
+    _migrate_3_name_search,
+    _migrate_4_payment_summary,
+    _migrate_5_payment_events,
+]
+
+SCHEMA_VERSION = len(_MIGRATIONS)
+
+
+def get_schema_version() -> int:
+    """Return the schema version stored in the database file."""
+    return _get_conn().execute("PRAGMA user_version").fetchone()[0]
+
+
+def init_db() -> None:
+    """
+    Create the tables or upgrade an older file to SCHEMA_VERSION.
+
+    Call this once when your program starts (before using any other function).
+    When the file is already current this is a single PRAGMA read and no DDL
+    runs at all.
+    """
+    if get_schema_version() >= SCHEMA_VERSION:
+        return
+
+    for target in range(1, SCHEMA_VERSION + 1):
+        with _session() as c:
+            # take the write lock first so two app instances cannot both migrate
+            c.execute("BEGIN IMMEDIATE")
+            current = c.execute("PRAGMA user_version").fetchone()[0]
+            if current >= target:
+                continue
+            _MIGRATIONS[target - 1](c)
+            c.execute(f"PRAGMA user_version = {target}")
+    _fts_present.pop(_db_path(), None)
+    _invalidate_groups()
 
 
 # ---------------------------------------------------------------------------
 # Dataclasses used as return types (optional, but nice)
 # ---------------------------------------------------------------------------
+#
+# All record types use __slots__: full-roster loads create one of these per
+# row, and a slotted instance is a fraction of the size of one with a __dict__
+# (or of a dict with string keys). Field order matches the SELECT column order
+# so the row factories below can build them straight from the row tuple.
 
-@dataclass
+@dataclass(slots=True)
 class Student:
     id: int
     name: str
     join_date: str  # YYYY-MM-DD
 
 
-@dataclass
+@dataclass(slots=True)
 class Group:
     id: int
     name: str
 
 
-@dataclass
+@dataclass(slots=True)
 class Payment:
     id: int
     student_id: int
@@ -142,19 +1227,74 @@ class Payment:
     payment_date: str    # 'YYYY-MM-DD'
 
 
-# ---------------------------------------------------------------------------
-# Student operations
-# ---------------------------------------------------------------------------
+@dataclass(slots=True)
+class PaymentEvent:
+    """One change to a payment record (see get_payment_events)."""
+    id: int
+    ts: str                       # local time 'YYYY-MM-DD HH:MM:SS'
+    student_id: int
+    year: int
+    month: int
+    paid: Optional[str]           # 'paid' | 'unpaid' | None (record deleted)
+    payment_date: Optional[str]
 
-def create_student(
-    name: str,
-    join_date: Optional[str] = None,
-    student_id: Optional[int] = None,
-) -> int:
-    """
-    Create a new student.
 
-    If student_id is provided we try to insert with that ID (manual IDs).
+@dataclass(slots=True)
+class MonthViewRow:
+    """One row of the main tree view (see get_students_with_payment_for_month)."""
+    id: int
+    name: str
+    join_date: str
+    groups: str              # 'G1, G2, ...'
+    monthly_payment: str     # 'Paid (YYYY-MM-DD)' | 'Unpaid' | 'No record'
+
+
+@dataclass(slots=True)
+class PaymentMatrixRow:
+    """One student's academic year (see get_payment_matrix)."""
+    id: int
+    name: str
+    join_date: str
+    groups: str              # 'G1, G2, ...'
+    months: tuple            # 12 x ('paid' | 'unpaid' | None), Aug..Jul
+
+
+def _record_factory(cls) -> Callable:
+    """Return a cursor row factory that builds cls directly from the row tuple."""
+    def factory(_cursor, row):
+        return cls(*row)
+    return factory
+
+
+_as_student = _record_factory(Student)
+_as_payment = _record_factory(Payment)
+_as_month_view_row = _record_factory(MonthViewRow)
+_as_payment_event = _record_factory(PaymentEvent)
+
+
+# sqlite3 hands back a fresh str for every cell; mapping them onto shared
+# constants keeps a 12-month matrix from holding 12 copies per student.
+_PAID_STATUS = {"paid": "paid", "unpaid": "unpaid"}
+
+
+def _as_payment_matrix_row(_cursor, row) -> PaymentMatrixRow:
+    months = tuple(map(_PAID_STATUS.get, row[4:]))
+    return PaymentMatrixRow(row[0], row[1], row[2], row[3], months)
+
+
+# ---------------------------------------------------------------------------
+# Student operations
+# ---------------------------------------------------------------------------
+
+def create_student(
+    name: str,
+    join_date: Optional[str] = None,
+    student_id: Optional[int] = None,
+) -> int:
+    """
+    Create a new student.
+
+    If student_id is provided we try to insert with that ID (manual IDs).
     Otherwise SQLite will auto-assign one.
 
     Returns the student's ID.
@@ -167,35 +1307,30 @@ def create_student(
 
     join_date = join_date or _today_str()
 
-    conn = _get_conn()
-    c = conn.cursor()
     try:
-        if student_id is not None:
-            # Check manually to give a nicer error
-            c.execute("SELECT 1 FROM students WHERE id = ?", (student_id,))
-            if c.fetchone():
-                raise AlreadyExistsError(f"Student ID {student_id} already exists.")
+        with _session() as c:
+            if student_id is not None:
+                # Check manually to give a nicer error
+                c.execute("SELECT 1 FROM students WHERE id = ?", (student_id,))
+                if c.fetchone():
+                    raise AlreadyExistsError(f"Student ID {student_id} already exists.")
 
-            c.execute(
-                "INSERT INTO students (id, name, join_date) VALUES (?, ?, ?)",
-                (student_id, name.strip(), join_date),
-            )
-            sid = student_id
-        else:
-            c.execute(
-                "INSERT INTO students (name, join_date) VALUES (?, ?)",
-                (name.strip(), join_date),
-            )
-            sid = c.lastrowid
+                c.execute(
+                    "INSERT INTO students (id, name, join_date) VALUES (?, ?, ?)",
+                    (student_id, name.strip(), join_date),
+                )
+                sid = student_id
+            else:
+                c.execute(
+                    "INSERT INTO students (name, join_date) VALUES (?, ?)",
+                    (name.strip(), join_date),
+                )
+                sid = c.lastrowid
 
-        conn.commit()
-        return sid
+            return sid
     except sqlite3.IntegrityError as e:
-        conn.rollback()
         # Could be duplicate name if you later add such a constraint
         raise DBError(str(e)) from e
-    finally:
-        conn.close()
 
 
 def update_student(
@@ -211,9 +1346,7 @@ def update_student(
     if name is None and join_date is None:
         return  # nothing to do
 
-    conn = _get_conn()
-    c = conn.cursor()
-    try:
+    with _session() as c:
         c.execute("SELECT 1 FROM students WHERE id = ?", (student_id,))
         if not c.fetchone():
             raise NotFoundError(f"Student {student_id} not found.")
@@ -235,9 +1368,6 @@ def update_student(
             f"UPDATE students SET {', '.join(fields)} WHERE id = ?",
             params,
         )
-        conn.commit()
-    finally:
-        conn.close()
 
 
 def get_student(student_id: int) -> Student:
@@ -246,19 +1376,15 @@ def get_student(student_id: int) -> Student:
 
     Raises NotFoundError if not found.
     """
-    conn = _get_conn(row_factory=True)
-    c = conn.cursor()
-    try:
+    with _session(_as_student) as c:
         c.execute(
             "SELECT id, name, join_date FROM students WHERE id = ?",
             (student_id,),
         )
-        row = c.fetchone()
-        if row is None:
+        student = c.fetchone()
+        if student is None:
             raise NotFoundError(f"Student {student_id} not found.")
-        return Student(id=row["id"], name=row["name"], join_date=row["join_date"])
-    finally:
-        conn.close()
+        return student
 
 
 def get_all_students(order_by: str = "name") -> list[Student]:
@@ -271,18 +1397,49 @@ def get_all_students(order_by: str = "name") -> list[Student]:
     if order_by not in allowed:
         raise ValueError(f"order_by must be one of {allowed}")
 
-    conn = _get_conn(row_factory=True)
-    c = conn.cursor()
-    try:
+    with _session(_as_student) as c:
         c.execute(
             f"SELECT id, name, join_date FROM students ORDER BY {order_by} COLLATE NOCASE"
         )
-        return [
-            Student(id=row["id"], name=row["name"], join_date=row["join_date"])
-            for row in c.fetchall()
-        ]
-    finally:
-        conn.close()
+        return c.fetchall()
+
+
+def iter_all_students(
+    order_by: str = "name",
+    page_size: int = STREAM_PAGE_SIZE,
+) -> Iterator[Student]:
+    """
+    Streaming version of get_all_students().
+
+    order_by can be 'name' (name COLLATE NOCASE, then id) or 'id'. Students
+    are fetched page_size at a time with keyset pagination, so no query ever
+    reads past the page being consumed.
+    """
+    if order_by not in ("name", "id"):
+        raise ValueError("order_by must be 'name' or 'id'")
+
+    after: Optional[tuple[str, int]] = None
+    while True:
+        if order_by == "name":
+            sql = "SELECT id, name, join_date FROM students s"
+            params: tuple = ()
+            if after is not None:
+                sql += " WHERE " + _KEYSET_AFTER_SQL
+                params = (after[0], after[0], after[1])
+            sql += " ORDER BY s.name COLLATE NOCASE, s.id LIMIT ?"
+        else:
+            sql = "SELECT id, name, join_date FROM students WHERE id > ? ORDER BY id LIMIT ?"
+            params = (after[1] if after is not None else -1,)
+
+        with _session(_as_student) as c:
+            c.execute(sql, params + (page_size,))
+            page = c.fetchall()
+
+        yield from page
+
+        if len(page) < page_size:
+            return
+        after = (page[-1].name, page[-1].id)
 
 
 def delete_student(student_id: int, snapshot_for_undo: bool = False) -> Optional[dict]:
@@ -303,9 +1460,7 @@ def delete_student(student_id: int, snapshot_for_undo: bool = False) -> Optional
 
     Raises NotFoundError if the student does not exist.
     """
-    conn = _get_conn(row_factory=True)
-    c = conn.cursor()
-    try:
+    with _session(row_factory=True) as c:
         # basic student row
         c.execute(
             "SELECT id, name, join_date FROM students WHERE id = ?",
@@ -366,10 +1521,7 @@ def delete_student(student_id: int, snapshot_for_undo: bool = False) -> Optional
         c.execute("DELETE FROM payments WHERE student_id = ?", (student_id,))
         c.execute("DELETE FROM students WHERE id = ?", (student_id,))
 
-        conn.commit()
         return snapshot
-    finally:
-        conn.close()
 
 
 def restore_student_snapshot(snapshot: dict) -> None:
@@ -388,9 +1540,7 @@ def restore_student_snapshot(snapshot: dict) -> None:
     if sid is None or name is None:
         raise DBError("Invalid snapshot: missing student id or name.")
 
-    conn = _get_conn()
-    c = conn.cursor()
-    try:
+    with _session() as c:
         # check ID availability
         c.execute("SELECT 1 FROM students WHERE id = ?", (sid,))
         if c.fetchone():
@@ -403,16 +1553,10 @@ def restore_student_snapshot(snapshot: dict) -> None:
         )
 
         # ensure groups exist and link
-        for gname in groups:
-            c.execute("INSERT OR IGNORE INTO groups (name) VALUES (?)", (gname,))
-            c.execute("SELECT id FROM groups WHERE name = ?", (gname,))
-            row = c.fetchone()
-            if row:
-                gid = row[0]
-                c.execute(
-                    "INSERT OR IGNORE INTO student_group (student_id, group_id) VALUES (?, ?)",
-                    (sid, gid),
-                )
+        c.executemany(
+            "INSERT OR IGNORE INTO student_group (student_id, group_id) VALUES (?, ?)",
+            [(sid, gid) for gid in _ensure_group_ids(c, groups)],
+        )
 
         # restore payments
         for p in payments:
@@ -424,10 +1568,6 @@ def restore_student_snapshot(snapshot: dict) -> None:
                 (sid, p["year"], p["month"], p["paid"], p["payment_date"]),
             )
 
-        conn.commit()
-    finally:
-        conn.close()
-
 
 # ---------------------------------------------------------------------------
 # Group operations
@@ -445,19 +1585,14 @@ def create_group(name: str) -> int:
     if not name:
         raise DBError("Group name cannot be empty.")
 
-    conn = _get_conn()
-    c = conn.cursor()
     try:
-        c.execute("INSERT INTO groups (name) VALUES (?)", (name,))
-        gid = c.lastrowid
-        conn.commit()
-        return gid
+        with _session() as c:
+            _invalidate_groups()
+            c.execute("INSERT INTO groups (name) VALUES (?)", (name,))
+            return c.lastrowid
     except sqlite3.IntegrityError as e:
-        conn.rollback()
         # UNIQUE(name) violated
         raise AlreadyExistsError(f"Group '{name}' already exists.") from e
-    finally:
-        conn.close()
 
 
 def delete_group_by_name(name: str) -> bool:
@@ -470,32 +1605,21 @@ def delete_group_by_name(name: str) -> bool:
     if not name:
         raise DBError("Group name cannot be empty.")
 
-    conn = _get_conn()
-    c = conn.cursor()
-    try:
-        c.execute("SELECT id FROM groups WHERE name = ?", (name,))
-        row = c.fetchone()
-        if not row:
+    with _session() as c:
+        gid = _group_ids(c).get(name)
+        if gid is None:
             return False
 
-        gid = row[0]
+        _invalidate_groups()
         c.execute("DELETE FROM student_group WHERE group_id = ?", (gid,))
         c.execute("DELETE FROM groups WHERE id = ?", (gid,))
-        conn.commit()
         return True
-    finally:
-        conn.close()
 
 
 def get_all_groups() -> list[str]:
     """Return a list of all group names sorted alphabetically."""
-    conn = _get_conn()
-    c = conn.cursor()
-    try:
-        c.execute("SELECT name FROM groups ORDER BY name")
-        return [r[0] for r in c.fetchall()]
-    finally:
-        conn.close()
+    with _session() as c:
+        return list(_group_ids(c))
 
 
 def set_student_groups(student_id: int, group_names: Sequence[str]) -> None:
@@ -504,9 +1628,7 @@ def set_student_groups(student_id: int, group_names: Sequence[str]) -> None:
 
     Any groups that don't exist are created automatically.
     """
-    conn = _get_conn()
-    c = conn.cursor()
-    try:
+    with _session() as c:
         # ensure student exists
         c.execute("SELECT 1 FROM students WHERE id = ?", (student_id,))
         if not c.fetchone():
@@ -516,30 +1638,16 @@ def set_student_groups(student_id: int, group_names: Sequence[str]) -> None:
         c.execute("DELETE FROM student_group WHERE student_id = ?", (student_id,))
 
         # add new ones
-        for gname in group_names:
-            gname = gname.strip()
-            if not gname:
-                continue
-            c.execute("INSERT OR IGNORE INTO groups (name) VALUES (?)", (gname,))
-            c.execute("SELECT id FROM groups WHERE name = ?", (gname,))
-            row = c.fetchone()
-            if row:
-                gid = row[0]
-                c.execute(
-                    "INSERT OR IGNORE INTO student_group (student_id, group_id) VALUES (?, ?)",
-                    (student_id, gid),
-                )
-
-        conn.commit()
-    finally:
-        conn.close()
+        names = [n for n in (g.strip() for g in group_names) if n]
+        c.executemany(
+            "INSERT OR IGNORE INTO student_group (student_id, group_id) VALUES (?, ?)",
+            [(student_id, gid) for gid in _ensure_group_ids(c, names)],
+        )
 
 
 def get_student_groups(student_id: int) -> list[str]:
     """Return list of group names for a student."""
-    conn = _get_conn()
-    c = conn.cursor()
-    try:
+    with _session() as c:
         c.execute(
             """
             SELECT g.name
@@ -551,39 +1659,175 @@ def get_student_groups(student_id: int) -> list[str]:
             (student_id,),
         )
         return [r[0] for r in c.fetchall()]
-    finally:
-        conn.close()
+
+
+def get_groups_for_students(student_ids: Iterable[int]) -> dict[int, list[str]]:
+    """
+    Return {student_id: [group names]} for many students in one query.
+
+    Every requested ID is a key; students without groups (or that don't
+    exist) map to an empty list. Names are sorted as in get_student_groups().
+    """
+    with _session() as c:
+        table = _id_table(c, student_ids)
+        c.execute(f"SELECT id FROM {table}")
+        result: dict[int, list[str]] = {r[0]: [] for r in c.fetchall()}
+        c.execute(
+            f"""
+            SELECT sg.student_id, g.name
+            FROM {table} t
+            CROSS JOIN student_group sg ON sg.student_id = t.id
+            JOIN groups g ON g.id = sg.group_id
+            ORDER BY sg.student_id, g.name
+            """
+        )
+        for sid, name in c:
+            result[sid].append(name)
+        return result
 
 
 def get_group_students(group_name: str) -> list[Student]:
     """
     Return all students in the given group (by name), ordered by name.
     """
-    conn = _get_conn(row_factory=True)
-    c = conn.cursor()
-    try:
-        c.execute("SELECT id FROM groups WHERE name = ?", (group_name,))
-        row = c.fetchone()
-        if not row:
-            return []
-
-        gid = row["id"]
+    with _session(_as_student) as c:
         c.execute(
             """
             SELECT s.id, s.name, s.join_date
-            FROM students s
-            JOIN student_group sg ON s.id = sg.student_id
-            WHERE sg.group_id = ?
+            FROM groups g
+            JOIN student_group sg ON sg.group_id = g.id
+            JOIN students s ON s.id = sg.student_id
+            WHERE g.name = ?
             ORDER BY s.name
             """,
+            (group_name,),
+        )
+        return c.fetchall()
+
+
+# ---------------------------------------------------------------------------
+# Bulk writes (one transaction, executemany)
+# ---------------------------------------------------------------------------
+
+def create_students_bulk(items: Iterable[dict]) -> list[int]:
+    """
+    Create many students in one transaction.
+
+    items: iterable of dicts with keys:
+        name, join_date (optional, defaults to today), id (optional manual ID)
+
+    Returns the students' IDs in the same order as items.
+
+    Raises AlreadyExistsError if a manual ID is already in use (or given
+    twice); nothing is inserted in that case.
+    """
+    today = _today_str()
+    manual_rows = []
+    auto_rows = []
+    order: list[Optional[int]] = []  # manual ID, or None for auto-assigned
+    for it in items:
+        name = (it.get("name") or "").strip()
+        if not name:
+            raise DBError("Student name cannot be empty.")
+        join_date = it.get("join_date") or today
+        sid = it.get("id")
+        order.append(sid)
+        if sid is None:
+            auto_rows.append((name, join_date))
+        else:
+            manual_rows.append((sid, name, join_date))
+
+    if not order:
+        return []
+
+    try:
+        with _session() as c:
+            c.executemany(
+                "INSERT INTO students (id, name, join_date) VALUES (?, ?, ?)",
+                manual_rows,
+            )
+            c.executemany(
+                "INSERT INTO students (name, join_date) VALUES (?, ?)",
+                auto_rows,
+            )
+            # The write lock is held from the first INSERT, so the
+            # auto-assigned IDs are consecutive and end at last_insert_rowid().
+            last_id = c.execute("SELECT last_insert_rowid()").fetchone()[0]
+    except sqlite3.IntegrityError as e:
+        raise AlreadyExistsError(f"A given student ID already exists: {e}") from e
+
+    next_id = last_id - len(auto_rows) + 1
+    ids = []
+    for sid in order:
+        if sid is None:
+            sid = next_id
+            next_id += 1
+        ids.append(sid)
+    return ids
+
+
+def set_groups_bulk(mapping: Mapping[int, Sequence[str]]) -> None:
+    """
+    Replace the group lists of many students at once.
+
+    mapping: {student_id: [group names]}; an empty list makes the student
+    groupless. Groups that don't exist are created automatically.
+
+    Raises NotFoundError (and changes nothing) if any student is missing.
+    """
+    student_ids = list(mapping)
+    if not student_ids:
+        return
+
+    cleaned = {
+        sid: [n for n in (g.strip() for g in names) if n]
+        for sid, names in mapping.items()
+    }
+    all_names = list(dict.fromkeys(n for names in cleaned.values() for n in names))
+
+    with _session() as c:
+        table = _id_table(c, student_ids)
+        missing = _missing_student_ids(c, table)
+        if missing:
+            raise NotFoundError(f"Students not found: {missing}")
+
+        gid_by_name = dict(zip(all_names, _ensure_group_ids(c, all_names)))
+        c.execute(f"DELETE FROM student_group WHERE student_id IN (SELECT id FROM {table})")
+        c.executemany(
+            "INSERT OR IGNORE INTO student_group (student_id, group_id) VALUES (?, ?)",
+            [(sid, gid_by_name[n]) for sid, names in cleaned.items() for n in names],
+        )
+
+
+def add_students_to_group(group_name: str, student_ids: Sequence[int]) -> int:
+    """
+    Add students to a group, keeping their other groups.
+
+    The group is created if it doesn't exist. Returns how many students were
+    newly added (students already in the group are skipped).
+
+    Raises NotFoundError (and changes nothing) if any student is missing.
+    """
+    group_name = group_name.strip()
+    if not group_name:
+        raise DBError("Group name cannot be empty.")
+    student_ids = list(student_ids)
+
+    with _session() as c:
+        table = _id_table(c, student_ids)
+        missing = _missing_student_ids(c, table)
+        if missing:
+            raise NotFoundError(f"Students not found: {missing}")
+
+        gid = _ensure_group_ids(c, [group_name])[0]
+        c.execute(
+            f"""
+            INSERT OR IGNORE INTO student_group (student_id, group_id)
+            SELECT id, ? FROM {table}
+            """,
             (gid,),
         )
-        return [
-            Student(id=r["id"], name=r["name"], join_date=r["join_date"])
-            for r in c.fetchall()
-        ]
-    finally:
-        conn.close()
+        return c.rowcount
 
 
 # ---------------------------------------------------------------------------
@@ -608,32 +1852,27 @@ def upsert_payment(
 
     payment_date = payment_date or _today_str()
 
-    conn = _get_conn()
-    c = conn.cursor()
-    try:
-        c.execute(
-            """
-            INSERT INTO payments (student_id, year, month, paid, payment_date)
-            VALUES (?, ?, ?, ?, ?)
-            ON CONFLICT(student_id, year, month)
-            DO UPDATE SET paid = excluded.paid,
-                          payment_date = excluded.payment_date
-            """,
-            (student_id, year, month, paid, payment_date),
-        )
-        conn.commit()
-    except sqlite3.OperationalError:
-        # Fallback for older SQLite versions (no ON CONFLICT DO UPDATE)
-        c.execute(
-            """
-            REPLACE INTO payments (student_id, year, month, paid, payment_date)
-            VALUES (?, ?, ?, ?, ?)
-            """,
-            (student_id, year, month, paid, payment_date),
-        )
-        conn.commit()
-    finally:
-        conn.close()
+    with _session() as c:
+        try:
+            c.execute(
+                """
+                INSERT INTO payments (student_id, year, month, paid, payment_date)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(student_id, year, month)
+                DO UPDATE SET paid = excluded.paid,
+                              payment_date = excluded.payment_date
+                """,
+                (student_id, year, month, paid, payment_date),
+            )
+        except sqlite3.OperationalError:
+            # Fallback for older SQLite versions (no ON CONFLICT DO UPDATE)
+            c.execute(
+                """
+                REPLACE INTO payments (student_id, year, month, paid, payment_date)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                (student_id, year, month, paid, payment_date),
+            )
 
 
 def upsert_payments_bulk(student_id: int, items: Iterable[dict]) -> None:
@@ -643,8 +1882,6 @@ def upsert_payments_bulk(student_id: int, items: Iterable[dict]) -> None:
     items: iterable of dicts with keys:
         year, month, paid ('paid'|'unpaid'), payment_date ('' or 'YYYY-MM-DD')
     """
-    conn = _get_conn()
-    c = conn.cursor()
     rows = []
     for it in items:
         paid = it["paid"]
@@ -655,34 +1892,31 @@ def upsert_payments_bulk(student_id: int, items: Iterable[dict]) -> None:
             (student_id, it["year"], it["month"], paid, payment_date)
         )
 
-    try:
-        c.executemany(
-            """
-            INSERT INTO payments (student_id, year, month, paid, payment_date)
-            VALUES (?, ?, ?, ?, ?)
-            ON CONFLICT(student_id, year, month)
-            DO UPDATE SET paid = excluded.paid,
-                          payment_date = excluded.payment_date
-            """,
-            rows,
-        )
-    except sqlite3.OperationalError:
-        c.executemany(
-            """
-            REPLACE INTO payments (student_id, year, month, paid, payment_date)
-            VALUES (?, ?, ?, ?, ?)
-            """,
-            rows,
-        )
-    conn.commit()
-    conn.close()
+    with _session() as c:
+        try:
+            c.executemany(
+                """
+                INSERT INTO payments (student_id, year, month, paid, payment_date)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(student_id, year, month)
+                DO UPDATE SET paid = excluded.paid,
+                              payment_date = excluded.payment_date
+                """,
+                rows,
+            )
+        except sqlite3.OperationalError:
+            c.executemany(
+                """
+                REPLACE INTO payments (student_id, year, month, paid, payment_date)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                rows,
+            )
 
 
 def get_payment(student_id: int, year: int, month: int) -> Optional[Payment]:
     """Return a single Payment or None."""
-    conn = _get_conn(row_factory=True)
-    c = conn.cursor()
-    try:
+    with _session(_as_payment) as c:
         c.execute(
             """
             SELECT id, student_id, year, month, paid, payment_date
@@ -691,26 +1925,12 @@ def get_payment(student_id: int, year: int, month: int) -> Optional[Payment]:
             """,
             (student_id, year, month),
         )
-        row = c.fetchone()
-        if not row:
-            return None
-        return Payment(
-            id=row["id"],
-            student_id=row["student_id"],
-            year=row["year"],
-            month=row["month"],
-            paid=row["paid"],
-            payment_date=row["payment_date"],
-        )
-    finally:
-        conn.close()
+        return c.fetchone()
 
 
 def get_payments_for_student(student_id: int) -> list[Payment]:
     """Return all payments for a student sorted by year, month."""
-    conn = _get_conn(row_factory=True)
-    c = conn.cursor()
-    try:
+    with _session(_as_payment) as c:
         c.execute(
             """
             SELECT id, student_id, year, month, paid, payment_date
@@ -720,19 +1940,7 @@ def get_payments_for_student(student_id: int) -> list[Payment]:
             """,
             (student_id,),
         )
-        return [
-            Payment(
-                id=row["id"],
-                student_id=row["student_id"],
-                year=row["year"],
-                month=row["month"],
-                paid=row["paid"],
-                payment_date=row["payment_date"],
-            )
-            for row in c.fetchall()
-        ]
-    finally:
-        conn.close()
+        return c.fetchall()
 
 
 def get_payments_for_student_academic_year(
@@ -748,9 +1956,7 @@ def get_payments_for_student_academic_year(
     start_year = academic_start_year
     end_year = academic_start_year + 1
 
-    conn = _get_conn(row_factory=True)
-    c = conn.cursor()
-    try:
+    with _session(_as_payment) as c:
         c.execute(
             """
             SELECT id, student_id, year, month, paid, payment_date
@@ -764,19 +1970,218 @@ def get_payments_for_student_academic_year(
             """,
             (student_id, start_year, end_year),
         )
-        return [
-            Payment(
-                id=row["id"],
-                student_id=row["student_id"],
-                year=row["year"],
-                month=row["month"],
-                paid=row["paid"],
-                payment_date=row["payment_date"],
+        return c.fetchall()
+
+
+# Academic-year month order (Aug..Jul), as used by the history window.
+ACADEMIC_MONTHS = (8, 9, 10, 11, 12, 1, 2, 3, 4, 5, 6, 7)
+
+
+def get_payment_matrix(
+    academic_start_year: int,
+    group_name: Optional[str] = None,
+) -> list[PaymentMatrixRow]:
+    """
+    Return every student's payment status for a whole academic year in one query.
+
+    academic_start_year is the year of August (2024 => 2024–2025).
+    If group_name is provided, only that group's students are returned.
+
+    Rows are PaymentMatrixRow records ordered by name; row.months holds 12
+    entries ('paid' | 'unpaid' | None) in Aug..Jul order.
+    """
+    # Within one academic year each month number occurs once, so the pivot
+    # only needs the month to pick the column.
+    pivot = ",\n            ".join(
+        f"MAX(CASE WHEN p.month = {m} THEN p.paid END) AS m{m}"
+        for m in ACADEMIC_MONTHS
+    )
+
+    # Restrict both the group-name aggregate and the main scan to the chosen
+    # group's members (resolved through idx_student_group_group).
+    member_filter = ""
+    student_filter = ""
+    group_params: list = []
+    if group_name:
+        in_group = """IN (
+                SELECT sg2.student_id
+                FROM student_group sg2
+                JOIN groups g2 ON g2.id = sg2.group_id
+                WHERE g2.name = ?
+            )"""
+        member_filter = f"WHERE sg.student_id {in_group}"
+        student_filter = f"WHERE s.id {in_group}"
+        group_params = [group_name]
+
+    sql = f"""
+        WITH member_groups AS (
+            SELECT student_id, GROUP_CONCAT(name, ', ') AS groups
+            FROM (
+                SELECT sg.student_id, g.name
+                FROM student_group sg
+                JOIN groups g ON g.id = sg.group_id
+                {member_filter}
+                ORDER BY sg.student_id, g.name
             )
-            for row in c.fetchall()
-        ]
-    finally:
-        conn.close()
+            GROUP BY student_id
+        )
+        SELECT
+            s.id,
+            s.name,
+            s.join_date,
+            COALESCE(mg.groups, '') AS groups,
+            {pivot}
+        FROM students s
+        LEFT JOIN member_groups mg ON mg.student_id = s.id
+        LEFT JOIN payments p
+            ON p.student_id = s.id
+           AND (
+                    (p.year = ? AND p.month BETWEEN 8 AND 12)
+                 OR (p.year = ? AND p.month BETWEEN 1 AND 7)
+           )
+        {student_filter}
+        GROUP BY s.id
+        ORDER BY s.name COLLATE NOCASE, s.id
+    """
+    params = group_params + [academic_start_year, academic_start_year + 1] + group_params
+
+    with _session(_as_payment_matrix_row) as c:
+        c.execute(sql, tuple(params))
+        return c.fetchall()
+
+
+# payment_status filters for get_students_with_payment_for_month, expressed on
+# the computed monthly_payment label so they always agree with what is shown.
+_PAYMENT_STATUS_FILTERS = {
+    "paid": "monthly_payment LIKE 'Paid (%'",
+    "unpaid": "monthly_payment = 'Unpaid'",
+    "no_record": "monthly_payment = 'No record'",
+}
+
+
+def _month_view_query(
+    year: int,
+    month: int,
+    search_text: str,
+    search_type: str,
+    group_name: Optional[str],
+    payment_status: Optional[str],
+    after: Optional[tuple[str, int]] = None,
+    limit: Optional[int] = None,
+) -> tuple[str, list]:
+    """
+    Build the SQL + params behind the main tree view.
+
+    With limit set, rows come back ordered by (name COLLATE NOCASE, id) and
+    start strictly after the `after` key, i.e. one keyset page.
+    """
+    search_type = search_type.lower()
+    if search_type not in ("id", "name"):
+        raise ValueError("search_type must be 'id' or 'name'.")
+    if payment_status is not None and payment_status not in _PAYMENT_STATUS_FILTERS:
+        raise ValueError(
+            f"payment_status must be one of {sorted(_PAYMENT_STATUS_FILTERS)} or None."
+        )
+
+    sql = """
+        SELECT
+            s.id,
+            s.name,
+            s.join_date,
+            COALESCE(GROUP_CONCAT(g.name, ', '), '') AS groups,
+            CASE
+                WHEN p.payment_date IS NOT NULL
+                     AND strftime('%Y-%m', p.payment_date) = strftime('%Y-%m', ?) THEN
+                     CASE
+                         WHEN p.paid = 'paid' THEN 'Paid (' || p.payment_date || ')'
+                         WHEN p.paid = 'unpaid' THEN 'Unpaid'
+                         ELSE 'Unpaid'
+                     END
+                WHEN p.payment_date IS NULL THEN 'No record'
+                ELSE 'No record'
+            END AS monthly_payment
+        FROM students s
+        LEFT JOIN student_group sg ON s.id = sg.student_id
+        LEFT JOIN groups g ON sg.group_id = g.id
+        LEFT JOIN payments p
+            ON s.id = p.student_id
+           AND p.year = ?
+           AND p.month = ?
+    """
+
+    params: list = [f"{year}-{month:02d}-01", year, month]
+    where: list[str] = []
+
+    if search_type == "id" and search_text:
+        where.append("s.id = ?")
+        params.append(int(search_text))
+    elif search_text:
+        name_sql, name_param = _name_filter(search_text)
+        where.append(name_sql)
+        params.append(name_param)
+
+    if group_name:
+        # members come from idx_student_group_group, so a small group in a
+        # large school only touches its own rows
+        where.append(
+            """s.id IN (
+                SELECT sg2.student_id
+                FROM student_group sg2
+                JOIN groups g2 ON g2.id = sg2.group_id
+                WHERE g2.name = ?
+            )"""
+        )
+        params.append(group_name)
+
+    if after is not None:
+        where.append(_KEYSET_AFTER_SQL)
+        params.extend((after[0], after[0], after[1]))
+
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+
+    if limit is None:
+        sql += " GROUP BY s.id"
+    else:
+        # grouping in index order lets SQLite stop after `limit` students
+        sql += " GROUP BY s.name COLLATE NOCASE, s.id"
+
+    if payment_status is not None:
+        sql += " HAVING " + _PAYMENT_STATUS_FILTERS[payment_status]
+
+    if limit is not None:
+        sql += " ORDER BY s.name COLLATE NOCASE, s.id LIMIT ?"
+        params.append(limit)
+
+    return sql, params
+
+
+# hits / misses of the month-view cache, summed over all threads
+_month_view_stats = {"hits": 0, "misses": 0}
+_month_view_stats_lock = threading.Lock()
+
+
+def _month_view_cache() -> OrderedDict:
+    """
+    Return this thread's month-view cache, emptied first if the database may
+    have changed since it was filled.
+
+    The cache is tagged with the change_token() it was filled under, so any
+    commit (through this module, another connection or another process), a
+    write inside an open transaction() or a different DB_PATH drops every
+    entry at the cost of one pragma.
+    """
+    token = change_token()
+    cache = getattr(_local, "month_view", None)
+    if cache is None or _local.month_view_token != token:
+        cache = _local.month_view = OrderedDict()
+        _local.month_view_token = token
+    return cache
+
+
+def _count_month_view(outcome: str) -> None:
+    with _month_view_stats_lock:
+        _month_view_stats[outcome] += 1
 
 
 def get_students_with_payment_for_month(
@@ -784,80 +2189,108 @@ def get_students_with_payment_for_month(
     month: int,
     search_text: str = "",
     search_type: str = "name",
-) -> list[dict]:
+    group_name: Optional[str] = None,
+    payment_status: Optional[str] = None,
+) -> list[MonthViewRow]:
     """
     Return a list of rows used by the main tree view for a given month.
 
-    Each dict has:
-        {
-            "id": int,
-            "name": str,
-            "groups": "G1, G2, ...",
-            "join_date": "YYYY-MM-DD",
-            "monthly_payment": "Paid (YYYY-MM-DD)" | "Unpaid" | "No record",
-        }
+    Each MonthViewRow has:
+        id, name, join_date ("YYYY-MM-DD"), groups ("G1, G2, ..."),
+        monthly_payment ("Paid (YYYY-MM-DD)" | "Unpaid" | "No record")
 
     search_type: "id" or "name"
+    group_name: only students in this group (their "groups" still lists all)
+    payment_status: "paid", "unpaid" or "no_record" to keep only those rows
+
+    The last MONTH_VIEW_CACHE_SIZE results are cached per thread until the
+    database changes (see _month_view_cache), so going back to a month seen
+    recently skips the query. The cache holds the plain row tuples and every
+    call builds its own MonthViewRow objects, so callers may change them.
     """
-    search_type = search_type.lower()
-    if search_type not in ("id", "name"):
-        raise ValueError("search_type must be 'id' or 'name'.")
+    sql, params = _month_view_query(
+        year, month, search_text, search_type, group_name, payment_status
+    )
+    if MONTH_VIEW_CACHE_SIZE <= 0:
+        with _session(_as_month_view_row) as c:
+            c.execute(sql, tuple(params))
+            return c.fetchall()
+
+    cache = _month_view_cache()
+    key = (year, month, search_text, search_type.lower(), group_name or None, payment_status)
+    rows = cache.get(key)
+    if rows is not None:
+        cache.move_to_end(key)
+        _count_month_view("hits")
+    else:
+        _count_month_view("misses")
+        with _session() as c:
+            c.execute(sql, tuple(params))
+            rows = c.fetchall()
+        cache[key] = rows
+        while len(cache) > MONTH_VIEW_CACHE_SIZE:
+            cache.popitem(last=False)
+    return [MonthViewRow(*r) for r in rows]
+
+
+def get_month_view_cache_stats() -> dict:
+    """
+    Return {"hits", "misses", "hit_rate", "size", "max_size"} for the
+    get_students_with_payment_for_month() cache.
 
-    conn = _get_conn(row_factory=True)
-    c = conn.cursor()
-    try:
-        base_sql = """
-            SELECT
-                s.id,
-                s.name,
-                s.join_date,
-                COALESCE(GROUP_CONCAT(g.name, ', '), '') AS groups,
-                CASE
-                    WHEN p.payment_date IS NOT NULL
-                         AND strftime('%Y-%m', p.payment_date) = strftime('%Y-%m', ?) THEN
-                         CASE
-                             WHEN p.paid = 'paid' THEN 'Paid (' || p.payment_date || ')'
-                             WHEN p.paid = 'unpaid' THEN 'Unpaid'
-                             ELSE 'Unpaid'
-                         END
-                    WHEN p.payment_date IS NULL THEN 'No record'
-                    ELSE 'No record'
-                END AS monthly_payment
-            FROM students s
-            LEFT JOIN student_group sg ON s.id = sg.student_id
-            LEFT JOIN groups g ON sg.group_id = g.id
-            LEFT JOIN payments p
-                ON s.id = p.student_id
-               AND p.year = ?
-               AND p.month = ?
-        """
+    hits / misses are summed over all threads since the last
+    clear_month_view_cache(); size is this thread's entry count.
+    """
+    with _month_view_stats_lock:
+        hits, misses = _month_view_stats["hits"], _month_view_stats["misses"]
+    cache = getattr(_local, "month_view", None)
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+        "size": len(cache) if cache is not None else 0,
+        "max_size": MONTH_VIEW_CACHE_SIZE,
+    }
+
+
+def clear_month_view_cache() -> None:
+    """Drop this thread's cached month views and zero the hit/miss counters."""
+    _local.month_view = None
+    with _month_view_stats_lock:
+        _month_view_stats["hits"] = _month_view_stats["misses"] = 0
+
+
+def iter_students_with_payment_for_month(
+    year: int,
+    month: int,
+    search_text: str = "",
+    search_type: str = "name",
+    group_name: Optional[str] = None,
+    payment_status: Optional[str] = None,
+    page_size: int = STREAM_PAGE_SIZE,
+) -> Iterator[MonthViewRow]:
+    """
+    Streaming version of get_students_with_payment_for_month().
 
-        params: list = [f"{year}-{month:02d}-01", year, month]
+    Yields the same rows, ordered by name then id, fetching page_size rows
+    per query (keyset pagination), so memory stays flat and the first row is
+    available before the whole month has been read.
+    """
+    after: Optional[tuple[str, int]] = None
+    while True:
+        sql, params = _month_view_query(
+            year, month, search_text, search_type, group_name, payment_status,
+            after=after, limit=page_size,
+        )
+        with _session(_as_month_view_row) as c:
+            c.execute(sql, tuple(params))
+            page = c.fetchall()
 
-        if search_type == "id" and search_text:
-            base_sql += " WHERE s.id = ? GROUP BY s.id"
-            params.append(int(search_text))
-        elif search_text:
-            base_sql += " WHERE s.name LIKE ? GROUP BY s.id"
-            params.append(f"%{search_text}%")
-        else:
-            base_sql += " GROUP BY s.id"
+        yield from page
 
-        c.execute(base_sql, tuple(params))
-        rows = []
-        for r in c.fetchall():
-            rows.append(
-                {
-                    "id": r["id"],
-                    "name": r["name"],
-                    "join_date": r["join_date"],
-                    "groups": r["groups"],
-                    "monthly_payment": r["monthly_payment"],
-                }
-            )
-        return rows
-    finally:
-        conn.close()
+        if len(page) < page_size:
+            return
+        after = (page[-1].name, page[-1].id)
 
 
 def get_unpaid_students_for_month(
@@ -870,10 +2303,21 @@ def get_unpaid_students_for_month(
 
     If group_name is provided, filters to that group.
     """
-    conn = _get_conn(row_factory=True)
-    c = conn.cursor()
-    try:
-        sql = """
+    return _unpaid_students(
+        "SELECT student_id, paid FROM payments WHERE year = ? AND month = ?",
+        [year, month],
+        group_name,
+    )
+
+
+def _unpaid_students(status_sql: str, params: list, group_name: Optional[str]) -> list[dict]:
+    """
+    get_unpaid_students_for_month() over the month's statuses from
+    status_sql, which selects (student_id, paid) with params.
+    """
+    with _session(row_factory=True) as c:
+        sql = f"""
+            WITH p AS ({status_sql})
             SELECT
                 s.id,
                 s.name,
@@ -881,19 +2325,24 @@ def get_unpaid_students_for_month(
             FROM students s
             LEFT JOIN student_group sg ON s.id = sg.student_id
             LEFT JOIN groups g ON sg.group_id = g.id
-            LEFT JOIN payments p
-                ON s.id = p.student_id
-               AND p.year = ?
-               AND p.month = ?
+            LEFT JOIN p ON s.id = p.student_id
             WHERE (p.paid IS NULL OR p.paid = 'unpaid')
         """
-        params: list = [year, month]
+        params = list(params)
 
         if group_name:
-            sql += " AND g.name = ?"
+            # resolve the group's members through idx_student_group_group
+            sql += """
+              AND s.id IN (
+                    SELECT sg2.student_id
+                    FROM student_group sg2
+                    JOIN groups g2 ON g2.id = sg2.group_id
+                    WHERE g2.name = ?
+              )
+            """
             params.append(group_name)
 
-        sql += " GROUP BY s.id ORDER BY s.name"
+        sql += " GROUP BY s.id ORDER BY s.name COLLATE NOCASE"
 
         c.execute(sql, tuple(params))
         return [
@@ -904,8 +2353,268 @@ def get_unpaid_students_for_month(
             }
             for r in c.fetchall()
         ]
-    finally:
-        conn.close()
+
+
+# ---------------------------------------------------------------------------
+# Payment history (payment_events)
+# ---------------------------------------------------------------------------
+
+# Each student's newest event of a month at or before a moment, i.e. the
+# month's records as they stood then; params (year, month, ts bound). One
+# range scan of idx_payment_events_month; ids grow in commit order, so the
+# max id in the range is the last change. (SQLite returns the bare columns
+# from the row that supplied MAX.)
+_STATUS_AS_OF_SQL = """
+    SELECT student_id, paid, payment_date, MAX(id) AS event_id
+    FROM payment_events
+    WHERE year = ? AND month = ? AND ts <= ?
+    GROUP BY student_id
+"""
+
+
+def _as_of_bound(as_of: Union[str, date, datetime]) -> int:
+    """
+    Turn as_of into the payment_events.ts bound it stands for.
+
+    as_of is local time: a datetime, or a date meaning the end of that day,
+    or either as an ISO string ('2025-11-05', '2025-11-05 14:30').
+    """
+    try:
+        if isinstance(as_of, str):
+            as_of = (
+                date.fromisoformat(as_of) if len(as_of) == 10 else datetime.fromisoformat(as_of)
+            )
+    except ValueError:
+        raise DBError(f"as_of must be 'YYYY-MM-DD' or 'YYYY-MM-DD HH:MM[:SS]', got {as_of!r}.")
+    if not isinstance(as_of, datetime):
+        as_of = datetime.combine(as_of, datetime.max.time())
+    # a naive datetime is taken as local time
+    return int(as_of.timestamp() * 1000)
+
+
+def get_payment_events(
+    student_id: int,
+    year: Optional[int] = None,
+    month: Optional[int] = None,
+) -> list[PaymentEvent]:
+    """
+    Return the change history of a student's payments, oldest first.
+
+    Optionally only for one year / month. Works for deleted students too.
+    """
+    sql = """
+        SELECT id, strftime('%Y-%m-%d %H:%M:%S', ts / 1000.0, 'unixepoch', 'localtime'),
+               student_id, year, month, paid, payment_date
+        FROM payment_events
+        WHERE student_id = ?
+    """
+    params: list = [student_id]
+    if year is not None:
+        sql += " AND year = ?"
+        params.append(year)
+    if month is not None:
+        sql += " AND month = ?"
+        params.append(month)
+    sql += " ORDER BY ts, id"
+
+    with _session(_as_payment_event) as c:
+        c.execute(sql, params)
+        return c.fetchall()
+
+
+def get_payments_as_of(
+    year: int,
+    month: int,
+    as_of: Union[str, date, datetime],
+) -> dict[int, tuple[str, str]]:
+    """
+    Return {student_id: (paid, payment_date)} for a month as it stood at as_of.
+
+    as_of: see _as_of_bound(); a plain date means the end of that day.
+    Students with no record for the month at that moment are left out.
+    """
+    with _session() as c:
+        c.execute(_STATUS_AS_OF_SQL, (year, month, _as_of_bound(as_of)))
+        return {sid: (paid, pdate) for sid, paid, pdate, _ in c.fetchall() if paid is not None}
+
+
+def get_unpaid_students_as_of(
+    year: int,
+    month: int,
+    as_of: Union[str, date, datetime],
+    group_name: Optional[str] = None,
+) -> list[dict]:
+    """
+    get_unpaid_students_for_month() as it would have answered at as_of.
+
+    E.g. who was unpaid for October 2025 as of 5 November:
+        get_unpaid_students_as_of(2025, 10, "2025-11-05")
+
+    Payment statuses come from payment_events; the students and their
+    groups are today's (deleted students aren't listed).
+    """
+    return _unpaid_students(
+        f"SELECT student_id, paid FROM ({_STATUS_AS_OF_SQL})",
+        [year, month, _as_of_bound(as_of)],
+        group_name,
+    )
+
+
+# ---------------------------------------------------------------------------
+# Merging duplicate students
+# ---------------------------------------------------------------------------
+
+def _duplicate_key(name: Optional[str]) -> Optional[str]:
+    """
+    Students whose names give the same key are duplicates. Registered on
+    every connection as the SQL function duplicate_key(), because SQLite's
+    own lower() and trim() only fold ASCII letters and strip spaces, so
+    "Hélène" and "HÉLÈNE " would never match.
+    """
+    return None if name is None else name.strip().lower()
+
+
+_DUPLICATE_KEY_SQL = "duplicate_key(name)"
+
+
+def _apply_merge_map(c: sqlite3.Cursor) -> int:
+    """
+    Merge every temp.merge_map duplicate into its master and delete it.
+
+    Per (year, month) the master keeps the best of its own and its
+    duplicates' records: 'paid' beats 'unpaid', between paid records the
+    earliest payment_date wins, otherwise the master's own record is kept.
+    Returns the number of students removed.
+    """
+    c.execute(
+        """
+        INSERT INTO student_group (student_id, group_id)
+        SELECT DISTINCT m.master_id, sg.group_id
+        FROM temp.merge_map m
+        JOIN student_group sg ON sg.student_id = m.dup_id
+        WHERE 1
+        ON CONFLICT DO NOTHING
+        """
+    )
+    c.execute(
+        """
+        WITH owners (student_id, master_id) AS (
+            SELECT dup_id, master_id FROM temp.merge_map
+            UNION
+            SELECT master_id, master_id FROM temp.merge_map
+        ),
+        ranked AS (
+            SELECT o.master_id, p.year, p.month, p.paid, p.payment_date,
+                   ROW_NUMBER() OVER (
+                       PARTITION BY o.master_id, p.year, p.month
+                       ORDER BY p.paid = 'paid' DESC,
+                                CASE WHEN p.paid = 'paid' THEN p.payment_date END,
+                                p.student_id = o.master_id DESC,
+                                p.payment_date,
+                                p.student_id
+                   ) AS rank
+            FROM owners o
+            JOIN payments p ON p.student_id = o.student_id
+        )
+        INSERT INTO payments (student_id, year, month, paid, payment_date)
+        SELECT master_id, year, month, paid, payment_date
+        FROM ranked
+        WHERE rank = 1
+        ON CONFLICT(student_id, year, month)
+        DO UPDATE SET paid = excluded.paid,
+                      payment_date = excluded.payment_date
+        WHERE paid IS NOT excluded.paid OR payment_date IS NOT excluded.payment_date
+        """
+    )
+    # Links and payments explicitly, as in delete_students_by_ids
+    for sql in (
+        "DELETE FROM student_group WHERE student_id IN (SELECT dup_id FROM temp.merge_map)",
+        "DELETE FROM payments WHERE student_id IN (SELECT dup_id FROM temp.merge_map)",
+        "DELETE FROM students WHERE id IN (SELECT dup_id FROM temp.merge_map)",
+    ):
+        c.execute(sql)
+    removed = c.rowcount
+    c.execute("DELETE FROM temp.merge_map")
+    return removed
+
+
+def _new_merge_map(c: sqlite3.Cursor) -> None:
+    c.execute(
+        """
+        CREATE TEMP TABLE IF NOT EXISTS merge_map (
+            dup_id INTEGER PRIMARY KEY,
+            master_id INTEGER NOT NULL
+        )
+        """
+    )
+    c.execute("DELETE FROM temp.merge_map")
+
+
+def merge_students(master_id: int, duplicate_ids: Sequence[int]) -> int:
+    """
+    Merge duplicate students into master_id, then delete the duplicates.
+
+    Groups are combined; payments follow the rules of _apply_merge_map().
+    Everything happens in one transaction. Returns the number of students
+    removed.
+
+    Raises NotFoundError (and changes nothing) if any student is missing.
+    """
+    dup_ids = [sid for sid in dict.fromkeys(duplicate_ids) if sid != master_id]
+    if not dup_ids:
+        return 0
+
+    with _session() as c:
+        missing = _missing_student_ids(c, _id_table(c, [master_id] + dup_ids))
+        if missing:
+            raise NotFoundError(f"Students not found: {missing}")
+
+        _new_merge_map(c)
+        c.executemany(
+            "INSERT INTO temp.merge_map (dup_id, master_id) VALUES (?, ?)",
+            [(sid, master_id) for sid in dup_ids],
+        )
+        return _apply_merge_map(c)
+
+
+def find_duplicate_students() -> list[list[int]]:
+    """
+    Return clusters of student IDs sharing a name (case-insensitive).
+
+    Each cluster is sorted by ID; clusters are ordered by name.
+    """
+    with _session() as c:
+        c.execute(
+            f"""
+            SELECT group_concat(id)
+            FROM students
+            GROUP BY {_DUPLICATE_KEY_SQL}
+            HAVING COUNT(*) > 1
+            ORDER BY {_DUPLICATE_KEY_SQL}
+            """
+        )
+        return [sorted(map(int, r[0].split(","))) for r in c.fetchall()]
+
+
+def merge_all_duplicates() -> int:
+    """
+    Merge every set of students sharing a name (case-insensitive).
+
+    The lowest ID of each name is kept as the master; see merge_students().
+    One transaction for the whole database. Returns the number of students
+    removed.
+    """
+    with _session() as c:
+        _new_merge_map(c)
+        c.execute(
+            f"""
+            INSERT INTO temp.merge_map (dup_id, master_id)
+            SELECT id, MIN(id) OVER (PARTITION BY {_DUPLICATE_KEY_SQL})
+            FROM students
+            """
+        )
+        c.execute("DELETE FROM temp.merge_map WHERE dup_id = master_id")
+        return _apply_merge_map(c)
 
 
 # ---------------------------------------------------------------------------
@@ -918,20 +2627,16 @@ def get_groupless_students() -> list[dict]:
 
     Each dict: {"id": int, "name": str}
     """
-    conn = _get_conn(row_factory=True)
-    c = conn.cursor()
-    try:
+    with _session(row_factory=True) as c:
         c.execute(
             """
             SELECT id, name
             FROM students
             WHERE id NOT IN (SELECT student_id FROM student_group)
-            ORDER BY name
+            ORDER BY name COLLATE NOCASE
             """
         )
         return [{"id": r["id"], "name": r["name"]} for r in c.fetchall()]
-    finally:
-        conn.close()
 
 
 def delete_students_by_ids(student_ids: Sequence[int]) -> None:
@@ -943,26 +2648,12 @@ def delete_students_by_ids(student_ids: Sequence[int]) -> None:
     if not student_ids:
         return
 
-    conn = _get_conn()
-    c = conn.cursor()
-    try:
-        placeholders = ",".join("?" for _ in student_ids)
+    with _session() as c:
+        table = _id_table(c, student_ids)
         # delete payments & links explicitly for compatibility
-        c.execute(
-            f"DELETE FROM student_group WHERE student_id IN ({placeholders})",
-            tuple(student_ids),
-        )
-        c.execute(
-            f"DELETE FROM payments WHERE student_id IN ({placeholders})",
-            tuple(student_ids),
-        )
-        c.execute(
-            f"DELETE FROM students WHERE id IN ({placeholders})",
-            tuple(student_ids),
-        )
-        conn.commit()
-    finally:
-        conn.close()
+        c.execute(f"DELETE FROM student_group WHERE student_id IN (SELECT id FROM {table})")
+        c.execute(f"DELETE FROM payments WHERE student_id IN (SELECT id FROM {table})")
+        c.execute(f"DELETE FROM students WHERE id IN (SELECT id FROM {table})")
 
 
 def get_student_counts_by_group() -> list[dict]:
@@ -970,16 +2661,16 @@ def get_student_counts_by_group() -> list[dict]:
     Return total students per group plus a 'TOTAL' row.
 
     Each dict: {"group": str, "count": int}
+
+    Read from the trigger-maintained group_member_counts table, so this is
+    one row per group rather than a scan of student_group.
     """
-    conn = _get_conn(row_factory=True)
-    c = conn.cursor()
-    try:
+    with _session(row_factory=True) as c:
         c.execute(
             """
-            SELECT g.name AS group_name, COUNT(sg.student_id) AS count
+            SELECT g.name AS group_name, COALESCE(mc.members, 0) AS count
             FROM groups g
-            LEFT JOIN student_group sg ON g.id = sg.group_id
-            GROUP BY g.id
+            LEFT JOIN group_member_counts mc ON mc.group_id = g.id
             ORDER BY g.name
             """
         )
@@ -992,5 +2683,237 @@ def get_student_counts_by_group() -> list[dict]:
         total = sum(r["count"] for r in rows)
         rows.append({"group": "TOTAL", "count": total})
         return rows
+
+
+def get_payment_counts_for_month(year: int, month: int) -> list[dict]:
+    """
+    Return per-group payment counts for a month plus a 'TOTAL' row.
+
+    Each dict: {"group": str, "total": int, "paid": int, "unpaid": int,
+                "no_record": int}
+
+    'TOTAL' counts every student once (including groupless ones), so it is
+    not the sum of the group rows. Answered from the summary tables in one
+    row per group.
+    """
+    with _session() as c:
+        c.execute(
+            """
+            SELECT g.name, COALESCE(mc.members, 0),
+                   COALESCE(ps.paid, 0), COALESCE(ps.unpaid, 0)
+            FROM groups g
+            LEFT JOIN group_member_counts mc ON mc.group_id = g.id
+            LEFT JOIN payment_summary ps
+                   ON ps.year = ? AND ps.month = ? AND ps.group_id = g.id
+            ORDER BY g.name
+            """,
+            (year, month),
+        )
+        rows = c.fetchall()
+        c.execute(
+            f"""
+            SELECT 'TOTAL', mc.members, COALESCE(ps.paid, 0), COALESCE(ps.unpaid, 0)
+            FROM group_member_counts mc
+            LEFT JOIN payment_summary ps
+                   ON ps.year = ? AND ps.month = ? AND ps.group_id = mc.group_id
+            WHERE mc.group_id = {_ALL_STUDENTS}
+            """,
+            (year, month),
+        )
+        rows += c.fetchall()
+
+    return [
+        {
+            "group": name,
+            "total": total,
+            "paid": paid,
+            "unpaid": unpaid,
+            "no_record": total - paid - unpaid,
+        }
+        for name, total, paid, unpaid in rows
+    ]
+
+
+def rebuild_payment_summary() -> None:
+    """
+    Recompute the summary tables from scratch.
+
+    The triggers keep them current; this is the repair tool for files edited
+    by other programs (e.g. the sqlite3 shell) with triggers bypassed.
+    """
+    with _session() as c:
+        _fill_payment_summary(c)
+
+
+# ---------------------------------------------------------------------------
+# Online backup
+# ---------------------------------------------------------------------------
+
+@contextmanager
+def frozen_db_file(retries: int = 20) -> Iterator[str]:
+    """
+    Keep the database file consistent and unchanged; yield its path.
+
+    Checkpoints the WAL into the main file, then pins a read snapshot that
+    reads from the main file alone. SQLite doesn't write anything back into
+    the file while such a reader exists (commits pile up in the WAL), so
+    inside the block the file can be read raw, e.g. by backup_store, while
+    other connections keep writing.
+
+    Raises DBError if commits by other connections keep slipping in
+    between the checkpoint and the pin.
+    """
+    path = _db_path()
+    conn = _open_conn(path)
+    try:
+        for _ in range(retries):
+            before = conn.execute("PRAGMA data_version").fetchone()[0]
+            busy = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()[0]
+            conn.execute("BEGIN")
+            conn.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchall()
+            # Unchanged data_version: nobody committed since the WAL was
+            # emptied, so this snapshot is exactly the main file.
+            if not busy and conn.execute("PRAGMA data_version").fetchone()[0] == before:
+                break
+            conn.rollback()
+            time.sleep(0.05)
+        else:
+            raise DBError("Database is too busy to freeze for a backup; try again.")
+
+        try:
+            yield path
+        finally:
+            conn.rollback()
     finally:
         conn.close()
+
+
+def backup(
+    dest_path: str,
+    progress: Optional[Callable[[int, int], None]] = None,
+    step_pages: int = BACKUP_STEP_PAGES,
+    pause: float = 0.0,
+) -> None:
+    """
+    Copy the database to dest_path with SQLite's online backup API.
+
+    Meant to run on a background thread while the app keeps working. The
+    copy is made from a single read snapshot, so it is consistent and never
+    restarts when another connection writes mid-backup; in WAL mode holding
+    that snapshot doesn't block writers.
+
+    Pages are copied step_pages at a time, calling progress(done, total)
+    after each step and sleeping pause seconds between steps.
+
+    The copy is written to dest_path + ".partial", switched to a rollback
+    journal (a standalone file, no -wal/-shm), checked with PRAGMA
+    quick_check and only then renamed to dest_path. Raises DBError, leaving
+    nothing at dest_path, if the check fails.
+    """
+    tmp_path = dest_path + ".partial"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    def on_step(status: int, remaining: int, total: int) -> None:
+        if progress is not None:
+            progress(total - remaining, total)
+        if pause and remaining:
+            time.sleep(pause)
+
+    src = _open_conn(_db_path())
+    try:
+        dst = sqlite3.connect(tmp_path)
+        try:
+            # Pin one snapshot for every step. Without an open read
+            # transaction each step takes a fresh one, and any commit by
+            # another connection in between restarts the copy from page 1.
+            src.execute("BEGIN")
+            src.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchall()
+            src.backup(dst, pages=step_pages, progress=on_step)
+            src.rollback()
+
+            dst.execute("PRAGMA journal_mode = DELETE")
+            problems = [r[0] for r in dst.execute("PRAGMA quick_check")]
+        finally:
+            dst.close()
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    finally:
+        src.close()
+
+    if problems != ["ok"]:
+        os.remove(tmp_path)
+        raise DBError("Backup failed quick_check: " + "; ".join(problems[:5]))
+    os.replace(tmp_path, dest_path)
+
+
+def restore(
+    src_path: str,
+    progress: Optional[Callable[[int, int], None]] = None,
+    step_pages: int = BACKUP_STEP_PAGES,
+    verify: bool = True,
+) -> None:
+    """
+    Replace the contents of the live database with the database file src_path.
+
+    Uses SQLite's online backup API with the live file as the destination,
+    so nothing has to be closed and the app keeps running. The copy is one
+    write transaction however many steps it takes: other connections go on
+    reading the old data until it commits and see the restored data from
+    their next statement on; their writes wait for it (busy_timeout). If
+    anything fails the live database is left as it was.
+
+    verify runs PRAGMA quick_check on src_path first (skip it for a file
+    that was just checked, e.g. by backup_store). A backup from an older
+    schema version is migrated afterwards, like at startup. Raises DBError
+    for a damaged file, one written by a newer version of the app, or one
+    whose page size differs from the live file (WAL mode can't change it).
+    """
+    if not os.path.isfile(src_path):
+        raise NotFoundError(f"Backup file not found: {src_path}")
+
+    def on_step(status: int, remaining: int, total: int) -> None:
+        if progress is not None:
+            progress(total - remaining, total)
+
+    src = sqlite3.connect(src_path)
+    try:
+        try:
+            if verify:
+                problems = [r[0] for r in src.execute("PRAGMA quick_check")]
+                if problems != ["ok"]:
+                    raise DBError("Backup failed quick_check: " + "; ".join(problems[:5]))
+            version = src.execute("PRAGMA user_version").fetchone()[0]
+            page_size = src.execute("PRAGMA page_size").fetchone()[0]
+        except sqlite3.DatabaseError as e:
+            raise DBError(f"Not a usable database file: {e}") from e
+        if version > SCHEMA_VERSION:
+            raise DBError(
+                f"Backup has schema version {version}; this program only "
+                f"knows up to {SCHEMA_VERSION}."
+            )
+
+        dst = _open_conn(_db_path())
+        try:
+            if dst.execute("PRAGMA page_size").fetchone()[0] != page_size:
+                raise DBError(
+                    f"Backup page size ({page_size}) differs from the live database's."
+                )
+            src.backup(dst, pages=step_pages, progress=on_step)
+        finally:
+            dst.close()
+    finally:
+        src.close()
+
+    # Other threads' group caches see the new data_version; this module's
+    # per-file caches don't.
+    _fts_present.pop(_db_path(), None)
+    _invalidate_groups()
+    init_db()
+
+
+_slow_ms = os.environ.get("ELNAJAH_DB_SLOW_MS")
+if _slow_ms:
+    enable_instrumentation(slow_ms=float(_slow_ms))
@@ -22,6 +22,8 @@ from DB import (
     get_students_with_payment_for_month,
     get_payment,
     upsert_payment,
+    transaction,
+    change_token,
 )
 
 import menu_tools
@@ -64,6 +66,9 @@ MONTHS = [
 _last_deleted_snapshot = None
 _last_deleted_id = None
 
+# (filters, DB change token) the main tree was last filled with
+_tree_shown_for = None
+
 
 # ---------------------------------------------------------------------------
 # Main window setup
@@ -230,43 +235,50 @@ def _current_year_month():
 def refresh_treeview_all():
     """
     Re-populate the main tree using filters + search.
+
+    Does nothing if the filters are the same as last time and the database
+    hasn't changed since (see DB.change_token).
     """
-    for item in tree.get_children():
-        tree.delete(item)
+    global _tree_shown_for
 
     year, month = _current_year_month()
     search_text = search_var.get().strip()
     search_type = search_type_var.get()
+    filter_group = group_filter_var.get()
 
     try:
+        shown_for = ((year, month, search_text, search_type, filter_group), change_token())
+        if shown_for == _tree_shown_for:
+            return
+        _tree_shown_for = None
+
+        for item in tree.get_children():
+            tree.delete(item)
+
         rows = get_students_with_payment_for_month(
             year=year,
             month=month,
             search_text=search_text,
             search_type=search_type,
+            group_name=None if filter_group == "All" else filter_group,
         )
     except Exception as e:
         messagebox.showerror("DB Error", f"Could not load students:\n{e}")
         return
 
-    filter_group = group_filter_var.get()
     for row in rows:
-        # Filter by group if not "All"
-        groups = [g.strip() for g in (row.get("groups") or "").split(",") if g.strip()]
-        if filter_group != "All" and filter_group not in groups:
-            continue
-
         tree.insert(
             "",
             "end",
             values=(
-                row["id"],
-                row["name"],
-                row.get("groups", ""),
-                row.get("join_date", ""),
-                row.get("monthly_payment", ""),
+                row.id,
+                row.name,
+                row.groups,
+                row.join_date,
+                row.monthly_payment,
             ),
         )
+    _tree_shown_for = shown_for
 
 
 def on_search_pressed(event=None):
@@ -378,9 +390,10 @@ def open_add_student():
         pay_status = pay_var.get() or "unpaid"
 
         try:
-            sid = create_student(name=name, student_id=manual_id)
-            set_student_groups(sid, selected_groups)
-            upsert_payment(sid, year=year, month=month, paid=pay_status)
+            with transaction():
+                sid = create_student(name=name, student_id=manual_id)
+                set_student_groups(sid, selected_groups)
+                upsert_payment(sid, year=year, month=month, paid=pay_status)
         except AlreadyExistsError as e:
             messagebox.showerror("Duplicate ID", str(e))
             return
@@ -575,10 +588,11 @@ def open_edit_student_modal():
             return
 
         try:
-            update_student(sid, name=name)
             chosen_groups = [g for g, v in group_vars.items() if v.get()]
-            set_student_groups(sid, chosen_groups)
-            upsert_payment(sid, year=year, month=month, paid=pay_var.get())
+            with transaction():
+                update_student(sid, name=name)
+                set_student_groups(sid, chosen_groups)
+                upsert_payment(sid, year=year, month=month, paid=pay_var.get())
         except DBError as e:
             messagebox.showerror("DB Error", str(e))
             return
@@ -646,6 +660,20 @@ def undo_delete():
     refresh_treeview_all()
 
 
+def refresh_after_restore():
+    """
+    Reload everything shown after a backup was restored into the live DB.
+    """
+    global _last_deleted_snapshot, _last_deleted_id
+
+    # The undo snapshot belongs to the data that was just replaced
+    _last_deleted_snapshot = None
+    _last_deleted_id = None
+    refresh_group_filter()
+    refresh_treeview_all()
+    payments_log.refresh_open_windows()
+
+
 # ---------------------------------------------------------------------------
 # Bottom buttons
 # ---------------------------------------------------------------------------
@@ -759,13 +787,18 @@ tools_menu = Menu(menubar, tearoff=0)
 tools_menu.add_command(label="Delete Groupless Students", command=menu_tools.delete_groupless_students)
 tools_menu.add_command(label="Merge Duplicate Students", command=menu_tools.merge_duplicate_students)
 tools_menu.add_command(label="Bulk Remove Group if Only Group", command=menu_tools.bulk_remove_group_if_only_group)
+tools_menu.add_command(label="Rebuild Summary Tables", command=menu_tools.rebuild_summary_tables)
 menubar.add_cascade(label="Tools", menu=tools_menu)
 
 # Backup menu
 backup_menu = Menu(menubar, tearoff=0)
 backup_menu.add_command(label="Backup Database", command=menu_tools.backup_database)
+backup_menu.add_command(label="Compressed Backup", command=menu_tools.backup_database_compressed)
 backup_menu.add_command(label="Restore Database", command=menu_tools.restore_backup)
 backup_menu.add_command(label="Purge Old Backups", command=menu_tools.purge_old_backups)
+backup_menu.add_separator()
+backup_menu.add_command(label="Take Snapshot", command=menu_tools.take_snapshot)
+backup_menu.add_command(label="Restore Snapshot", command=menu_tools.restore_snapshot)
 menubar.add_cascade(label="Backup", menu=backup_menu)
 
 # Export menu
@@ -792,6 +825,7 @@ menubar.add_cascade(label="Help", menu=help_menu)
 menu_tools.ElNajahSchool = ElNajahSchool
 menu_tools.refresh_treeview_all = refresh_treeview_all
 menu_tools.get_all_groups = get_all_groups
+menu_tools.refresh_after_restore = refresh_after_restore
 
 payments_log.ElNajahSchool = ElNajahSchool
 payments_log.get_all_groups = get_all_groups
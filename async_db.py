@@ -0,0 +1,256 @@
+"""
+Asyncio facade over DB.py.
+
+    adb = AsyncDB()
+    rows = await adb.get_students_with_payment_for_month(2025, 1)
+    async for student in adb.iter_all_students():
+        ...
+    await adb.close()
+
+The DB query and write functions (see _FUNCTIONS) are available on AsyncDB
+under the same name as coroutine functions (the iter_* ones as async
+generators); connection, lifecycle and backup helpers are not, since on a
+worker thread they would act on the wrong connection. Calls run on the
+AsyncDB's own worker threads; DB connections are per thread, so each worker
+has its own and the event loop thread never touches SQLite.
+
+- At most max_pending calls are queued or running; further calls wait
+  (without blocking the loop) until one finishes.
+- Cancelling the awaiting task drops a call that hasn't started, and
+  interrupts the SQLite statement of one that is running (the DB function
+  then rolls back and the task sees CancelledError).
+- DB.transaction() can't span awaits; put the whole unit of work in one
+  function and pass it to run().
+"""
+
+from __future__ import annotations
+
+import asyncio
+import functools
+import inspect
+import itertools
+import queue
+import threading
+from typing import Any, AsyncIterator, Callable, Optional
+
+import DB
+
+
+_PENDING, _RUNNING, _DONE, _CANCELLED = range(4)
+
+# DB functions AsyncDB forwards. Everything else in DB works on the calling
+# thread's connection or on the process (use_database, close_connections,
+# init_db, transaction, instrumentation, backup/restore...) and is left to
+# the loop thread or to run().
+_FUNCTIONS = frozenset({
+    # students
+    "create_student", "update_student", "get_student", "get_all_students",
+    "iter_all_students", "delete_student", "restore_student_snapshot",
+    "create_students_bulk", "delete_students_by_ids", "get_groupless_students",
+    "merge_students", "find_duplicate_students", "merge_all_duplicates",
+    # groups
+    "create_group", "delete_group_by_name", "get_all_groups",
+    "set_student_groups", "get_student_groups", "get_groups_for_students",
+    "get_group_students", "set_groups_bulk", "add_students_to_group",
+    # payments
+    "upsert_payment", "upsert_payments_bulk", "get_payment",
+    "get_payments_for_student", "get_payments_for_student_academic_year",
+    "get_payment_matrix", "get_students_with_payment_for_month",
+    "iter_students_with_payment_for_month", "get_unpaid_students_for_month",
+    "get_payment_events", "get_payments_as_of", "get_unpaid_students_as_of",
+    "rebuild_payment_summary",
+    # counts
+    "get_student_counts_by_group", "get_payment_counts_for_month",
+    "get_schema_version",
+})
+
+
+class _Job:
+    """One call handed to a worker thread."""
+    __slots__ = ("fn", "args", "kwargs", "loop", "future", "lock", "state", "conn")
+
+    def __init__(self, fn, args, kwargs, loop, future):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.loop = loop
+        self.future = future
+        self.lock = threading.Lock()
+        self.state = _PENDING
+        self.conn = None
+
+
+def _deliver(future: asyncio.Future, value=None, exc: Optional[BaseException] = None) -> None:
+    """Runs on the event loop: complete future unless it was cancelled meanwhile."""
+    if future.done():
+        return
+    if exc is not None:
+        future.set_exception(exc)
+    else:
+        future.set_result(value)
+
+
+class AsyncDB:
+    """
+    Run DB functions on dedicated worker threads and await their results.
+
+    workers: threads (and so connections) serving calls. SQLite in WAL mode
+             lets readers run next to one writer, so 2 keeps a long report
+             from holding up a quick save.
+    max_pending: calls allowed to be queued or running at once.
+    """
+
+    def __init__(self, workers: int = 2, max_pending: int = 32):
+        if workers < 1 or max_pending < 1:
+            raise ValueError("workers and max_pending must be at least 1")
+        self._jobs: queue.SimpleQueue = queue.SimpleQueue()
+        self._slots = asyncio.Semaphore(max_pending)
+        self._closed = False
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"AsyncDB-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for t in self._threads:
+            t.start()
+
+    # -- worker side ---------------------------------------------------------
+
+    def _worker(self) -> None:
+        try:
+            while True:
+                job = self._jobs.get()
+                if job is None:
+                    return
+                self._run_job(job)
+        finally:
+            DB.close_connections()
+
+    def _run_job(self, job: _Job) -> None:
+        with job.lock:
+            if job.state == _CANCELLED:
+                self._hand_back(job, None)
+                return
+            job.state = _RUNNING
+            job.conn = DB._get_conn()
+        try:
+            value, exc = job.fn(*job.args, **job.kwargs), None
+        except BaseException as e:  # delivered to the awaiting task
+            value, exc = None, e
+        with job.lock:
+            if job.state == _CANCELLED:
+                self._hand_back(job, None)
+                return
+            job.state = _DONE
+        self._hand_back(job, (value, exc))
+
+    def _hand_back(self, job: _Job, result: Optional[tuple]) -> None:
+        """
+        Tell the loop this worker is done with job, so its max_pending slot
+        is only freed once the call has really stopped (a cancelled call may
+        run on until its next statement).
+        """
+        try:
+            job.loop.call_soon_threadsafe(self._job_finished, job.future, result)
+        except RuntimeError:
+            pass  # the loop is closed; nobody is waiting any more
+
+    # -- loop side -------------------------------------------------------------
+
+    def _job_finished(self, future: asyncio.Future, result: Optional[tuple]) -> None:
+        self._slots.release()
+        if result is not None:
+            _deliver(future, *result)
+
+    def _on_future_done(self, job: _Job, future: asyncio.Future) -> None:
+        if not future.cancelled():
+            return
+        with job.lock:
+            if job.state == _RUNNING and job.conn is not None:
+                # Makes the running statement fail with "interrupted"; the
+                # DB function's _session() then rolls back.
+                job.conn.interrupt()
+            job.state = _CANCELLED
+
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Run fn(*args, **kwargs) on a worker thread and return its result.
+
+        fn may call any number of DB functions, e.g. inside DB.transaction().
+        """
+        if self._closed:
+            raise RuntimeError("AsyncDB is closed")
+        await self._slots.acquire()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        job = _Job(fn, args, kwargs, loop, future)
+        future.add_done_callback(functools.partial(self._on_future_done, job))
+        self._jobs.put(job)
+        return await future
+
+    async def _iterate(self, gen_fn, args, kwargs) -> AsyncIterator[Any]:
+        """Drive a DB iter_* generator on the workers, one page per call."""
+        page_size = kwargs.get("page_size", DB.STREAM_PAGE_SIZE)
+        gen = gen_fn(*args, **kwargs)
+        try:
+            while True:
+                page = await self.run(lambda: list(itertools.islice(gen, page_size)))
+                if not page:
+                    return
+                for item in page:
+                    yield item
+        finally:
+            await self.run(gen.close)
+
+    async def _broadcast(self, fn: Callable[[], Any]) -> None:
+        """Run fn once on every worker thread."""
+        barrier = threading.Barrier(len(self._threads))
+
+        def step():
+            fn()
+            # Holding each worker here until all have arrived guarantees
+            # every thread takes exactly one of these jobs.
+            barrier.wait()
+
+        await asyncio.gather(*(self.run(step) for _ in self._threads))
+
+    async def close_connections(self) -> None:
+        """Close every worker's connections (e.g. before replacing the DB file)."""
+        await self._broadcast(DB.close_connections)
+
+    async def close(self) -> None:
+        """Finish queued calls, close the workers' connections and stop them."""
+        if self._closed:
+            return
+        self._closed = True
+        for _ in self._threads:
+            self._jobs.put(None)
+        await asyncio.get_running_loop().run_in_executor(
+            None, lambda: [t.join() for t in self._threads]
+        )
+
+    async def __aenter__(self) -> "AsyncDB":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    def __getattr__(self, name: str):
+        if name == "transaction":
+            raise AttributeError(
+                "transaction() can't span awaits; pass a function that uses "
+                "DB.transaction() to AsyncDB.run() instead"
+            )
+        if name not in _FUNCTIONS:
+            raise AttributeError(f"AsyncDB has no DB query or write function {name!r}")
+        fn = getattr(DB, name)
+
+        if inspect.isgeneratorfunction(fn):
+            @functools.wraps(fn)
+            def iterate(*args, **kwargs):
+                return self._iterate(fn, args, kwargs)
+            return iterate
+
+        @functools.wraps(fn)
+        async def call(*args, **kwargs):
+            return await self.run(fn, *args, **kwargs)
+        return call
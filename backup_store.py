@@ -0,0 +1,902 @@
+"""
+Deduplicated, incremental backup store, and compressed single-file backups.
+
+    store = BackupStore("backups/store")
+    snap = store.snapshot()                  # the live database (DB.DB_PATH)
+    store.restore(snap.name, "restored.db")
+
+A snapshot splits the database file into its pages and hashes each one.
+Pages the store hasn't seen before are appended to a new pack file; the
+rest are only referenced. An hourly snapshot therefore costs the pages that
+changed in that hour (about 1 MB for a busy hour on a 70 MB school) instead
+of a full copy.
+
+Layout of the store directory:
+
+    store.db         index: chunks (page hash -> pack file, offset), one
+                     manifest row per snapshot (metadata + its page list)
+                     and the retention periods each snapshot keeps
+    packs/NAME.pack  the pages first stored by snapshot NAME, back to back
+
+Snapshots are pruned by the same tiered retention as BackupCatalog (see
+DEFAULT_RETENTION) each time one is added, so the store stays bounded.
+
+write_compressed_backup() / restore_compressed_backup() make and read
+standalone .db.xz / .db.gz copies (plain xz and gzip files, so other tools
+open them too), streamed through fixed-size buffers.
+
+BackupCatalog keeps an index (catalog.db) of the single-file backups in
+the backups folder, with each file's size, SHA-256, schema version and
+row counts, and prunes them by tiered retention as new ones are added:
+
+    catalog = BackupCatalog("backups")
+    entry = catalog.backup(codec="xz")       # write, record, prune
+    for entry in catalog.entries():          # no file is opened or stat'ed
+        ...
+"""
+
+from __future__ import annotations
+
+import gzip
+import hashlib
+import itertools
+import lzma
+import mmap
+import os
+import sqlite3
+import threading
+import zlib
+from array import array
+from contextlib import closing
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Iterator, Optional
+
+import DB
+
+
+# Bytes moved per read() call when snapshotting, compressing or restoring.
+READ_BUFFER_SIZE = 1024 * 1024
+
+# Compressed backups: file suffix -> codec. The default is the best
+# ratio per second of CPU on generated schools; see
+# python -m benchmarks.compression for the numbers on a given database.
+COMPRESSED_SUFFIXES = {".xz": "xz", ".gz": "gz"}
+DEFAULT_CODEC = "xz"
+DEFAULT_LEVEL = 0
+
+# SQLite never uses the page holding byte 2**30 (its lock bytes live
+# there), and on Windows reading it fails while the file is locked.
+_LOCK_BYTE_OFFSET = 0x40000000
+
+# Snapshots in one process run one at a time (they hand out chunk ids).
+_snapshot_lock = threading.Lock()
+
+# Page hashes looked up in store.db per query while snapshotting.
+_LOOKUP_BATCH = 500
+
+
+@dataclass(slots=True)
+class Snapshot:
+    name: str
+    created: str            # ISO timestamp
+    db_size: int            # bytes
+    page_size: int
+    schema_version: int     # PRAGMA user_version of the backed-up file
+    new_pages: int          # pages this snapshot added to the store
+
+
+def _encode_page_list(chunk_ids: list[int]) -> bytes:
+    """Delta-encode and compress; unchanged runs of pages shrink to almost nothing."""
+    deltas = array("q", (b - a for a, b in zip([0] + chunk_ids, chunk_ids)))
+    return zlib.compress(deltas.tobytes())
+
+
+def _decode_page_list(blob: bytes) -> list[int]:
+    deltas = array("q")
+    deltas.frombytes(zlib.decompress(blob))
+    return list(itertools.accumulate(deltas))
+
+
+def _header(path: str) -> tuple[int, int]:
+    """Return (page_size, user_version) from a database file header."""
+    with open(path, "rb") as f:
+        header = f.read(100)
+    if len(header) < 100 or not header.startswith(b"SQLite format 3\0"):
+        raise DB.DBError(f"{path} is not an SQLite database.")
+    page_size = int.from_bytes(header[16:18], "big")
+    return (65536 if page_size == 1 else page_size), int.from_bytes(header[60:64], "big")
+
+
+def _read_blocks(path: str, page_size: int) -> Iterator[memoryview]:
+    """
+    Yield the file in runs of whole pages through one fixed buffer.
+
+    Each block is only valid until the next one is requested. The lock-byte
+    page is yielded (alone) as zeros without being read.
+    """
+    lock_page = _LOCK_BYTE_OFFSET // page_size
+    per_read = max(1, READ_BUFFER_SIZE // page_size)
+    buf = memoryview(bytearray(per_read * page_size))
+    zero_page = memoryview(bytes(page_size))
+
+    with open(path, "rb", buffering=0) as f:
+        n_pages = os.fstat(f.fileno()).st_size // page_size
+        i = 0
+        while i < n_pages:
+            if i == lock_page:
+                f.seek(page_size, os.SEEK_CUR)
+                yield zero_page
+                i += 1
+                continue
+            count = min(per_read, n_pages - i)
+            if i < lock_page:
+                count = min(count, lock_page - i)
+            want = count * page_size
+            got = 0
+            while got < want:
+                n = f.readinto(buf[got:want])
+                if not n:
+                    raise DB.DBError(f"{path} shrank while it was being read.")
+                got += n
+            yield buf[:want]
+            i += count
+
+
+def _read_pages(path: str, page_size: int) -> Iterator[memoryview]:
+    """Yield the file page by page; see _read_blocks()."""
+    for block in _read_blocks(path, page_size):
+        for k in range(0, len(block), page_size):
+            yield block[k:k + page_size]
+
+
+class _PackReader:
+    """Random access to a pack file, memory-mapped where the platform allows."""
+
+    def __init__(self, path: str):
+        self._file = open(path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            self._map = None
+
+    def read(self, offset: int, size: int) -> bytes:
+        if self._map is not None:
+            return self._map[offset:offset + size]
+        self._file.seek(offset)
+        return self._file.read(size)
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+        self._file.close()
+
+
+class BackupStore:
+    """
+    A directory of deduplicated database snapshots.
+
+    retention: tiers as in BackupCatalog (default DEFAULT_RETENTION),
+               applied every time a snapshot is added.
+    """
+
+    def __init__(
+        self,
+        root: str = os.path.join("backups", "store"),
+        retention: Optional[dict] = None,
+    ):
+        self.root = root
+        self.packs_dir = os.path.join(root, "packs")
+        self.retention = _check_retention(retention)
+        os.makedirs(self.packs_dir, exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.executescript(_RETENTION_SCHEMA)
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS chunks (
+                    id INTEGER PRIMARY KEY,
+                    hash BLOB NOT NULL UNIQUE,
+                    pack TEXT NOT NULL,
+                    offset INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS snapshots (
+                    name TEXT PRIMARY KEY,
+                    created TEXT NOT NULL,
+                    db_size INTEGER NOT NULL,
+                    page_size INTEGER NOT NULL,
+                    schema_version INTEGER NOT NULL,
+                    new_pages INTEGER NOT NULL,
+                    pages BLOB NOT NULL     -- _encode_page_list(chunk ids)
+                );
+                """
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(os.path.join(self.root, "store.db"))
+
+    def _pack_path(self, pack: str) -> str:
+        return os.path.join(self.packs_dir, pack + ".pack")
+
+    # -- writing ---------------------------------------------------------------
+
+    def snapshot(self, progress: Optional[Callable[[int, int], None]] = None) -> Snapshot:
+        """
+        Add a snapshot of the live database (DB.DB_PATH) and return it.
+
+        The file is read under DB.frozen_db_file(), so the app can keep
+        writing meanwhile. Only pages not already in the store are written.
+        Snapshots retention no longer keeps are deleted afterwards.
+        progress(done, total) is called every few hundred pages.
+        """
+        with _snapshot_lock:
+            return self._snapshot(progress)
+
+    def _snapshot(self, progress: Optional[Callable[[int, int], None]]) -> Snapshot:
+        created = datetime.now()
+        name = created.strftime("%Y-%m-%d_%H-%M-%S")
+
+        with closing(self._connect()) as conn:
+            taken = {r[0] for r in conn.execute("SELECT name FROM snapshots")}
+            for n in itertools.count(2):
+                if name not in taken and not os.path.exists(self._pack_path(name)):
+                    break
+                name = f"{created:%Y-%m-%d_%H-%M-%S}_{n}"
+
+            next_id = conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM chunks").fetchone()[0]
+
+            pack_path = self._pack_path(name)
+            # hash -> chunk id of every page met in this snapshot; grows with
+            # the database, not with the store
+            known: dict[bytes, int] = {}
+            new_chunks: list[tuple[int, bytes, str, int]] = []
+            page_ids: list[int] = []
+            try:
+                with DB.frozen_db_file() as db_file, open(pack_path, "wb") as pack:
+                    page_size, schema_version = _header(db_file)
+                    total = os.path.getsize(db_file) // page_size
+                    for block in _read_blocks(db_file, page_size):
+                        if progress is not None:
+                            progress(len(page_ids), total)
+                        pages = [block[k:k + page_size] for k in range(0, len(block), page_size)]
+                        digests = [hashlib.sha256(page).digest() for page in pages]
+                        self._look_up(conn, known, digests)
+                        for page, digest in zip(pages, digests):
+                            cid = known.get(digest)
+                            if cid is None:
+                                cid = known[digest] = next_id
+                                next_id += 1
+                                new_chunks.append((cid, digest, name, pack.tell()))
+                                pack.write(page)
+                            page_ids.append(cid)
+                    if progress is not None:
+                        progress(total, total)
+                    pack.flush()
+                    os.fsync(pack.fileno())
+
+                snap = Snapshot(
+                    name=name,
+                    created=created.isoformat(timespec="seconds"),
+                    db_size=len(page_ids) * page_size,
+                    page_size=page_size,
+                    schema_version=schema_version,
+                    new_pages=len(new_chunks),
+                )
+                with conn:
+                    conn.executemany(
+                        "INSERT INTO chunks (id, hash, pack, offset) VALUES (?, ?, ?, ?)",
+                        new_chunks,
+                    )
+                    conn.execute(
+                        "INSERT INTO snapshots VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (
+                            snap.name, snap.created, snap.db_size, snap.page_size,
+                            snap.schema_version, snap.new_pages,
+                            _encode_page_list(page_ids),
+                        ),
+                    )
+                    # Snapshots from before the store had retention are
+                    # fitted in first, oldest first, then the new one.
+                    pruned: set[str] = set()
+                    for old_name, old_created in conn.execute(
+                        "SELECT name, created FROM snapshots"
+                        " WHERE name NOT IN (SELECT name FROM retention)"
+                        " ORDER BY created, name"
+                    ).fetchall():
+                        pruned.update(_retain(
+                            conn, self.retention, old_name, datetime.fromisoformat(old_created)
+                        ))
+                    unused_packs = self._drop(conn, pruned)
+            except BaseException:
+                if os.path.exists(pack_path):
+                    os.remove(pack_path)
+                raise
+
+        if not new_chunks:
+            os.remove(pack_path)
+        self._remove_packs(unused_packs)
+        return snap
+
+    @staticmethod
+    def _look_up(conn: sqlite3.Connection, known: dict[bytes, int], digests: list[bytes]) -> None:
+        """Add to known the chunk ids of the digests the store already has."""
+        wanted = list({d for d in digests if d not in known})
+        for i in range(0, len(wanted), _LOOKUP_BATCH):
+            batch = wanted[i:i + _LOOKUP_BATCH]
+            marks = ", ".join("?" * len(batch))
+            known.update(conn.execute(f"SELECT hash, id FROM chunks WHERE hash IN ({marks})", batch))
+
+    # -- reading ---------------------------------------------------------------
+
+    def snapshots(self) -> list[Snapshot]:
+        """Return all snapshots, newest first."""
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                """
+                SELECT name, created, db_size, page_size, schema_version, new_pages
+                FROM snapshots
+                ORDER BY created DESC, name DESC
+                """
+            ).fetchall()
+        return [Snapshot(*r) for r in rows]
+
+    def restore(
+        self,
+        name: str,
+        dest_path: str,
+        verify: bool = True,
+        progress: Optional[Callable[[int, int], None]] = None,
+    ) -> None:
+        """
+        Rebuild snapshot name as the database file dest_path.
+
+        Pages are streamed from the (memory-mapped) pack files into
+        dest_path + ".partial", which replaces dest_path once complete.
+        With verify, every page is checked against its hash on the way.
+        progress(done, total) is called every few hundred pages.
+        Raises DB.NotFoundError for an unknown name, DB.DBError for a
+        damaged store.
+        """
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT page_size, pages FROM snapshots WHERE name = ?", (name,)
+            ).fetchone()
+            if row is None:
+                raise DB.NotFoundError(f"Snapshot {name!r} not found.")
+            page_size, blob = row
+            page_ids = _decode_page_list(blob)
+            conn.execute("CREATE TEMP TABLE wanted (id INTEGER PRIMARY KEY)")
+            conn.executemany(
+                "INSERT OR IGNORE INTO temp.wanted (id) VALUES (?)", ((i,) for i in page_ids)
+            )
+            where = {
+                cid: (pack, offset, digest)
+                for cid, pack, offset, digest in conn.execute(
+                    "SELECT id, pack, offset, hash FROM chunks WHERE id IN (SELECT id FROM temp.wanted)"
+                )
+            }
+
+        tmp_path = dest_path + ".partial"
+        readers: dict[str, _PackReader] = {}
+        try:
+            with open(tmp_path, "wb", buffering=READ_BUFFER_SIZE) as out:
+                for i, cid in enumerate(page_ids):
+                    if progress is not None and i % 256 == 0:
+                        progress(i, len(page_ids))
+                    pack, offset, digest = where[cid]
+                    reader = readers.get(pack)
+                    if reader is None:
+                        reader = readers[pack] = _PackReader(self._pack_path(pack))
+                    page = reader.read(offset, page_size)
+                    if len(page) != page_size or (
+                        verify and hashlib.sha256(page).digest() != digest
+                    ):
+                        raise DB.DBError(f"Damaged page in pack {pack!r} at offset {offset}.")
+                    out.write(page)
+                if progress is not None:
+                    progress(len(page_ids), len(page_ids))
+                out.flush()
+                os.fsync(out.fileno())
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        finally:
+            for reader in readers.values():
+                reader.close()
+        os.replace(tmp_path, dest_path)
+
+    # -- pruning ---------------------------------------------------------------
+
+    def delete(self, name: str) -> int:
+        """
+        Remove snapshot name; return the bytes of pack files freed.
+
+        Chunks no other snapshot uses are dropped from the index, and pack
+        files left with no used chunks are deleted. A pack that still holds
+        some used pages is kept whole.
+        """
+        with closing(self._connect()) as conn:
+            with conn:
+                if conn.execute("SELECT 1 FROM snapshots WHERE name = ?", (name,)).fetchone() is None:
+                    raise DB.NotFoundError(f"Snapshot {name!r} not found.")
+                unused_packs = self._drop(conn, [name])
+        return self._remove_packs(unused_packs)
+
+    def _drop(self, conn: sqlite3.Connection, names) -> set[str]:
+        """
+        Delete snapshots names and the chunks no remaining snapshot uses
+        (inside the caller's transaction); return the packs left unused.
+        """
+        names = list(names)
+        if not names:
+            return set()
+        old_packs = {r[0] for r in conn.execute("SELECT DISTINCT pack FROM chunks")}
+        conn.executemany("DELETE FROM snapshots WHERE name = ?", ((n,) for n in names))
+        conn.executemany("DELETE FROM retention WHERE name = ?", ((n,) for n in names))
+
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS used (id INTEGER PRIMARY KEY)")
+        conn.execute("DELETE FROM temp.used")
+        for (blob,) in conn.execute("SELECT pages FROM snapshots").fetchall():
+            conn.executemany(
+                "INSERT OR IGNORE INTO temp.used (id) VALUES (?)",
+                ((i,) for i in _decode_page_list(blob)),
+            )
+        conn.execute("DELETE FROM chunks WHERE id NOT IN (SELECT id FROM temp.used)")
+        live_packs = {r[0] for r in conn.execute("SELECT DISTINCT pack FROM chunks")}
+        return old_packs - live_packs
+
+    def _remove_packs(self, packs: set[str]) -> int:
+        freed = 0
+        for pack in packs:
+            path = self._pack_path(pack)
+            if os.path.exists(path):
+                freed += os.path.getsize(path)
+                os.remove(path)
+        return freed
+
+
+# ---------------------------------------------------------------------------
+# Compressed single-file backups
+# ---------------------------------------------------------------------------
+
+def compressed_codec(path: str) -> Optional[str]:
+    """Return "xz" or "gz" for a compressed backup file name, else None."""
+    return COMPRESSED_SUFFIXES.get(os.path.splitext(path)[1].lower())
+
+
+def _open_compressed(fileobj, mode: str, codec: str, level: Optional[int] = None):
+    if codec == "xz":
+        return lzma.LZMAFile(fileobj, mode, preset=level if "w" in mode else None)
+    if codec == "gz":
+        return gzip.GzipFile(
+            fileobj=fileobj, mode=mode, compresslevel=9 if level is None else level
+        )
+    raise ValueError(f"Unknown codec {codec!r}")
+
+
+def write_compressed_backup(
+    dest_path: str,
+    level: Optional[int] = None,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> int:
+    """
+    Write a compressed copy of the live database to dest_path.
+
+    The codec comes from the suffix (.xz or .gz); level defaults to
+    DEFAULT_LEVEL for xz and 6 for gz. The file is read under
+    DB.frozen_db_file() and streamed through one READ_BUFFER_SIZE buffer,
+    so memory use doesn't grow with the database. progress(done, total)
+    counts database bytes. Returns the compressed size.
+    """
+    return _write_compressed(dest_path, level, progress)[0]
+
+
+def _write_compressed(
+    dest_path: str,
+    level: Optional[int],
+    progress: Optional[Callable[[int, int], None]],
+) -> tuple[int, dict]:
+    """write_compressed_backup(); also return describe_db() of what was written."""
+    codec = compressed_codec(dest_path)
+    if codec is None:
+        raise ValueError(f"{dest_path}: expected a .xz or .gz file name")
+    if level is None:
+        level = DEFAULT_LEVEL if codec == "xz" else 6
+
+    tmp_path = dest_path + ".partial"
+    try:
+        with DB.frozen_db_file() as db_file, open(tmp_path, "wb") as raw:
+            stats = describe_db(db_file)
+            page_size, _ = _header(db_file)
+            total = os.path.getsize(db_file)
+            done = 0
+            with _open_compressed(raw, "wb", codec, level) as out:
+                for block in _read_blocks(db_file, page_size):
+                    out.write(block)
+                    done += len(block)
+                    if progress is not None:
+                        progress(done, total)
+            raw.flush()
+            os.fsync(raw.fileno())
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, dest_path)
+    return os.path.getsize(dest_path), stats
+
+
+def restore_compressed_backup(
+    src_path: str,
+    dest_path: str,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> None:
+    """
+    Decompress the backup src_path into the database file dest_path.
+
+    Streams through one READ_BUFFER_SIZE buffer into dest_path + ".partial",
+    checks the result is an intact SQLite database (PRAGMA quick_check),
+    then renames it over dest_path. progress(done, total) counts compressed
+    bytes read. Raises DB.DBError if the result fails the check.
+    """
+    codec = compressed_codec(src_path)
+    if codec is None:
+        raise ValueError(f"{src_path}: expected a .xz or .gz file name")
+
+    tmp_path = dest_path + ".partial"
+    buf = memoryview(bytearray(READ_BUFFER_SIZE))
+    try:
+        with open(src_path, "rb") as raw, open(tmp_path, "wb") as out:
+            total = os.fstat(raw.fileno()).st_size
+            with _open_compressed(raw, "rb", codec) as src:
+                while True:
+                    n = src.readinto(buf)
+                    if not n:
+                        break
+                    out.write(buf[:n])
+                    if progress is not None:
+                        progress(raw.tell(), total)
+            out.flush()
+            os.fsync(out.fileno())
+
+        _header(tmp_path)
+        with closing(sqlite3.connect(tmp_path)) as check:
+            problems = [r[0] for r in check.execute("PRAGMA quick_check")]
+        if problems != ["ok"]:
+            raise DB.DBError("Restored file failed quick_check: " + "; ".join(problems[:5]))
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, dest_path)
+
+
+# ---------------------------------------------------------------------------
+# Backup catalog and tiered retention
+# ---------------------------------------------------------------------------
+
+# Tier -> how many to keep. "last" keeps the newest N backups; every other
+# tier keeps the newest backup of each of its last N periods that have one
+# (so "daily": 7 means the last 7 days with a backup, not the last week).
+DEFAULT_RETENTION = {"last": 5, "hourly": 24, "daily": 7, "weekly": 4, "monthly": 12}
+
+# strftime() pattern naming a backup's period in each tier; the names sort
+# in time order.
+_TIER_PERIODS = {"hourly": "%Y-%m-%d %H", "daily": "%Y-%m-%d", "weekly": "%G-W%V", "monthly": "%Y-%m"}
+
+# One row per (tier, period) kept: the backup or snapshot that keeps it.
+_RETENTION_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS retention (
+        tier TEXT NOT NULL,
+        period TEXT NOT NULL,
+        name TEXT NOT NULL,
+        created TEXT NOT NULL,
+        PRIMARY KEY (tier, period)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS retention_name ON retention (name);
+"""
+
+BACKUP_PREFIX = "elnajah_backup_"
+_BACKUP_TIME_FORMAT = "%Y-%m-%d_%H-%M-%S"
+
+
+@dataclass(slots=True)
+class CatalogEntry:
+    name: str                      # file name inside the catalog's folder
+    created: str                   # ISO timestamp
+    size: int                      # bytes on disk
+    sha256: str                    # hex digest of the file as stored
+    schema_version: Optional[int]  # None: not known (see BackupCatalog.sync)
+    students: Optional[int]
+    groups: Optional[int]
+    payments: Optional[int]
+    tiers: str                     # retention tiers keeping it, e.g. "last, daily"
+
+
+def describe_db(path: str) -> dict:
+    """
+    Return the schema version and row counts of a database file.
+
+    The file is opened immutable (no locks, -wal ignored), so it must not
+    change while this runs: a standalone backup, or the live file inside
+    DB.frozen_db_file(). Counts of tables the file doesn't have are None.
+    """
+    uri = "file:" + os.path.abspath(path).replace("?", "%3f").replace("#", "%23") + "?immutable=1"
+    with closing(sqlite3.connect(uri, uri=True)) as conn:
+        stats = {"schema_version": conn.execute("PRAGMA user_version").fetchone()[0]}
+        tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        for table in ("students", "groups", "payments"):
+            stats[table] = (
+                conn.execute(f'SELECT count(*) FROM "{table}"').fetchone()[0]
+                if table in tables else None
+            )
+    return stats
+
+
+def _file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    buf = memoryview(bytearray(READ_BUFFER_SIZE))
+    with open(path, "rb", buffering=0) as f:
+        while n := f.readinto(buf):
+            digest.update(buf[:n])
+    return digest.hexdigest()
+
+
+def _check_retention(retention: Optional[dict]) -> dict:
+    retention = dict(DEFAULT_RETENTION if retention is None else retention)
+    unknown = set(retention) - set(_TIER_PERIODS) - {"last"}
+    if unknown:
+        raise ValueError(f"Unknown retention tiers: {sorted(unknown)}")
+    return retention
+
+
+def _retain(conn: sqlite3.Connection, retention: dict, name: str, created: datetime) -> list[str]:
+    """
+    Give name (created at created) the retention periods it now keeps and
+    drop the rest, in conn's retention table.
+
+    Touches one period per tier plus the one falling off each tier's
+    end, so the work doesn't depend on how many items there are.
+    Returns the names no tier keeps any more; the caller deletes them.
+    """
+    stamp = created.isoformat(timespec="seconds")
+    losers = {name}
+    for tier, keep in retention.items():
+        if keep <= 0:
+            continue
+        pattern = _TIER_PERIODS.get(tier)
+        period = f"{stamp} {name}" if pattern is None else created.strftime(pattern)
+        holder = conn.execute(
+            "SELECT name, created FROM retention WHERE tier = ? AND period = ?",
+            (tier, period),
+        ).fetchone()
+        # The newest item of a period keeps it.
+        if holder is not None and (holder[1], holder[0]) >= (stamp, name):
+            continue
+        if holder is not None:
+            losers.add(holder[0])
+        conn.execute(
+            "INSERT OR REPLACE INTO retention VALUES (?, ?, ?, ?)",
+            (tier, period, name, stamp),
+        )
+        expired = conn.execute(
+            "SELECT period, name FROM retention WHERE tier = ? "
+            "ORDER BY period DESC LIMIT -1 OFFSET ?",
+            (tier, keep),
+        ).fetchall()
+        for old_period, old_name in expired:
+            conn.execute(
+                "DELETE FROM retention WHERE tier = ? AND period = ?", (tier, old_period)
+            )
+            losers.add(old_name)
+
+    return [
+        n for n in sorted(losers)
+        if conn.execute("SELECT 1 FROM retention WHERE name = ?", (n,)).fetchone() is None
+    ]
+
+
+def _is_backup_file(name: str) -> bool:
+    base = name[:-3] if compressed_codec(name) else name
+    return base.endswith(".db") and name != "catalog.db"
+
+
+class BackupCatalog:
+    """
+    Index of the single-file backups in a folder, with tiered retention.
+
+    Every backup is recorded once, when it's made (backup()) or first seen
+    (sync()); listing reads only catalog.db. Retention is kept up to date
+    incrementally: each tier holds one row per period it keeps, so adding
+    a backup replaces at most the previous holder of its period and drops
+    the oldest period of each tier. Pruning therefore costs the same with
+    ten backups in the folder as with a thousand.
+    """
+
+    def __init__(self, root: str = "backups", retention: Optional[dict] = None):
+        self.root = root
+        self.retention = _check_retention(retention)
+        os.makedirs(root, exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.executescript(_RETENTION_SCHEMA)
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS backups (
+                    name TEXT PRIMARY KEY,
+                    created TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    sha256 TEXT NOT NULL,
+                    schema_version INTEGER,
+                    students INTEGER,
+                    groups INTEGER,
+                    payments INTEGER
+                );
+                CREATE INDEX IF NOT EXISTS backups_created ON backups (created);
+                """
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(
+            os.path.join(self.root, "catalog.db"), timeout=DB.BUSY_TIMEOUT_MS / 1000
+        )
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+    # -- writing ---------------------------------------------------------------
+
+    def backup(
+        self,
+        codec: Optional[str] = None,
+        progress: Optional[Callable[[int, int], None]] = None,
+    ) -> CatalogEntry:
+        """
+        Back up the live database into the folder, record it and prune.
+
+        codec None makes a plain copy with DB.backup(); "xz" or "gz" a
+        compressed one with write_compressed_backup(). Returns the entry.
+        """
+        created = datetime.now()
+        name = BACKUP_PREFIX + created.strftime(_BACKUP_TIME_FORMAT) + ".db"
+        if codec is not None:
+            name += "." + codec
+        path = self.path(name)
+        if codec is None:
+            DB.backup(path, progress=progress)
+            stats = describe_db(path)
+        else:
+            _, stats = _write_compressed(path, None, progress)
+        return self._add(name, created, stats)[0]
+
+    def _created_of(self, name: str) -> datetime:
+        stamp = name[len(BACKUP_PREFIX):].split(".", 1)[0]
+        try:
+            return datetime.strptime(stamp, _BACKUP_TIME_FORMAT)
+        except ValueError:
+            return datetime.fromtimestamp(os.path.getmtime(self.path(name)))
+
+    def _add(
+        self, name: str, created: datetime, stats: Optional[dict]
+    ) -> tuple[CatalogEntry, list[str]]:
+        """Record name and apply retention; return its entry and the names pruned."""
+        path = self.path(name)
+        stats = stats or {}
+        row = (
+            name, created.isoformat(timespec="seconds"), os.path.getsize(path),
+            _file_sha256(path), stats.get("schema_version"),
+            stats.get("students"), stats.get("groups"), stats.get("payments"),
+        )
+        with closing(self._connect()) as conn:
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute("DELETE FROM retention WHERE name = ?", (name,))
+                conn.execute("INSERT OR REPLACE INTO backups VALUES (?, ?, ?, ?, ?, ?, ?, ?)", row)
+                pruned = self._retain(conn, name, created)
+            entry = self._entries(conn, "WHERE b.name = ?", (name,))
+        for gone in pruned:
+            if os.path.exists(self.path(gone)):
+                os.remove(self.path(gone))
+        # No entry left: retention dropped a backup older than all it keeps.
+        return (entry[0] if entry else CatalogEntry(*row, tiers="")), pruned
+
+    def _retain(self, conn: sqlite3.Connection, name: str, created: datetime) -> list[str]:
+        """Apply retention to the new backup name; return (and unindex) the backups pruned."""
+        pruned = _retain(conn, self.retention, name, created)
+        conn.executemany("DELETE FROM backups WHERE name = ?", ((n,) for n in pruned))
+        return pruned
+
+    def sync(self, progress: Optional[Callable[[int, int], None]] = None) -> tuple[int, int, int]:
+        """
+        Bring the catalog in line with the folder; return (added, forgotten, pruned).
+
+        Backup files the catalog doesn't know (made before it existed, or
+        copied in) are recorded, oldest first, and retention applied to
+        them; entries whose file is gone are forgotten. A changed retention
+        policy is applied to the backups already recorded. Only new files
+        are opened. progress(done, total) counts new files.
+        """
+        with os.scandir(self.root) as it:
+            on_disk = {e.name for e in it if e.is_file() and _is_backup_file(e.name)}
+        with closing(self._connect()) as conn:
+            with conn:
+                known = {r[0] for r in conn.execute("SELECT name FROM backups")}
+                missing = known - on_disk
+                for gone in missing:
+                    conn.execute("DELETE FROM retention WHERE name = ?", (gone,))
+                    conn.execute("DELETE FROM backups WHERE name = ?", (gone,))
+
+                tiers = list(self.retention)
+                marks = ", ".join("?" * len(tiers))
+                conn.execute(f"DELETE FROM retention WHERE tier NOT IN ({marks})", tiers)
+                for tier, keep in self.retention.items():
+                    conn.execute(
+                        "DELETE FROM retention WHERE tier = ? AND period NOT IN ("
+                        " SELECT period FROM retention WHERE tier = ?"
+                        " ORDER BY period DESC LIMIT ?)",
+                        (tier, tier, max(keep, 0)),
+                    )
+                dropped = [
+                    r[0] for r in conn.execute(
+                        "SELECT name FROM backups WHERE name NOT IN (SELECT name FROM retention)"
+                    )
+                ]
+                conn.executemany("DELETE FROM backups WHERE name = ?", ((n,) for n in dropped))
+        for gone in dropped:
+            if os.path.exists(self.path(gone)):
+                os.remove(self.path(gone))
+
+        new = sorted(on_disk - known, key=self._created_of)
+        pruned = len(dropped)
+        for i, name in enumerate(new):
+            if progress is not None:
+                progress(i, len(new))
+            stats = None if compressed_codec(name) else describe_db(self.path(name))
+            pruned += len(self._add(name, self._created_of(name), stats)[1])
+        if progress is not None:
+            progress(len(new), len(new))
+        return len(new), len(missing), pruned
+
+    # -- reading ---------------------------------------------------------------
+
+    def _entries(self, conn: sqlite3.Connection, where: str = "", params: tuple = ()) -> list[CatalogEntry]:
+        tiers = {tier: i for i, tier in enumerate(self.retention)}
+        rows = conn.execute(
+            f"""
+            SELECT b.name, b.created, b.size, b.sha256, b.schema_version,
+                   b.students, b.groups, b.payments,
+                   (SELECT group_concat(r.tier) FROM retention r WHERE r.name = b.name)
+            FROM backups b
+            {where}
+            ORDER BY b.created DESC, b.name DESC
+            """,
+            params,
+        ).fetchall()
+        out = []
+        for r in rows:
+            kept_by = sorted(r[8].split(",") if r[8] else [], key=lambda t: tiers.get(t, len(tiers)))
+            out.append(CatalogEntry(*r[:8], tiers=", ".join(kept_by)))
+        return out
+
+    def entries(self) -> list[CatalogEntry]:
+        """Return every recorded backup, newest first."""
+        with closing(self._connect()) as conn:
+            return self._entries(conn)
+
+    def verify(self, name: str) -> None:
+        """
+        Check the file name still matches its recorded size and checksum.
+
+        Raises DB.NotFoundError if it isn't in the catalog or is missing,
+        DB.DBError if it changed.
+        """
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT size, sha256 FROM backups WHERE name = ?", (name,)
+            ).fetchone()
+        if row is None:
+            raise DB.NotFoundError(f"Backup {name!r} is not in the catalog.")
+        path = self.path(name)
+        if not os.path.exists(path):
+            raise DB.NotFoundError(f"Backup file {path} is missing.")
+        if os.path.getsize(path) != row[0] or _file_sha256(path) != row[1]:
+            raise DB.DBError(f"Backup {name} is damaged (checksum mismatch).")
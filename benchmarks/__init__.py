@@ -0,0 +1,8 @@
+"""
+Performance benchmarks for the DB layer.
+
+    python -m benchmarks.datagen school.db   # build a synthetic school
+    python -m benchmarks                     # time everything, compare to baseline
+
+See benchmarks/run.py for the options.
+"""
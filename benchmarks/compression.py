@@ -0,0 +1,102 @@
+"""
+Compression report for backup_store's compressed backups.
+
+    python -m benchmarks.compression                      # 50k students
+    python -m benchmarks.compression --db elnajah.db      # a real file
+    python -m benchmarks.compression --codecs xz:0,1 gz:1,6
+
+For every codec and level it writes a compressed backup of the database
+with backup_store.write_compressed_backup() and restores it with
+restore_compressed_backup(), then prints the ratio and both throughputs
+(MB of database per second). Restore times include the quick_check.
+Use the table to pick backup_store.DEFAULT_CODEC / DEFAULT_LEVEL.
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import DB
+import backup_store
+from benchmarks.datagen import SchoolSpec
+from benchmarks.run import DEFAULT_DATA_DIR, _dataset
+
+DEFAULT_CODECS = ("xz:0,1,3,6", "gz:1,6,9")
+
+
+def _parse_codecs(specs: list[str]) -> list[tuple[str, int]]:
+    """["xz:0,1", "gz:6"] -> [("xz", 0), ("xz", 1), ("gz", 6)]"""
+    out = []
+    for spec in specs:
+        codec, _, levels = spec.partition(":")
+        out += [(codec, int(level)) for level in levels.split(",")]
+    return out
+
+
+def measure(db_path: str, codec: str, level: int, scratch: str) -> dict:
+    """Compress and restore db_path once; return sizes and timings."""
+    packed = os.path.join(scratch, f"backup.db.{codec}")
+    restored = os.path.join(scratch, "restored.db")
+
+    old_path = DB.DB_PATH
+    DB.DB_PATH = db_path
+    try:
+        t0 = time.perf_counter()
+        size = backup_store.write_compressed_backup(packed, level=level)
+        t1 = time.perf_counter()
+    finally:
+        DB.DB_PATH = old_path
+    backup_store.restore_compressed_backup(packed, restored)
+    t2 = time.perf_counter()
+
+    db_size = os.path.getsize(db_path)
+    os.remove(packed)
+    os.remove(restored)
+    return {
+        "codec": codec,
+        "level": level,
+        "db_mb": db_size / 1e6,
+        "packed_mb": size / 1e6,
+        "ratio": db_size / size,
+        "backup_mb_s": db_size / 1e6 / (t1 - t0),
+        "restore_mb_s": db_size / 1e6 / (t2 - t1),
+    }
+
+
+def main(argv: list[str] | None = None) -> int:
+    defaults = SchoolSpec()
+    ap = argparse.ArgumentParser(description="Compare backup compression codecs and levels.")
+    ap.add_argument("--db", help="database to measure (default: a generated school)")
+    ap.add_argument("--students", type=int, default=defaults.students)
+    ap.add_argument("--years", type=int, default=defaults.years)
+    ap.add_argument("--data-dir", default=DEFAULT_DATA_DIR)
+    ap.add_argument("--codecs", nargs="+", default=list(DEFAULT_CODECS),
+                    help="codec:level,level,... (codecs: xz, gz)")
+    args = ap.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="elnajah-compress-") as scratch:
+        # Measure a copy: frozen_db_file() checkpoints, which writes to the file.
+        work = os.path.join(scratch, "school.db")
+        source = args.db or _dataset(
+            SchoolSpec(students=args.students, years=args.years), args.data_dir
+        )
+        shutil.copyfile(source, work)
+
+        print(f"{os.path.getsize(work) / 1e6:.1f} MB database")
+        print(f"{'codec':<6}{'level':>6}{'size MB':>10}{'ratio':>8}{'backup MB/s':>13}{'restore MB/s':>14}")
+        for codec, level in _parse_codecs(args.codecs):
+            r = measure(work, codec, level, scratch)
+            print(
+                f"{codec:<6}{level:>6}{r['packed_mb']:>10.1f}{r['ratio']:>7.1f}x"
+                f"{r['backup_mb_s']:>13.1f}{r['restore_mb_s']:>14.1f}"
+            )
+        DB.close_connections()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
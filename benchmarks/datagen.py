@@ -0,0 +1,230 @@
+"""
+Deterministic synthetic school generator for the benchmarks.
+
+    python -m benchmarks.datagen school.db --students 50000 --groups 300 --years 10
+
+The same SchoolSpec always produces the same rows (same IDs, names, groups
+and payments), so timings taken on different machines or commits are
+comparable. The schema is created by DB.init_db(), so the file always has
+the current tables, indexes and triggers.
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import sqlite3
+import time
+from dataclasses import asdict, dataclass
+from typing import Iterator
+
+import DB
+
+
+_FIRST_NAMES = (
+    "Ahmed", "Mohamed", "Youssef", "Omar", "Ali", "Karim", "Hamza", "Bilal",
+    "Amine", "Rayan", "Walid", "Nabil", "Sofiane", "Yacine", "Mehdi", "Adel",
+    "Ilyes", "Anis", "Zakaria", "Imad", "Said", "Farid", "Riad", "Samir",
+    "Fatima", "Amina", "Sara", "Khadija", "Nour", "Lina", "Salma", "Rania",
+    "Yasmine", "Meriem", "Imane", "Ines", "Asma", "Hiba", "Aya", "Malak",
+    "Souad", "Nadia", "Leila", "Hanane", "Djamila", "Zineb", "Wafa", "Chaima",
+)
+_LAST_PREFIXES = (
+    "Ben", "Bou", "Bel", "Ait", "Hadj", "Sidi", "Abd", "Ould", "Ras", "Zer",
+    "Mek", "Kha", "Cher", "Man", "Bra", "Sai", "Tal", "Ham", "Lak", "Mez",
+    "Dah", "Fer", "Gha", "Nac", "Rah", "Sli", "Tay", "Yah", "Zou", "Kad",
+)
+_LAST_SUFFIXES = (
+    "ali", "zid", "kacem", "souri", "himi", "idi", "if", "elifi", "rouki",
+    "iane", "rani", "dad", "ahmed", "moussa", "allah", "aoui", "ouche", "ache",
+    "ani", "ouni", "ebbi", "ami", "ira", "ane", "out", "ssi", "ekki", "ouda",
+    "oul", "ri",
+)
+_SUBJECTS = (
+    "Math", "Physics", "Arabic", "French", "English", "Science", "History",
+    "Coding", "Quran", "Chemistry",
+)
+
+
+@dataclass(frozen=True)
+class SchoolSpec:
+    """Size and shape of a generated school."""
+    students: int = 50_000
+    groups: int = 300
+    years: int = 10                 # academic years of payment history
+    last_year: int = 2024           # academic start year of the newest year
+    seed: int = 1
+    duplicate_rate: float = 0.01    # students registered twice under one name
+    groupless_rate: float = 0.03
+    second_group_rate: float = 0.2
+    record_rate: float = 0.95       # enrolled months that have a payment row
+    paid_rate: float = 0.85
+
+    @property
+    def first_year(self) -> int:
+        return self.last_year - self.years + 1
+
+    def file_name(self) -> str:
+        """Cache-friendly file name; includes the schema version it was built with."""
+        return (
+            f"school_s{self.students}_g{self.groups}_y{self.years}"
+            f"_{self.last_year}_seed{self.seed}_v{DB.SCHEMA_VERSION}.db"
+        )
+
+
+def _group_names(spec: SchoolSpec) -> list[str]:
+    names = []
+    level = 1
+    while len(names) < spec.groups:
+        for subject in _SUBJECTS:
+            for section in "ABC":
+                names.append(f"{subject} L{level} {section}")
+        level += 1
+    return names[:spec.groups]
+
+
+def _student_names(spec: SchoolSpec, r: random.Random) -> list[str]:
+    """Unique three-part names, plus spec.duplicate_rate re-registrations."""
+    n_first = len(_FIRST_NAMES)
+    n_last = len(_LAST_PREFIXES) * len(_LAST_SUFFIXES)
+    space = n_first * n_first * n_last
+    if spec.students > space:
+        raise ValueError(f"At most {space} students can be generated.")
+
+    names = []
+    for code in r.sample(range(space), spec.students):
+        code, last = divmod(code, n_last)
+        first, father = divmod(code, n_first)
+        prefix, suffix = divmod(last, len(_LAST_SUFFIXES))
+        names.append(
+            f"{_FIRST_NAMES[first]} {_FIRST_NAMES[father]} "
+            f"{_LAST_PREFIXES[prefix]}{_LAST_SUFFIXES[suffix]}"
+        )
+
+    for i in range(1, len(names)):
+        if r.random() < spec.duplicate_rate:
+            twin = names[r.randrange(i)]
+            names[i] = twin.lower() if r.random() < 0.3 else twin
+    return names
+
+
+def _academic_months(start_year: int) -> list[tuple[int, int]]:
+    return [(start_year, m) for m in range(8, 13)] + [(start_year + 1, m) for m in range(1, 8)]
+
+
+def _rows(spec: SchoolSpec, r: random.Random):
+    """Return (student_rows, link_rows, payment_row_iterator)."""
+    names = _student_names(spec, r)
+    students = []
+    links = []
+    enrolments = []
+    for sid, name in enumerate(names, start=1):
+        join_year = r.randint(spec.first_year, spec.last_year)
+        join_idx = r.randrange(3) if r.random() < 0.8 else r.randrange(12)
+        stay = r.choice((1, 1, 2, 2, 3, 4, 5))
+        jy, jm = _academic_months(join_year)[join_idx]
+        students.append((sid, name, f"{jy}-{jm:02d}-{r.randint(1, 28):02d}"))
+        enrolments.append((sid, join_year, join_idx, min(join_year + stay - 1, spec.last_year)))
+
+        if r.random() >= spec.groupless_rate:
+            first = r.randrange(spec.groups) + 1
+            links.append((sid, first))
+            if r.random() < spec.second_group_rate:
+                second = r.randrange(spec.groups) + 1
+                if second != first:
+                    links.append((sid, second))
+
+    def payments() -> Iterator[tuple]:
+        # Drawn after students/links, so their values never depend on this.
+        for sid, first_ay, join_idx, last_ay in enrolments:
+            for ay in range(first_ay, last_ay + 1):
+                months = _academic_months(ay)
+                if ay == first_ay:
+                    months = months[join_idx:]
+                for y, m in months:
+                    if r.random() >= spec.record_rate:
+                        continue
+                    paid = "paid" if r.random() < spec.paid_rate else "unpaid"
+                    yield (sid, y, m, paid, f"{y}-{m:02d}-{r.randint(1, 28):02d}")
+
+    return students, links, payments()
+
+
+def generate(path: str, spec: SchoolSpec = SchoolSpec()) -> dict:
+    """
+    Create a new database file at path filled according to spec.
+
+    Returns row counts. Raises FileExistsError if path already exists.
+    """
+    if os.path.exists(path):
+        raise FileExistsError(path)
+
+    old_path = DB.DB_PATH
+    DB.DB_PATH = path
+    try:
+        DB.init_db()
+    finally:
+        DB.close_connections()
+        DB.DB_PATH = old_path
+
+    r = random.Random(spec.seed)
+    students, links, payments = _rows(spec, r)
+
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("PRAGMA synchronous = OFF")
+        with conn:
+            conn.executemany(
+                "INSERT INTO groups (id, name) VALUES (?, ?)",
+                enumerate(_group_names(spec), start=1),
+            )
+            conn.executemany(
+                "INSERT INTO students (id, name, join_date) VALUES (?, ?, ?)", students
+            )
+            conn.executemany(
+                "INSERT INTO student_group (student_id, group_id) VALUES (?, ?)", links
+            )
+            conn.executemany(
+                "INSERT INTO payments (student_id, year, month, paid, payment_date) "
+                "VALUES (?, ?, ?, ?, ?)",
+                payments,
+            )
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        n_payments = conn.execute("SELECT COUNT(*) FROM payments").fetchone()[0]
+    finally:
+        conn.close()
+
+    return {
+        "students": len(students),
+        "groups": spec.groups,
+        "memberships": len(links),
+        "payments": n_payments,
+    }
+
+
+def main(argv: list[str] | None = None) -> None:
+    defaults = SchoolSpec()
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("path", help="database file to create")
+    ap.add_argument("--students", type=int, default=defaults.students)
+    ap.add_argument("--groups", type=int, default=defaults.groups)
+    ap.add_argument("--years", type=int, default=defaults.years)
+    ap.add_argument("--last-year", type=int, default=defaults.last_year)
+    ap.add_argument("--seed", type=int, default=defaults.seed)
+    args = ap.parse_args(argv)
+
+    spec = SchoolSpec(
+        students=args.students,
+        groups=args.groups,
+        years=args.years,
+        last_year=args.last_year,
+        seed=args.seed,
+    )
+    t0 = time.perf_counter()
+    counts = generate(args.path, spec)
+    print(f"{args.path}: {counts} in {time.perf_counter() - t0:.1f}s ({asdict(spec)})")
+
+
+if __name__ == "__main__":
+    main()
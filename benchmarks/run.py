@@ -0,0 +1,681 @@
+"""
+Benchmark runner: times every public DB function, the history loader and
+the menu_tools exporters against a generated school, writes the results as
+JSON and compares them with a stored baseline.
+
+    python -m benchmarks.run                          # 50k students, compare
+    python -m benchmarks.run --students 5000 --repeat 3
+    python -m benchmarks.run --save-baseline          # accept current numbers
+    python -m benchmarks.run --memory                 # add peak Python memory
+
+The generated database is cached in benchmarks/.data/ and copied to a
+scratch directory for every run, so write benchmarks never touch the cache.
+Exit status is 1 when a benchmark got slower than the baseline by more than
+--tolerance (and by more than --min-delta-ms).
+"""
+
+from __future__ import annotations
+
+import argparse
+import gc
+import inspect
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from typing import Callable, Iterator, Optional
+from unittest import mock
+
+import DB
+import branches
+from benchmarks.datagen import SchoolSpec, generate
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DATA_DIR = os.path.join(HERE, ".data")
+DEFAULT_OUT = os.path.join(HERE, "latest.json")
+DEFAULT_BASELINE = os.path.join(HERE, "baseline.json")
+
+# Rows handled by each bulk-write benchmark.
+BULK_SIZE = 500
+
+# Public DB functions that aren't worth timing (diagnostics switches).
+NOT_TIMED = {
+    "enable_instrumentation", "disable_instrumentation", "get_query_stats",
+    "reset_query_stats", "recent_queries", "format_query_stats",
+    "get_month_view_cache_stats", "clear_month_view_cache",
+}
+
+# Month-view cache size for the [cached] bench; every other bench runs with
+# the cache off so repetitions measure the query.
+MONTH_VIEW_CACHE_SIZE = DB.MONTH_VIEW_CACHE_SIZE
+
+
+# ---------------------------------------------------------------------------
+# Benchmark definitions
+# ---------------------------------------------------------------------------
+
+@dataclass
+class Bench:
+    """
+    One timed call.
+
+    fn is called once per repetition; if setup is given it runs (untimed)
+    before every repetition and its return value is passed to fn as *args.
+    covers names the public function this exercises (for the coverage check).
+    """
+    name: str
+    fn: Callable[..., object]
+    setup: Optional[Callable[[], tuple]] = None
+    covers: str = ""
+
+    def __post_init__(self):
+        if not self.covers:
+            self.covers = self.name.split("[")[0].split(".")[0]
+
+
+@dataclass
+class Context:
+    """Facts about the generated school that the benchmarks need."""
+    year: int                   # a month that has payments...
+    month: int
+    academic_year: int          # ...and its academic start year
+    student_id: int             # a student with payments in that year
+    student_name: str
+    big_group: str
+    small_group: str
+    common_term: str            # substring matching many names
+    counter: Iterator[int]      # unique suffixes for rows the writes create
+
+
+def _context(path: str, spec: SchoolSpec) -> Context:
+    conn = sqlite3.connect(path)
+    try:
+        year = spec.last_year + 1
+        month = 1
+        sid, name = conn.execute(
+            """
+            SELECT s.id, s.name FROM payments p JOIN students s ON s.id = p.student_id
+            WHERE p.year = ? AND p.month = ? ORDER BY p.student_id LIMIT 1
+            """,
+            (year, month),
+        ).fetchone()
+        groups = conn.execute(
+            """
+            SELECT g.name FROM groups g JOIN student_group sg ON sg.group_id = g.id
+            GROUP BY g.id ORDER BY COUNT(*) DESC, g.name
+            """
+        ).fetchall()
+    finally:
+        conn.close()
+    return Context(
+        year=year,
+        month=month,
+        academic_year=spec.last_year,
+        student_id=sid,
+        student_name=name,
+        big_group=groups[0][0],
+        small_group=groups[-1][0],
+        common_term="Ben",
+        counter=iter(range(1, 10**9)),
+    )
+
+
+def _drain(it) -> int:
+    n = 0
+    for _ in it:
+        n += 1
+    return n
+
+
+@contextmanager
+def _fts(enabled: bool):
+    old = DB.USE_FTS_SEARCH
+    DB.USE_FTS_SEARCH = enabled
+    try:
+        yield
+    finally:
+        DB.USE_FTS_SEARCH = old
+
+
+@contextmanager
+def _month_view_cache(size: int):
+    old = DB.MONTH_VIEW_CACHE_SIZE
+    DB.MONTH_VIEW_CACHE_SIZE = size
+    try:
+        yield
+    finally:
+        DB.MONTH_VIEW_CACHE_SIZE = old
+
+
+def _cached_month_view(ctx: Context):
+    def fn():
+        with _month_view_cache(MONTH_VIEW_CACHE_SIZE):
+            return DB.get_students_with_payment_for_month(ctx.year, ctx.month)
+    return fn
+
+
+def _search(ctx: Context, term: str, fts: bool):
+    def fn():
+        with _fts(fts):
+            return DB.get_students_with_payment_for_month(
+                ctx.year, ctx.month, search_text=term, search_type="name"
+            )
+    return fn
+
+
+def _branches_unpaid(ctx: Context):
+    # two branches on the same file: open (schema check on each), query, close
+    def fn():
+        with branches.Branches({"a": DB.DB_PATH, "b": DB.DB_PATH}) as br:
+            return br.get_unpaid_students_for_month(ctx.year, ctx.month)
+    return fn
+
+
+# as_of for the payment history benches: after every generated payment.
+_AS_OF = "2100-01-01"
+
+
+def read_benches(ctx: Context) -> list[Bench]:
+    """Benchmarks that don't change the data (run first)."""
+    y, m, ay, sid = ctx.year, ctx.month, ctx.academic_year, ctx.student_id
+    benches = [
+        Bench("init_db[current]", DB.init_db),
+        Bench("get_schema_version", DB.get_schema_version),
+        Bench("change_token", DB.change_token),
+        Bench("get_student", lambda: DB.get_student(sid)),
+        Bench("get_all_students", DB.get_all_students),
+        Bench("iter_all_students[first_page]", lambda: next(DB.iter_all_students())),
+        Bench("iter_all_students[drain]", lambda: _drain(DB.iter_all_students())),
+        Bench("get_all_groups", DB.get_all_groups),
+        Bench("get_student_groups", lambda: DB.get_student_groups(sid)),
+        Bench(
+            f"get_groups_for_students[{BULK_SIZE}]",
+            lambda: DB.get_groups_for_students(range(sid, sid + BULK_SIZE)),
+        ),
+        Bench("get_group_students[big]", lambda: DB.get_group_students(ctx.big_group)),
+        Bench("get_payment", lambda: DB.get_payment(sid, y, m)),
+        Bench("get_payments_for_student", lambda: DB.get_payments_for_student(sid)),
+        Bench(
+            "get_payments_for_student_academic_year",
+            lambda: DB.get_payments_for_student_academic_year(sid, ay),
+        ),
+        Bench("get_payment_matrix[all]", lambda: DB.get_payment_matrix(ay)),
+        Bench("get_payment_matrix[big_group]", lambda: DB.get_payment_matrix(ay, ctx.big_group)),
+        Bench(
+            "get_students_with_payment_for_month[all]",
+            lambda: DB.get_students_with_payment_for_month(y, m),
+        ),
+        # the first repetition fills the cache, the rest are hits
+        Bench("get_students_with_payment_for_month[cached]", _cached_month_view(ctx)),
+        Bench(
+            "get_students_with_payment_for_month[big_group]",
+            lambda: DB.get_students_with_payment_for_month(y, m, group_name=ctx.big_group),
+        ),
+        Bench(
+            "get_students_with_payment_for_month[unpaid]",
+            lambda: DB.get_students_with_payment_for_month(y, m, payment_status="unpaid"),
+        ),
+        Bench(
+            "get_students_with_payment_for_month[id]",
+            lambda: DB.get_students_with_payment_for_month(
+                y, m, search_text=str(sid), search_type="id"
+            ),
+        ),
+        Bench(
+            "iter_students_with_payment_for_month[first_page]",
+            lambda: next(DB.iter_students_with_payment_for_month(y, m)),
+        ),
+        Bench(
+            "iter_students_with_payment_for_month[drain]",
+            lambda: _drain(DB.iter_students_with_payment_for_month(y, m)),
+        ),
+        Bench("get_unpaid_students_for_month", lambda: DB.get_unpaid_students_for_month(y, m)),
+        Bench(
+            "get_unpaid_students_for_month[big_group]",
+            lambda: DB.get_unpaid_students_for_month(y, m, group_name=ctx.big_group),
+        ),
+        Bench("get_payment_events", lambda: DB.get_payment_events(sid)),
+        Bench("get_payments_as_of", lambda: DB.get_payments_as_of(y, m, _AS_OF)),
+        Bench(
+            "get_unpaid_students_as_of",
+            lambda: DB.get_unpaid_students_as_of(y, m, _AS_OF),
+        ),
+        Bench(
+            "branches.get_unpaid_students_for_month[2]",
+            _branches_unpaid(ctx),
+            covers="use_database",
+        ),
+        Bench("get_groupless_students", DB.get_groupless_students),
+        Bench("find_duplicate_students", DB.find_duplicate_students),
+        Bench("get_student_counts_by_group", DB.get_student_counts_by_group),
+        Bench("get_payment_counts_for_month", lambda: DB.get_payment_counts_for_month(y, m)),
+    ]
+
+    # Name search, trigram index vs plain LIKE on the same terms.
+    for label, term in (
+        ("full_name", ctx.student_name),
+        ("common", ctx.common_term),
+        ("no_match", "zzq"),
+    ):
+        for fts in (True, False):
+            benches.append(Bench(
+                f"get_students_with_payment_for_month[search_{label},{'fts' if fts else 'like'}]",
+                _search(ctx, term, fts),
+            ))
+    return benches
+
+
+def write_benches(ctx: Context) -> list[Bench]:
+    """Benchmarks that change the data; each repetition uses fresh rows."""
+    y, m, sid = ctx.year, ctx.month, ctx.student_id
+
+    def uid() -> int:
+        return next(ctx.counter)
+
+    def new_student() -> tuple:
+        return (DB.create_student(f"Bench Student {uid()}"),)
+
+    def new_students() -> tuple:
+        return (DB.create_students_bulk(
+            {"name": f"Bench Bulk {uid()}"} for _ in range(BULK_SIZE)
+        ),)
+
+    def new_group_with_members() -> tuple:
+        name = f"Bench Group {uid()}"
+        (ids,) = new_students()
+        DB.add_students_to_group(name, ids)
+        return (name,)
+
+    def deleted_snapshot() -> tuple:
+        (new_id,) = new_student()
+        DB.set_student_groups(new_id, [ctx.small_group])
+        return (DB.delete_student(new_id, snapshot_for_undo=True),)
+
+    def bulk_items() -> list[dict]:
+        return [{"name": f"Bench Bulk {uid()}"} for _ in range(BULK_SIZE)]
+
+    def duplicates(clusters: int, size: int) -> list[int]:
+        names = [f"Bench Dup {uid()}" for _ in range(clusters)]
+        ids = DB.create_students_bulk({"name": n} for n in names for _ in range(size))
+        DB.set_groups_bulk({i: [ctx.small_group] for i in ids})
+        for k, i in enumerate(ids):
+            paid = "paid" if k % 2 else "unpaid"
+            DB.upsert_payments_bulk(i, [dict(it, paid=paid) for it in year_items])
+        return ids
+
+    def duplicate_pairs() -> tuple:
+        duplicates(BULK_SIZE // 2, 2)
+        return ()
+
+    def backed_up() -> tuple:
+        DB.backup("bench_backup.db")
+        return ()
+
+    def freeze():
+        with DB.frozen_db_file():
+            pass
+
+    def empty_transaction():
+        with DB.transaction():
+            pass
+
+    year_items = [
+        {"year": yy, "month": mm, "paid": "paid", "payment_date": f"{yy}-{mm:02d}-01"}
+        for yy, mm in [(ctx.academic_year, k) for k in range(8, 13)]
+        + [(ctx.academic_year + 1, k) for k in range(1, 8)]
+    ]
+
+    return [
+        Bench("transaction[empty]", empty_transaction, covers="transaction"),
+        Bench("create_student", lambda: DB.create_student(f"Bench Student {uid()}")),
+        Bench("update_student", lambda: DB.update_student(sid, name=ctx.student_name)),
+        Bench("delete_student[snapshot]", lambda i: DB.delete_student(i, True), setup=new_student),
+        Bench("restore_student_snapshot", DB.restore_student_snapshot, setup=deleted_snapshot),
+        Bench("create_group", lambda: DB.create_group(f"Bench Group {uid()}")),
+        Bench("delete_group_by_name", DB.delete_group_by_name, setup=new_group_with_members),
+        Bench(
+            "set_student_groups",
+            lambda: DB.set_student_groups(sid, [ctx.big_group, ctx.small_group]),
+        ),
+        Bench("upsert_payment", lambda: DB.upsert_payment(sid, y, m, "paid")),
+        Bench("upsert_payments_bulk[year]", lambda: DB.upsert_payments_bulk(sid, year_items)),
+        Bench(f"create_students_bulk[{BULK_SIZE}]", lambda: DB.create_students_bulk(bulk_items())),
+        Bench(
+            f"set_groups_bulk[{BULK_SIZE}]",
+            lambda ids: DB.set_groups_bulk({i: [ctx.small_group] for i in ids}),
+            setup=new_students,
+        ),
+        Bench(
+            f"add_students_to_group[{BULK_SIZE}]",
+            lambda ids: DB.add_students_to_group(ctx.small_group, ids),
+            setup=new_students,
+        ),
+        Bench(f"delete_students_by_ids[{BULK_SIZE}]", DB.delete_students_by_ids, setup=new_students),
+        Bench(
+            "merge_students[10]",
+            lambda ids: DB.merge_students(ids[0], ids[1:]),
+            setup=lambda: (duplicates(1, 10),),
+        ),
+        Bench(
+            f"merge_all_duplicates[{BULK_SIZE // 2} pairs]",
+            DB.merge_all_duplicates,
+            setup=duplicate_pairs,
+        ),
+        Bench("rebuild_payment_summary", DB.rebuild_payment_summary),
+        Bench("backup", lambda: DB.backup("bench_backup.db")),
+        Bench("restore", lambda: DB.restore("bench_backup.db"), setup=backed_up),
+        Bench("frozen_db_file", freeze, covers="frozen_db_file"),
+        Bench("checkpoint", DB.checkpoint),
+        Bench("close_connections", DB.close_connections),
+    ]
+
+
+class _Dialogs:
+    """Answers the exporters' prompts and swallows their message boxes."""
+
+    def __init__(self, answers: list[str]):
+        self.answers = list(answers)
+
+    def askstring(self, *args, **kwargs):
+        return self.answers.pop(0)
+
+    def askyesno(self, *args, **kwargs):
+        return True
+
+    def showinfo(self, *args, **kwargs):
+        pass
+
+    showwarning = showinfo
+
+    def showerror(self, title, message=None, **kwargs):
+        raise RuntimeError(f"{title}: {message}")
+
+
+def gui_benches(ctx: Context, skipped: dict[str, str]) -> list[Bench]:
+    """
+    payments_log.load_history_rows and the menu_tools exporters.
+
+    These modules import the GUI/report libraries at the top; when those
+    aren't installed the benchmarks are reported as skipped.
+    """
+    try:
+        import menu_tools
+        import payments_log
+    except ImportError as e:
+        for name in (
+            "load_history_rows", "export_history_pdf", "_export_group_to_pdf",
+            "export_all_students_excel", "export_unpaid_students_pdf",
+            "export_student_count_pdf", "export_student_payment_history_pdf",
+        ):
+            skipped[name] = f"{e.name or e} not installed"
+        return []
+
+    def exporter(module, fn, *answers):
+        def run(*args):
+            dialogs = _Dialogs(answers)
+            with mock.patch.object(module, "messagebox", dialogs), \
+                    mock.patch.object(module, "simpledialog", dialogs, create=True):
+                return fn(*args)
+        return run
+
+    label = payments_log.make_academic_label(ctx.academic_year)
+    return [
+        Bench(
+            "load_history_rows[all]",
+            lambda: payments_log.load_history_rows(ctx.academic_year, None),
+        ),
+        Bench(
+            "load_history_rows[big_group]",
+            lambda: payments_log.load_history_rows(ctx.academic_year, ctx.big_group),
+        ),
+        Bench(
+            "export_history_pdf[big_group]",
+            exporter(payments_log, lambda: payments_log.export_history_pdf(label, ctx.big_group)),
+        ),
+        Bench(
+            "_export_group_to_pdf[big_group]",
+            exporter(menu_tools, lambda: menu_tools._export_group_to_pdf(ctx.big_group)),
+        ),
+        Bench("export_all_students_excel", exporter(menu_tools, menu_tools.export_all_students_excel)),
+        Bench(
+            "export_unpaid_students_pdf",
+            exporter(menu_tools, menu_tools.export_unpaid_students_pdf, str(ctx.year), str(ctx.month)),
+        ),
+        Bench("export_student_count_pdf", exporter(menu_tools, menu_tools.export_student_count_pdf)),
+        Bench(
+            "export_student_payment_history_pdf",
+            exporter(
+                menu_tools, menu_tools.export_student_payment_history_pdf,
+                str(ctx.student_id), str(ctx.academic_year),
+            ),
+        ),
+    ]
+
+
+def public_db_functions() -> set[str]:
+    """Names of the public functions defined in DB.py."""
+    return {
+        name for name, obj in inspect.getmembers(DB, inspect.isfunction)
+        if not name.startswith("_") and obj.__module__ == DB.__name__
+    }
+
+
+# ---------------------------------------------------------------------------
+# Timing
+# ---------------------------------------------------------------------------
+
+def _size(result) -> Optional[int]:
+    if isinstance(result, int) and not isinstance(result, bool):
+        return result
+    try:
+        return len(result)
+    except TypeError:
+        return None
+
+
+def time_bench(bench: Bench, repeat: int, memory: bool) -> dict:
+    """Warm up once, then time `repeat` runs. Returns the JSON record."""
+    args = bench.setup() if bench.setup else ()
+    result = bench.fn(*args)
+    rows = _size(result)
+    del result
+
+    times = []
+    for _ in range(repeat):
+        args = bench.setup() if bench.setup else ()
+        gc.collect()
+        t0 = time.perf_counter()
+        result = bench.fn(*args)
+        times.append((time.perf_counter() - t0) * 1000)
+        del result
+
+    record = {
+        "median_ms": round(statistics.median(times), 3),
+        "min_ms": round(min(times), 3),
+        "max_ms": round(max(times), 3),
+        "runs": repeat,
+        "rows": rows,
+    }
+
+    if memory:
+        args = bench.setup() if bench.setup else ()
+        gc.collect()
+        tracemalloc.start()
+        try:
+            # the peak is the high-water mark, so it counts the result even
+            # though it is dropped straight away
+            bench.fn(*args)
+            record["peak_kib"] = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+        finally:
+            tracemalloc.stop()
+    return record
+
+
+# ---------------------------------------------------------------------------
+# Baseline comparison
+# ---------------------------------------------------------------------------
+
+def compare(current: dict, baseline: dict, tolerance: float, min_delta_ms: float) -> list[str]:
+    """
+    Print a comparison table and return the names that regressed.
+
+    A benchmark regresses when its median is more than `tolerance` (relative)
+    and more than `min_delta_ms` (absolute) above the baseline median.
+    """
+    if current["meta"]["dataset"] != baseline["meta"]["dataset"]:
+        print("warning: baseline was recorded on a different dataset; ratios are not comparable")
+
+    cur, base = current["results"], baseline["results"]
+    regressed = []
+    width = max(map(len, cur | base), default=10)
+    print(f"\n{'benchmark':<{width}}  {'baseline':>10}  {'current':>10}  {'ratio':>6}")
+    for name in sorted(cur | base):
+        if name not in base:
+            print(f"{name:<{width}}  {'-':>10}  {cur[name]['median_ms']:>8.2f}ms  {'':>6}  new")
+            continue
+        if name not in cur:
+            print(f"{name:<{width}}  {base[name]['median_ms']:>8.2f}ms  {'-':>10}  {'':>6}  missing")
+            continue
+        b, c = base[name]["median_ms"], cur[name]["median_ms"]
+        ratio = c / b if b else float("inf")
+        status = ""
+        if c - b > min_delta_ms and ratio > 1 + tolerance:
+            status = "REGRESSION"
+            regressed.append(name)
+        elif b - c > min_delta_ms and ratio < 1 / (1 + tolerance):
+            status = "faster"
+        print(f"{name:<{width}}  {b:>8.2f}ms  {c:>8.2f}ms  {ratio:>6.2f}  {status}")
+    return regressed
+
+
+# ---------------------------------------------------------------------------
+# Entry point
+# ---------------------------------------------------------------------------
+
+def _dataset(spec: SchoolSpec, data_dir: str) -> str:
+    """Return the cached database for spec, generating it on first use."""
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, spec.file_name())
+    if not os.path.exists(path):
+        print(f"generating {path} ...", flush=True)
+        tmp = path + ".tmp"
+        for leftover in (tmp, tmp + "-wal", tmp + "-shm"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+        counts = generate(tmp, spec)
+        os.replace(tmp, path)
+        print(f"  {counts}")
+    return path
+
+
+def run(spec: SchoolSpec, data_dir: str, repeat: int, memory: bool, only: Optional[str]) -> dict:
+    source = _dataset(spec, data_dir)
+    old_path, old_cwd = DB.DB_PATH, os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="elnajah-bench-") as scratch:
+        work = os.path.join(scratch, "school.db")
+        shutil.copyfile(source, work)
+        ctx = _context(work, spec)
+
+        DB.close_connections()
+        DB.DB_PATH = work
+        os.chdir(scratch)           # exporters write to ./exports and ./
+        skipped: dict[str, str] = {}
+        results: dict[str, dict] = {}
+        try:
+            benches = read_benches(ctx) + gui_benches(ctx, skipped) + write_benches(ctx)
+            with _month_view_cache(0):
+                for bench in benches:
+                    if only and only not in bench.name:
+                        continue
+                    print(f"{bench.name} ...", end=" ", flush=True)
+                    results[bench.name] = record = time_bench(bench, repeat, memory)
+                    print(f"{record['median_ms']:.2f} ms")
+        finally:
+            DB.close_connections()
+            DB.DB_PATH = old_path
+            os.chdir(old_cwd)
+
+    for name, reason in skipped.items():
+        print(f"skipped {name}: {reason}")
+    uncovered = sorted(public_db_functions() - NOT_TIMED - {b.covers for b in benches})
+    if uncovered:
+        print(f"warning: public DB functions without a benchmark: {', '.join(uncovered)}")
+
+    return {
+        "meta": {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "schema_version": DB.SCHEMA_VERSION,
+            "dataset": asdict(spec),
+            "repeat": repeat,
+        },
+        "results": results,
+        "skipped": skipped,
+        "uncovered": uncovered,
+    }
+
+
+def main(argv: list[str] | None = None) -> int:
+    defaults = SchoolSpec()
+    ap = argparse.ArgumentParser(description="Time the DB layer on a generated school.")
+    ap.add_argument("--students", type=int, default=defaults.students)
+    ap.add_argument("--groups", type=int, default=defaults.groups)
+    ap.add_argument("--years", type=int, default=defaults.years)
+    ap.add_argument("--seed", type=int, default=defaults.seed)
+    ap.add_argument("--repeat", type=int, default=5, help="timed runs per benchmark")
+    ap.add_argument("--memory", action="store_true", help="also record peak Python memory")
+    ap.add_argument("--only", help="run only benchmarks whose name contains this text")
+    ap.add_argument("--data-dir", default=DEFAULT_DATA_DIR)
+    ap.add_argument("--out", default=DEFAULT_OUT, help="where to write the JSON results")
+    ap.add_argument("--baseline", default=DEFAULT_BASELINE)
+    ap.add_argument("--save-baseline", action="store_true",
+                    help="write the results to --baseline instead of comparing")
+    ap.add_argument("--tolerance", type=float, default=0.25,
+                    help="allowed relative slowdown before a run fails (0.25 = 25%%)")
+    ap.add_argument("--min-delta-ms", type=float, default=1.0,
+                    help="ignore slowdowns smaller than this many milliseconds")
+    args = ap.parse_args(argv)
+
+    spec = SchoolSpec(
+        students=args.students, groups=args.groups, years=args.years, seed=args.seed
+    )
+    current = run(spec, args.data_dir, args.repeat, args.memory, args.only)
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(current, f, indent=2)
+    print(f"results written to {args.out}")
+
+    if args.save_baseline:
+        shutil.copyfile(args.out, args.baseline)
+        print(f"baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"no baseline at {args.baseline}; run with --save-baseline to create one")
+        return 0
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    if args.only:
+        baseline["results"] = {
+            k: v for k, v in baseline["results"].items() if args.only in k
+        }
+    regressed = compare(current, baseline, args.tolerance, args.min_delta_ms)
+    if regressed:
+        print(f"\n{len(regressed)} regression(s): {', '.join(regressed)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,197 @@
+"""
+Queries across several school databases, one file per branch.
+
+    with Branches({"Centre": "elnajah.db", "North": "D:/north/elnajah.db"}) as br:
+        unpaid = br.get_unpaid_students_for_month(2025, 1)
+        # [{"branch": "Centre", "id": 7, "name": "...", "groups": "..."}, ...]
+        counts = br.get_payment_counts_for_month(2025, 1)
+
+Each call fans out to the Branches' worker threads, one branch per job.
+Every worker points its own DB calls at the branch's file with
+DB.use_database() and runs the ordinary DB function there, so each branch
+gets the same queries and indexes as the main database. Branch files are
+opened read-only and must already be on the current schema, unless the
+Branches is created with migrate=True. SQLite releases the GIL while it
+steps a statement, so branches are read in parallel. Results come back merged in branch order (each branch's rows in
+the DB function's own order) as dicts with "branch" as their first key.
+The rest of the app keeps using DB.DB_PATH.
+"""
+
+from __future__ import annotations
+
+import dataclasses
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Any, Callable, Mapping, Optional
+
+import DB
+
+
+def _branch_call(
+    path: str, readonly: bool, fn: Callable[..., Any], args: tuple, kwargs: dict
+) -> Any:
+    """Runs on a worker: fn(*args, **kwargs) against the branch file at path."""
+    with DB.use_database(path, readonly=readonly):
+        return fn(*args, **kwargs)
+
+
+def _as_dict(row: Any) -> dict:
+    if isinstance(row, dict):
+        return row
+    return {f.name: getattr(row, f.name) for f in dataclasses.fields(row)}
+
+
+class Branches:
+    """
+    Run DB queries on several branch databases at once.
+
+    paths: {branch name: database file}, in the order results are merged.
+           Every file must exist and be on DB.SCHEMA_VERSION (DBError
+           otherwise); files are opened read-only and never changed.
+    workers: threads querying branches concurrently (default: one per
+             branch, at most 4).
+    migrate: open the files read-write instead, bring each to the current
+             schema (DB.init_db, which also switches it to WAL) and allow
+             calls that write.
+    """
+
+    def __init__(
+        self,
+        paths: Mapping[str, str],
+        workers: Optional[int] = None,
+        migrate: bool = False,
+    ):
+        if not paths:
+            raise ValueError("at least one branch is required")
+        missing = [p for p in paths.values() if not os.path.exists(p)]
+        if missing:
+            raise DB.NotFoundError(f"Branch databases not found: {missing}")
+        if workers is None:
+            workers = min(len(paths), 4)
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        self.paths = dict(paths)
+        self._readonly = not migrate
+        self._workers = workers
+        self._closed = False
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="Branch")
+        try:
+            if migrate:
+                self.call(DB.init_db)
+            else:
+                self._check_schema()
+        except BaseException:
+            self.close()
+            raise
+
+    def _check_schema(self) -> None:
+        stale = {
+            name: version
+            for name, version in self.call(DB.get_schema_version).items()
+            if version != DB.SCHEMA_VERSION
+        }
+        if stale:
+            raise DB.DBError(
+                f"Branch databases are not on schema version {DB.SCHEMA_VERSION}: "
+                f"{stale}. Open them with migrate=True to upgrade them."
+            )
+
+    def call(self, fn: Callable[..., Any], *args, **kwargs) -> dict[str, Any]:
+        """
+        Run fn(*args, **kwargs) once per branch and return {branch: result}.
+
+        fn may be any DB function, or a function making several DB calls
+        (e.g. inside DB.transaction()); it runs with its worker pointed at
+        the branch. Without migrate=True, anything that writes to a branch
+        raises. If a branch raises, the first such error (in branch order)
+        is raised once every branch has finished.
+        """
+        futures = {
+            name: self._pool.submit(_branch_call, path, self._readonly, fn, args, kwargs)
+            for name, path in self.paths.items()
+        }
+        wait(futures.values())
+        return {name: future.result() for name, future in futures.items()}
+
+    def merged(self, fn: Callable[..., Any], *args, **kwargs) -> list[dict]:
+        """
+        call() a DB function that returns rows and merge them into one list.
+
+        Rows (dicts or DB dataclasses) become dicts with "branch" first.
+        """
+        return [
+            {"branch": name, **_as_dict(row)}
+            for name, rows in self.call(fn, *args, **kwargs).items()
+            for row in rows
+        ]
+
+    # -- roster ----------------------------------------------------------------
+
+    def get_all_students(self, order_by: str = "name") -> list[dict]:
+        """DB.get_all_students() of every branch: {"branch", "id", "name", "join_date"}."""
+        return self.merged(DB.get_all_students, order_by)
+
+    def get_students_with_payment_for_month(
+        self,
+        year: int,
+        month: int,
+        search_text: str = "",
+        search_type: str = "name",
+        group_name: Optional[str] = None,
+        payment_status: Optional[str] = None,
+    ) -> list[dict]:
+        """DB.get_students_with_payment_for_month() of every branch, plus "branch"."""
+        return self.merged(
+            DB.get_students_with_payment_for_month,
+            year, month, search_text, search_type, group_name, payment_status,
+        )
+
+    # -- unpaid ------------------------------------------------------------------
+
+    def get_unpaid_students_for_month(
+        self, year: int, month: int, group_name: Optional[str] = None
+    ) -> list[dict]:
+        """DB.get_unpaid_students_for_month() of every branch: {"branch", "id", "name", "groups"}."""
+        return self.merged(DB.get_unpaid_students_for_month, year, month, group_name)
+
+    # -- counts ------------------------------------------------------------------
+
+    def get_student_counts_by_group(self) -> list[dict]:
+        """
+        DB.get_student_counts_by_group() of every branch: {"branch", "group",
+        "count"}, with each branch's own 'TOTAL' row.
+        """
+        return self.merged(DB.get_student_counts_by_group)
+
+    def get_payment_counts_for_month(self, year: int, month: int) -> list[dict]:
+        """
+        DB.get_payment_counts_for_month() of every branch: {"branch", "group",
+        "total", "paid", "unpaid", "no_record"}, with each branch's own
+        'TOTAL' row.
+        """
+        return self.merged(DB.get_payment_counts_for_month, year, month)
+
+    # -- lifetime ----------------------------------------------------------------
+
+    def close(self) -> None:
+        """Finish running calls, close the workers' connections and stop them."""
+        if self._closed:
+            return
+        self._closed = True
+        barrier = threading.Barrier(self._workers)
+
+        def close_connections():
+            DB.close_connections()
+            # Holding each worker here until all have arrived makes the pool
+            # start every thread and hand each exactly one of these jobs.
+            barrier.wait()
+
+        wait([self._pool.submit(close_connections) for _ in range(self._workers)])
+        self._pool.shutdown(wait=True)
+
+    def __enter__(self) -> "Branches":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
@@ -1,10 +1,11 @@
 import customtkinter as ctk
 import tkinter as tk
-import shutil
 import os
+import threading
 import time
 import webbrowser
 import urllib.parse
+from collections import Counter
 from datetime import datetime
 
 from reportlab.lib.pagesizes import A4, landscape
@@ -19,22 +20,37 @@ from DB import (
     get_all_groups as db_get_all_groups,
     get_student,
     get_student_groups,
-    set_student_groups,
+    get_groups_for_students,
+    set_groups_bulk,
     get_group_students,
     get_groupless_students,
     delete_students_by_ids,
+    find_duplicate_students,
+    merge_all_duplicates,
     get_unpaid_students_for_month,
     get_student_counts_by_group,
     get_payments_for_student_academic_year,
-    upsert_payments_bulk,
+    rebuild_payment_summary,
+    restore,
+    transaction,
+)
+from backup_store import (
+    DEFAULT_CODEC,
+    DEFAULT_RETENTION,
+    BackupCatalog,
+    BackupStore,
+    compressed_codec,
+    restore_compressed_backup,
 )
 
 # These will be injected from the main file:
 #   menu_tools.ElNajahSchool = ElNajahSchool
 #   menu_tools.refresh_treeview_all = refresh_treeview_all
 #   menu_tools.get_all_groups = get_all_groups  (optional)
+#   menu_tools.refresh_after_restore = refresh_after_restore  (optional)
 ElNajahSchool = None
 refresh_treeview_all = None
+refresh_after_restore = None
 get_all_groups = db_get_all_groups  # fallback to DB version
 
 
@@ -115,22 +131,17 @@ def merge_duplicate_students():
         - Merge groups and payments of other students with same name into master.
         - Delete the duplicates.
 
+    The merge itself is DB.merge_all_duplicates(): one transaction, so it
+    either fully applies or changes nothing.
+
     NOTE: This uses a simple rule; it will not ask which one to keep.
     """
     try:
-        students = get_all_students(order_by="name")
+        clusters = find_duplicate_students()
     except DBError as e:
         messagebox.showerror("DB Error", f"Could not load students:\n{e}")
         return
 
-    # Group students by lowercased name
-    by_name = {}
-    for stu in students:
-        key = stu.name.strip().lower()
-        by_name.setdefault(key, []).append(stu)
-
-    # Collect all duplicate clusters
-    clusters = [lst for lst in by_name.values() if len(lst) > 1]
     if not clusters:
         messagebox.showinfo("No Duplicates", "No duplicate names found to merge.")
         return
@@ -147,106 +158,17 @@ def merge_duplicate_students():
     ):
         return
 
-    from DB import get_payments_for_student, get_payment, upsert_payment  # to avoid huge imports at top
-
-    merged_pairs = []  # list of (master_id, removed_id)
-
-    for cluster in clusters:
-        # Sort by id, keep the one with smallest id as master
-        cluster_sorted = sorted(cluster, key=lambda s: s.id)
-        master = cluster_sorted[0]
-        others = cluster_sorted[1:]
-
-        # Collect master groups / payments
-        try:
-            master_groups = set(get_student_groups(master.id))
-        except DBError:
-            master_groups = set()
+    try:
+        merged = merge_all_duplicates()
+    except DBError as e:
+        messagebox.showerror("DB Error", f"Merge failed, nothing was changed:\n{e}")
+        return
 
-        try:
-            master_payments = get_payments_for_student(master.id)
-        except DBError:
-            master_payments = []
-        master_map = {(p.year, p.month): p for p in master_payments}
-
-        # For each duplicate student
-        for dup in others:
-            try:
-                dup_groups = set(get_student_groups(dup.id))
-            except DBError:
-                dup_groups = set()
-
-            try:
-                dup_payments = get_payments_for_student(dup.id)
-            except DBError:
-                dup_payments = []
-
-            # Merge groups
-            combined_groups = master_groups.union(dup_groups)
-            try:
-                set_student_groups(master.id, sorted(combined_groups))
-            except DBError:
-                pass
-            master_groups = combined_groups
-
-            # Merge payments:
-            #   - If master has no record for (year,month), copy dup's record.
-            #   - If both have records:
-            #       * if one is 'paid' and the other is 'unpaid', choose 'paid'.
-            #       * if both 'paid', choose the one with earlier payment_date.
-            merge_items = []
-            for p in dup_payments:
-                mk = (p.year, p.month)
-                mp = master_map.get(mk)
-                if mp is None:
-                    # master has nothing -> copy dup
-                    merge_items.append({
-                        "year": p.year,
-                        "month": p.month,
-                        "paid": p.paid,
-                        "payment_date": p.payment_date,
-                    })
-                else:
-                    # conflict
-                    chosen_paid = mp.paid
-                    chosen_date = mp.payment_date
-
-                    if mp.paid == "paid" and p.paid == "unpaid":
-                        pass  # keep master
-                    elif mp.paid == "unpaid" and p.paid == "paid":
-                        chosen_paid = "paid"
-                        chosen_date = p.payment_date
-                    elif mp.paid == "paid" and p.paid == "paid":
-                        # keep the earlier date
-                        if p.payment_date < mp.payment_date:
-                            chosen_date = p.payment_date
-
-                    merge_items.append({
-                        "year": p.year,
-                        "month": p.month,
-                        "paid": chosen_paid,
-                        "payment_date": chosen_date,
-                    })
-
-            if merge_items:
-                try:
-                    upsert_payments_bulk(master.id, merge_items)
-                except DBError:
-                    pass
-
-            # Delete duplicate student
-            try:
-                delete_students_by_ids([dup.id])
-            except DBError:
-                continue
-
-            merged_pairs.append((master.id, dup.id))
-
-    if not merged_pairs:
+    if not merged:
         messagebox.showinfo("No Changes", "No students were merged.")
     else:
         msg = (
-            f"Merged {len(merged_pairs)} students into their master records.\n"
+            f"Merged {merged} students into their master records.\n"
             "Lowest IDs were kept as masters."
         )
         messagebox.showinfo("Merge Complete", msg)
@@ -312,18 +234,18 @@ def bulk_remove_group_if_only_group():
             dlg.destroy()
             return
 
-        changed = 0
-        for stu in students:
-            try:
-                groups_for_stu = get_student_groups(stu.id)
-            except DBError:
-                continue
-            if len(groups_for_stu) == 1 and groups_for_stu[0] == group_name:
-                try:
-                    set_student_groups(stu.id, [])
-                except DBError:
-                    continue
-                changed += 1
+        try:
+            with transaction():
+                groups_by_id = get_groups_for_students(stu.id for stu in students)
+                only_here = [
+                    sid for sid, names in groups_by_id.items() if names == [group_name]
+                ]
+                set_groups_bulk({sid: [] for sid in only_here})
+        except DBError as e:
+            messagebox.showerror("DB Error", str(e))
+            dlg.destroy()
+            return
+        changed = len(only_here)
 
         messagebox.showinfo(
             "Done",
@@ -337,6 +259,26 @@ def bulk_remove_group_if_only_group():
     ctk.CTkButton(btn_frame, text="Cancel", command=dlg.destroy).pack(side="left", padx=4)
 
 
+# ---------------------------------------------------------------------------
+# Tools: rebuild summary tables
+# ---------------------------------------------------------------------------
+
+def rebuild_summary_tables():
+    """
+    Recompute the per-month / per-group count tables used by the reports.
+
+    They are kept up to date automatically; this is only needed if the
+    database file was edited with another program.
+    """
+    try:
+        rebuild_payment_summary()
+    except Exception as e:
+        messagebox.showerror("DB Error", f"Could not rebuild summary tables:\n{e}")
+        return
+
+    messagebox.showinfo("Done", "Summary tables rebuilt.")
+
+
 # ---------------------------------------------------------------------------
 # Backup / Restore / Purge
 # ---------------------------------------------------------------------------
@@ -346,120 +288,368 @@ def _db_path():
     return "elnajah.db"
 
 
-def backup_database():
+def _catalog():
+    """Return the catalog of the 'backups' folder, or None after showing why not."""
+    try:
+        return BackupCatalog("backups")
+    except Exception as e:
+        messagebox.showerror("Backup Error", f"Could not open the backup catalog:\n{e}")
+        return None
+
+
+def _entry_label(entry):
+    """One line describing a catalog entry, for pickers and messages."""
+    students = "?" if entry.students is None else f"{entry.students:,}"
+    codec = compressed_codec(entry.name)
+    kind = f", {codec}" if codec else ""
+    return (
+        f"{entry.created.replace('T', ' ')[:16]}  -  {students} students  "
+        f"({entry.size / 1e6:.1f} MB{kind})"
+    )
+
+
+def _run_in_background(title, text, work, on_success):
+    """
+    Run work(progress) on a thread behind a small progress window.
+
+    work may call progress(done, total) from its thread; the window polls
+    it with after(). on_success(result) runs on the Tk thread; an exception
+    from work is shown in an error box instead.
+    """
+    win = ctk.CTkToplevel(_root())
+    win.title(title)
+    win.geometry("360x120")
+    ctk.CTkLabel(win, text=text, font=("Arial", 14)).pack(pady=(16, 8))
+    bar = ctk.CTkProgressBar(win, width=300)
+    bar.set(0)
+    bar.pack(pady=4)
+
+    # Written by the worker thread, read by poll() on the Tk thread.
+    state = {"done": 0, "total": 0, "result": None, "error": None, "finished": False}
+
+    def on_progress(done, total):
+        state["done"], state["total"] = done, total
+
+    def run():
+        try:
+            state["result"] = work(on_progress)
+        except Exception as e:
+            state["error"] = e
+        state["finished"] = True
+
+    def poll():
+        if state["total"]:
+            bar.set(state["done"] / state["total"])
+        if not state["finished"]:
+            win.after(100, poll)
+            return
+
+        win.destroy()
+        if state["error"] is not None:
+            messagebox.showerror(f"{title} Error", f"{title} failed:\n{state['error']}")
+        else:
+            on_success(state["result"])
+
+    threading.Thread(target=run, name=title, daemon=True).start()
+    win.after(100, poll)
+
+
+def backup_database(codec=None):
     """
     Create a timestamped backup of elnajah.db in a 'backups' folder.
+
+    The copy is made by BackupCatalog.backup() on a background thread, so
+    the app stays usable (and can keep saving) meanwhile. It's recorded in
+    the folder's catalog, and backups retention no longer keeps are deleted.
     """
     db_file = _db_path()
     if not os.path.exists(db_file):
         messagebox.showerror("Error", f"Database file not found:\n{db_file}")
         return
+    catalog = _catalog()
+    if catalog is None:
+        return
+
+    def done(entry):
+        messagebox.showinfo(
+            "Backup Complete",
+            f"Database backed up to:\n{catalog.path(entry.name)}\n\n{_entry_label(entry)}"
+        )
 
-    os.makedirs("backups", exist_ok=True)
-    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    backup_name = f"elnajah_backup_{timestamp}.db"
-    dest = os.path.join("backups", backup_name)
+    _run_in_background(
+        "Backup",
+        "Compressing database..." if codec else "Backing up database...",
+        lambda progress: catalog.backup(codec=codec, progress=progress),
+        done,
+    )
 
-    try:
-        shutil.copy2(db_file, dest)
-    except Exception as e:
-        messagebox.showerror("Backup Error", f"Could not back up database:\n{e}")
-        return
 
-    messagebox.showinfo("Backup Complete", f"Database backed up to:\n{dest}")
+def _hot_restore(text, prepare, what):
+    """
+    Restore a backup into the running app with DB.restore().
+
+    On a background thread: call prepare(progress), which returns (path of
+    the database file to restore, whether it is a temporary file to delete
+    afterwards), take a safety snapshot of the current data and copy the
+    file into the live database in one transaction. Then refresh the open
+    windows in place; no restart needed.
+    """
+    def work(progress):
+        src_path, temporary = prepare(progress)
+        try:
+            safety = BackupStore().snapshot(progress=progress)
+            # Temporary files were just rebuilt and checked by backup_store.
+            restore(src_path, progress=progress, verify=not temporary)
+        finally:
+            if temporary and os.path.exists(src_path):
+                os.remove(src_path)
+        return safety
+
+    def done(safety):
+        if refresh_after_restore is not None:
+            refresh_after_restore()
+        elif refresh_treeview_all is not None:
+            refresh_treeview_all()
+        messagebox.showinfo(
+            "Restore Complete",
+            f"{what.capitalize()} restored successfully.\n\n"
+            f"The data from before the restore was saved as snapshot {safety.name} "
+            "(Backup > Restore Snapshot)."
+        )
+
+    _run_in_background("Restore", text, work, done)
+
+
+def backup_database_compressed():
+    """
+    Create a timestamped, compressed (.db.xz) backup in the 'backups' folder.
+
+    Slower than backup_database() but several times smaller; streamed on a
+    background thread with flat memory use (see backup_store).
+    """
+    backup_database(codec=DEFAULT_CODEC)
 
 
 def restore_backup():
     """
-    Restore a backup into elnajah.db.
+    Restore a backup into elnajah.db while the app keeps running.
 
-    WARNING: This overwrites the current DB; user will be prompted.
+    The picker lists the backup catalog; Browse... restores any other file.
+    WARNING: This replaces the current data; user will be prompted. A
+    snapshot of the current data is taken first (see _hot_restore).
     """
-    root = _root()
+    catalog = _catalog()
+    if catalog is None:
+        return
+    entries = catalog.entries()
+    # The picker maps its text back to a file, so backups that would read
+    # the same (same minute, size and student count) also show their name.
+    texts = [_entry_label(e) for e in entries]
+    repeated = {t for t, n in Counter(texts).items() if n > 1}
+    labels = {
+        (f"{t}  [{e.name}]" if t in repeated else t): e.name
+        for t, e in zip(texts, entries)
+    }
+
+    dlg = ctk.CTkToplevel(_root())
+    dlg.title("Restore Database")
+    dlg.geometry("460x180")
+    dlg.grab_set()
+    dlg.focus_force()
+
+    ctk.CTkLabel(
+        dlg,
+        text="Choose backup to restore:" if labels else "No backups in the catalog yet.",
+        font=("Arial", 14),
+    ).pack(pady=(16, 8))
+    choice = ctk.StringVar(value=next(iter(labels), ""))
+    if labels:
+        ctk.CTkOptionMenu(dlg, variable=choice, values=list(labels), width=400).pack(pady=4)
+
+    def handle_ok():
+        name = labels[choice.get()]
+        if not _confirm_restore(name):
+            return
+        dlg.destroy()
+
+        def prepare(progress):
+            catalog.verify(name)
+            return _prepare_backup_file(catalog.path(name), progress)
+
+        _hot_restore("Restoring backup...", prepare, "backup")
+
+    def handle_browse():
+        dlg.destroy()
+        _restore_other_file()
+
+    btn_frame = ctk.CTkFrame(dlg, fg_color="transparent")
+    btn_frame.pack(pady=12)
+    if labels:
+        ctk.CTkButton(btn_frame, text="Restore", command=handle_ok, fg_color="#3B82F6").pack(side="left", padx=4)
+    ctk.CTkButton(btn_frame, text="Browse...", command=handle_browse).pack(side="left", padx=4)
+    ctk.CTkButton(btn_frame, text="Cancel", command=dlg.destroy).pack(side="left", padx=4)
+
+
+def _confirm_restore(backup_name):
+    return messagebox.askyesno(
+        "Confirm Restore",
+        "Restoring this backup will replace all current data.\n\n"
+        f"Backup: {backup_name}\n\n"
+        "A snapshot of the current data is taken first.\n"
+        "Continue?"
+    )
+
+
+def _prepare_backup_file(path, progress):
+    """prepare() for _hot_restore: a .db file as is, a compressed one unpacked."""
+    if not compressed_codec(path):
+        return path, False
+    # Decompress next to the live file first, so a damaged archive
+    # never touches the current database.
+    tmp_path = _db_path() + ".restore-tmp"
+    restore_compressed_backup(path, tmp_path, progress=progress)
+    return tmp_path, True
+
+
+def _restore_other_file():
+    """Restore a backup file picked from disk (not necessarily in the catalog)."""
     initial_dir = os.path.abspath("backups") if os.path.isdir("backups") else os.getcwd()
 
     filename = filedialog.askopenfilename(
-        parent=root,
+        parent=_root(),
         title="Select Backup File",
         initialdir=initial_dir,
-        filetypes=[("DB Files", "*.db"), ("All Files", "*.*")],
+        filetypes=[
+            ("Backups", "*.db *.db.xz *.db.gz"),
+            ("DB Files", "*.db"),
+            ("Compressed Backups", "*.db.xz *.db.gz"),
+            ("All Files", "*.*"),
+        ],
     )
-    if not filename:
+    if not filename or not _confirm_restore(filename):
         return
 
-    if not messagebox.askyesno(
-        "Confirm Restore",
-        "Restoring this backup will overwrite the current database file.\n\n"
-        f"Backup: {filename}\n\n"
-        "You should close and restart the application after restoring.\n"
-        "Continue?"
-    ):
-        return
+    _hot_restore(
+        "Restoring backup...",
+        lambda progress: _prepare_backup_file(filename, progress),
+        "backup",
+    )
 
-    db_file = _db_path()
+
+def take_snapshot():
+    """
+    Add an incremental snapshot of the database to backups/store.
+
+    Only pages changed since earlier snapshots are stored (see backup_store),
+    so this is cheap enough to run often.
+    """
     try:
-        shutil.copy2(filename, db_file)
+        store = BackupStore()
     except Exception as e:
-        messagebox.showerror("Restore Error", f"Could not restore backup:\n{e}")
+        messagebox.showerror("Snapshot Error", f"Could not open the backup store:\n{e}")
         return
 
-    messagebox.showinfo(
-        "Restore Complete",
-        "Backup restored successfully.\n\n"
-        "Please CLOSE and RESTART the application now."
-    )
+    def done(snap):
+        messagebox.showinfo(
+            "Snapshot Complete",
+            f"Snapshot {snap.name} saved.\n"
+            f"New data stored: {snap.new_pages * snap.page_size / 1e6:.1f} MB "
+            f"(database: {snap.db_size / 1e6:.1f} MB)."
+        )
 
+    _run_in_background("Snapshot", "Taking snapshot...", store.snapshot, done)
 
-def purge_old_backups():
+
+def restore_snapshot():
     """
-    Delete old backup files, keeping only the N most recent in 'backups'.
+    Rebuild a snapshot from backups/store and restore it into elnajah.db
+    while the app keeps running.
     """
-    if not os.path.isdir("backups"):
-        messagebox.showinfo("No Backups", "The 'backups' folder does not exist.")
+    try:
+        store = BackupStore()
+        snapshots = store.snapshots()
+    except Exception as e:
+        messagebox.showerror("Snapshot Error", f"Could not open the backup store:\n{e}")
         return
-
-    keep_str = simpledialog.askstring(
-        "Purge Backups",
-        "Keep how many most recent backups? (default: 5)",
-        parent=_root(),
-    )
-    if keep_str is None:
+    if not snapshots:
+        messagebox.showinfo("No Snapshots", "No snapshots have been taken yet.")
         return
 
-    keep_str = keep_str.strip()
-    if not keep_str:
-        keep_n = 5
-    else:
-        try:
-            keep_n = max(1, int(keep_str))
-        except ValueError:
-            messagebox.showerror("Invalid Number", "Please enter a valid integer.")
+    labels = {
+        f"{s.name}  ({s.db_size / 1e6:.1f} MB)": s.name for s in snapshots
+    }
+    dlg = ctk.CTkToplevel(_root())
+    dlg.title("Restore Snapshot")
+    dlg.geometry("380x180")
+    dlg.grab_set()
+    dlg.focus_force()
+
+    ctk.CTkLabel(dlg, text="Choose snapshot to restore:", font=("Arial", 14)).pack(pady=(16, 8))
+    choice = ctk.StringVar(value=next(iter(labels)))
+    ctk.CTkOptionMenu(dlg, variable=choice, values=list(labels), width=300).pack(pady=4)
+
+    def handle_ok():
+        name = labels[choice.get()]
+        if not messagebox.askyesno(
+            "Confirm Restore",
+            "Restoring this snapshot will replace all current data.\n\n"
+            f"Snapshot: {name}\n\n"
+            "A snapshot of the current data is taken first.\n"
+            "Continue?"
+        ):
             return
+        dlg.destroy()
 
-    backups = []
-    for fname in os.listdir("backups"):
-        path = os.path.join("backups", fname)
-        if os.path.isfile(path):
-            backups.append((path, os.path.getmtime(path)))
+        def prepare(progress):
+            tmp_path = os.path.join(store.root, "restore.tmp.db")
+            store.restore(name, tmp_path, progress=progress)
+            return tmp_path, True
 
-    if len(backups) <= keep_n:
-        messagebox.showinfo("No Purge Needed", "There are not enough backups to purge.")
-        return
+        _hot_restore("Restoring snapshot...", prepare, "snapshot")
 
-    backups.sort(key=lambda x: x[1], reverse=True)
-    to_keep = backups[:keep_n]
-    to_delete = backups[keep_n:]
+    btn_frame = ctk.CTkFrame(dlg, fg_color="transparent")
+    btn_frame.pack(pady=12)
+    ctk.CTkButton(btn_frame, text="Restore", command=handle_ok, fg_color="#3B82F6").pack(side="left", padx=4)
+    ctk.CTkButton(btn_frame, text="Cancel", command=dlg.destroy).pack(side="left", padx=4)
 
-    for path, _ in to_delete:
-        try:
-            os.remove(path)
-        except Exception:
-            continue
 
-    messagebox.showinfo(
-        "Purge Complete",
-        f"Kept {len(to_keep)} backups.\nDeleted {len(to_delete)} old backup(s)."
+def purge_old_backups():
+    """
+    Apply the retention policy to the 'backups' folder.
+
+    Backups are pruned as new ones are made; this also indexes backup
+    files the catalog doesn't know yet (e.g. made by an older version),
+    forgets deleted ones, and prunes whatever the policy no longer keeps.
+    """
+    if not os.path.isdir("backups"):
+        messagebox.showinfo("No Backups", "The 'backups' folder does not exist.")
+        return
+    catalog = _catalog()
+    if catalog is None:
+        return
+
+    policy = "\n".join(
+        f"  {tier}: {keep}" for tier, keep in DEFAULT_RETENTION.items()
     )
+    if not messagebox.askyesno(
+        "Purge Backups",
+        "Keep these backups and delete the rest?\n\n"
+        f"{policy}\n\n"
+        "('last': the newest ones; the others: the newest backup of each of\n"
+        "the last N hours/days/weeks/months that have one.)"
+    ):
+        return
+
+    def done(result):
+        added, forgotten, pruned = result
+        messagebox.showinfo(
+            "Purge Complete",
+            f"Kept {len(catalog.entries())} backups.\n"
+            f"Deleted {pruned} old backup(s).\n"
+            f"Newly indexed: {added}; missing files forgotten: {forgotten}."
+        )
+
+    _run_in_background("Purge", "Indexing backups...", catalog.sync, done)
 
 
 # ---------------------------------------------------------------------------
@@ -593,12 +783,13 @@ def export_all_students_excel():
 
     ws.append(["ID", "Name", "Join Date", "Groups"])
 
+    try:
+        groups_by_id = get_groups_for_students(stu.id for stu in students)
+    except DBError:
+        groups_by_id = {}
+
     for stu in students:
-        try:
-            groups_list = get_student_groups(stu.id)
-        except DBError:
-            groups_list = []
-        groups_str = ", ".join(groups_list)
+        groups_str = ", ".join(groups_by_id.get(stu.id, []))
         ws.append([stu.id, stu.name, stu.join_date, groups_str])
 
     os.makedirs("exports", exist_ok=True)
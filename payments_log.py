@@ -18,6 +18,7 @@ from tkinter import ttk, messagebox
 from datetime import datetime, date
 import os
 import json
+import sqlite3
 
 from reportlab.lib.pagesizes import A4, landscape
 from reportlab.pdfgen import canvas
@@ -25,13 +26,14 @@ from reportlab.pdfgen import canvas
 from DB import (
     DBError,
     NotFoundError,
+    PaymentMatrixRow,
     get_student,
     get_student_groups,
     get_all_groups,
-    get_all_students,
-    get_group_students,
+    get_payment_matrix,
     get_payments_for_student_academic_year,
     upsert_payments_bulk,
+    change_token,
 )
 
 # ---------------------------------------------------------------------------
@@ -48,9 +50,16 @@ MONTH_COLS = [
     "Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul"
 ]
 
+# Cell text per payment status; months with no record stay blank
+_CELL_TEXT = {"paid": "Paid", "unpaid": "Unpaid"}
+
 # Preferences file to remember last selected academic year/group
 PREFS_PATH = os.path.join(os.path.dirname(__file__), "payments_history_prefs.json")
 
+# (window, reload function) for every history window opened so far;
+# see refresh_open_windows()
+_history_windows = []
+
 
 # ---------------------------------------------------------------------------
 # Utility helpers
@@ -146,54 +155,23 @@ def save_prefs(academic_label: str, group_name: str) -> None:
 # Data loader for history view
 # ---------------------------------------------------------------------------
 
-def load_history_rows(academic_start_year: int, group_name: str | None) -> list[dict]:
+def load_history_rows(academic_start_year: int, group_name: str | None) -> list[PaymentMatrixRow]:
     """
     Load rows for the history table.
 
-    Returns list of dicts:
-        {
-            "student": Student dataclass,
-            "groups": "G1, G2, ...",
-            "cells": [text_for_Aug, ..., text_for_Jul]
-        }
+    Returns DB.PaymentMatrixRow records (id, name, join_date, groups, months)
+    straight from a single DB.get_payment_matrix() query; use history_cells()
+    to turn a row's months into display text.
     """
-    if group_name and group_name != "All":
-        students = get_group_students(group_name)
-    else:
-        students = get_all_students(order_by="name")
+    if not group_name or group_name == "All":
+        group_name = None
 
-    months_spec = months_for_academic_year(academic_start_year)
-    rows: list[dict] = []
+    return get_payment_matrix(academic_start_year, group_name)
 
-    for stu in students:
-        try:
-            groups_list = get_student_groups(stu.id)
-            groups_str = ", ".join(groups_list)
-        except DBError:
-            groups_str = ""
-
-        payments = get_payments_for_student_academic_year(stu.id, academic_start_year)
-        pay_map = {(p.year, p.month): p for p in payments}
-
-        cells: list[str] = []
-        for (py, pm, _label) in months_spec:
-            p = pay_map.get((py, pm))
-            if p:
-                if p.paid == "paid":
-                    cell_text = f"Paid"
-                else:
-                    cell_text = "Unpaid"
-            else:
-                cell_text = ""  # no record
-            cells.append(cell_text)
 
-        rows.append({
-            "student": stu,
-            "groups": groups_str,
-            "cells": cells,
-        })
-
-    return rows
+def history_cells(row: PaymentMatrixRow) -> list[str]:
+    """Display text for a history row's 12 months (Aug..Jul)."""
+    return [_CELL_TEXT.get(status, "") for status in row.months]
 
 
 # ---------------------------------------------------------------------------
@@ -414,15 +392,11 @@ def export_history_pdf(academic_label: str, group_name: str | None) -> None:
             y = height - margin_y
             c.setFont("Helvetica", 8)
 
-        stu = row["student"]
-        groups_str = row["groups"]
-        cells = row["cells"]
-
-        c.drawString(x_positions[0], y, str(stu.id))
-        c.drawString(x_positions[1], y, stu.name[:24])
-        c.drawString(x_positions[2], y, groups_str[:26])
+        c.drawString(x_positions[0], y, str(row.id))
+        c.drawString(x_positions[1], y, row.name[:24])
+        c.drawString(x_positions[2], y, row.groups[:26])
 
-        for idx, val in enumerate(cells):
+        for idx, val in enumerate(history_cells(row)):
             if val.startswith("Paid"):
                 txt = "P"
             elif val == "Unpaid":
@@ -538,23 +512,42 @@ def open_history_window(root: ctk.CTk | None = None) -> None:
     bottom_frame = ctk.CTkFrame(win, fg_color="transparent")
     bottom_frame.pack(side="bottom", fill="x", padx=12, pady=(4, 10))
 
-    def refresh_tree():
-        # Clear
-        for item in tree.get_children():
-            tree.delete(item)
+    # (filters, DB change token) the tree was last filled with
+    shown_for = None
 
+    def refresh_tree():
+        nonlocal shown_for
         start_year = parse_academic_label(academic_year_var.get())
         g_name = group_var.get()
+
         try:
+            # Nothing to redo if neither the filters nor the data changed
+            current = ((start_year, g_name), change_token())
+            if current == shown_for:
+                return
+            shown_for = None
+
+            # Clear
+            for item in tree.get_children():
+                tree.delete(item)
+
             rows = load_history_rows(start_year, g_name if g_name != "All" else None)
-        except DBError as e:
+        except (DBError, sqlite3.Error) as e:
             messagebox.showerror("DB Error", str(e))
             return
 
         for row in rows:
-            stu = row["student"]
-            vals = [stu.id, stu.name, row["groups"]] + row["cells"]
+            vals = [row.id, row.name, row.groups] + history_cells(row)
             tree.insert("", "end", values=vals)
+        shown_for = current
+
+    def reload():
+        """Re-read the group list and the tree (the data changed underneath)."""
+        values = ["All"] + get_all_groups()
+        if group_var.get() not in values:
+            group_var.set("All")
+        group_menu.configure(values=values)
+        refresh_tree()
 
     def on_edit_selected():
         sel = tree.selection()
@@ -594,10 +587,23 @@ def open_history_window(root: ctk.CTk | None = None) -> None:
     year_menu.configure(command=lambda _value: refresh_tree())
     group_menu.configure(command=lambda _value: refresh_tree())
 
+    _history_windows.append((win, reload))
+
     # Initial load
     refresh_tree()
 
 
+def refresh_open_windows() -> None:
+    """
+    Reload every open Payments History window, e.g. after a restore
+    replaced the whole database.
+    """
+    global _history_windows
+    _history_windows = [(w, fn) for w, fn in _history_windows if w.winfo_exists()]
+    for _win, reload in _history_windows:
+        reload()
+
+
 # Backwards-compatible name used by your main file's history button
 def open_full_window():
     """
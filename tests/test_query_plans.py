@@ -0,0 +1,152 @@
+"""
+Every hot query in DB.py must be answered from an index.
+
+Each case calls a DB function on a small fresh database, captures the
+statements it runs (with their parameters bound) and checks their
+EXPLAIN QUERY PLAN: a table may only be SCANned (read in full, with or
+without an index) when the case says that query reads all of it anyway.
+"""
+
+from __future__ import annotations
+
+import re
+
+import pytest
+
+import DB
+
+# Plan lines that read a whole table or index, e.g. "SCAN s" or
+# "SCAN students USING COVERING INDEX idx_students_name_nocase".
+_SCAN = re.compile(r"^SCAN (\S+)(?: USING .*)?$")
+
+
+@pytest.fixture
+def school(tmp_path, monkeypatch):
+    monkeypatch.setattr(DB, "DB_PATH", str(tmp_path / "school.db"))
+    monkeypatch.setattr(DB, "MONTH_VIEW_CACHE_SIZE", 0)
+    DB.init_db()
+    ids = DB.create_students_bulk({"name": f"Student {i:03d}"} for i in range(60))
+    DB.add_students_to_group("Big", ids[:40])
+    DB.add_students_to_group("Small", ids[40:45])
+    for sid in ids[:30]:
+        DB.upsert_payment(sid, 2025, 1, "paid" if sid % 2 else "unpaid", "2025-01-05")
+        DB.upsert_payment(sid, 2024, 9, "paid", "2024-09-03")
+    yield ids
+    DB.close_connections()
+
+
+def _plans(fn) -> list[tuple[str, list[str]]]:
+    """Run fn and return (sql, plan lines) for every query it ran."""
+    conn = DB._get_conn()
+    statements: list[str] = []
+    conn.set_trace_callback(statements.append)
+    try:
+        fn()
+    finally:
+        conn.set_trace_callback(None)
+    return [
+        (sql, [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql)])
+        for sql in statements
+        if sql.lstrip().upper().startswith(("SELECT", "WITH"))
+    ]
+
+
+# (case, call(ids), tables/aliases the query may read in full)
+CASES = [
+    ("get_student", lambda ids: DB.get_student(ids[0]), set()),
+    ("get_all_students", lambda ids: DB.get_all_students(), {"students"}),
+    ("iter_all_students", lambda ids: list(DB.iter_all_students(page_size=10)), {"s"}),
+    ("get_student_groups", lambda ids: DB.get_student_groups(ids[0]), set()),
+    ("get_groups_for_students", lambda ids: DB.get_groups_for_students(ids[:5]), {"t"}),
+    ("get_group_students", lambda ids: DB.get_group_students("Small"), set()),
+    ("get_payment", lambda ids: DB.get_payment(ids[0], 2025, 1), set()),
+    ("get_payments_for_student", lambda ids: DB.get_payments_for_student(ids[0]), set()),
+    (
+        "get_payments_for_student_academic_year",
+        lambda ids: DB.get_payments_for_student_academic_year(ids[0], 2024),
+        set(),
+    ),
+    ("get_payment_matrix[group]", lambda ids: DB.get_payment_matrix(2024, "Small"), set()),
+    (
+        "get_students_with_payment_for_month[all]",
+        lambda ids: DB.get_students_with_payment_for_month(2025, 1),
+        {"s"},
+    ),
+    (
+        "get_students_with_payment_for_month[group]",
+        lambda ids: DB.get_students_with_payment_for_month(2025, 1, group_name="Small"),
+        set(),
+    ),
+    (
+        "get_students_with_payment_for_month[name]",
+        lambda ids: DB.get_students_with_payment_for_month(2025, 1, search_text="Student 01"),
+        {"sqlite_master"},
+    ),
+    (
+        "get_students_with_payment_for_month[id]",
+        lambda ids: DB.get_students_with_payment_for_month(
+            2025, 1, search_text=str(ids[0]), search_type="id"
+        ),
+        set(),
+    ),
+    (
+        "iter_students_with_payment_for_month",
+        lambda ids: list(DB.iter_students_with_payment_for_month(2025, 1, page_size=10)),
+        {"s"},
+    ),
+    ("get_unpaid_students_for_month[all]", lambda ids: DB.get_unpaid_students_for_month(2025, 1), {"s"}),
+    (
+        "get_unpaid_students_for_month[group]",
+        lambda ids: DB.get_unpaid_students_for_month(2025, 1, "Small"),
+        set(),
+    ),
+    ("get_payment_events", lambda ids: DB.get_payment_events(ids[0]), set()),
+    ("get_payments_as_of", lambda ids: DB.get_payments_as_of(2025, 1, "2100-01-01"), set()),
+    (
+        "get_unpaid_students_as_of",
+        lambda ids: DB.get_unpaid_students_as_of(2025, 1, "2100-01-01"),
+        {"s"},
+    ),
+    ("get_groupless_students", lambda ids: DB.get_groupless_students(), {"students"}),
+    ("find_duplicate_students", lambda ids: DB.find_duplicate_students(), {"students"}),
+    ("get_student_counts_by_group", lambda ids: DB.get_student_counts_by_group(), {"g"}),
+    ("get_payment_counts_for_month", lambda ids: DB.get_payment_counts_for_month(2025, 1), {"g"}),
+]
+
+
+@pytest.mark.parametrize("call, full_scans", [c[1:] for c in CASES], ids=[c[0] for c in CASES])
+def test_query_uses_index(school, call, full_scans):
+    plans = _plans(lambda: call(school))
+    assert plans, "no query was traced"
+    for sql, plan in plans:
+        for line in plan:
+            m = _SCAN.match(line)
+            if m is None:
+                continue
+            table = m.group(1)
+            if table.startswith(("temp.", "(")):
+                continue
+            assert table in full_scans, f"{line!r} in plan of:\n{sql}\nplan: {plan}"
+
+
+def test_hot_query_indexes_exist(school):
+    names = {
+        r[0] for r in DB._get_conn().execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+    }
+    assert {
+        "idx_student_group_group",
+        "idx_payments_year_month_paid",
+        "idx_students_name_nocase",
+    } <= names
+
+
+def test_init_db_runs_no_ddl_when_current(school):
+    conn = DB._get_conn()
+    statements: list[str] = []
+    conn.set_trace_callback(statements.append)
+    try:
+        DB.init_db()
+    finally:
+        conn.set_trace_callback(None)
+    ddl = [s for s in statements if re.match(r"\s*(CREATE|DROP|ALTER)\b", s, re.I)]
+    assert ddl == []